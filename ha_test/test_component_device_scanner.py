@@ -9,12 +9,22 @@ import unittest
 from datetime import datetime, timedelta
 import logging
 import os
+import io
+import shutil
+import json
+import socket
+import threading
+import time
 
 import homeassistant as ha
 import homeassistant.loader as loader
 from homeassistant.const import (
     STATE_HOME, STATE_NOT_HOME, ATTR_ENTITY_PICTURE, CONF_PLATFORM)
 import homeassistant.components.device_tracker as device_tracker
+import homeassistant.components.device_tracker.syslog as syslog
+import homeassistant.components.device_tracker.nmap_tracker as nmap_tracker
+import homeassistant.components.device_tracker.luci as luci
+import homeassistant.util as util
 
 from helpers import get_test_home_assistant
 
@@ -24,6 +34,93 @@ def setUpModule():   # pylint: disable=invalid-name
     logging.disable(logging.CRITICAL)
 
 
+class MockPushScanner(device_tracker.PushDeviceScanner):
+    """ Push scanner that counts the scans. """
+
+    def __init__(self):
+        super().__init__()
+        self.devices = []
+        self.scans = 0
+
+    def scan_devices(self):
+        """ Returns the connected devices. """
+        self.scans += 1
+        return list(self.devices)
+
+
+class MockScanner(object):
+    """ Scanner that can be made to fail or to wait before returning. """
+
+    def __init__(self, devices, error=False):
+        self.devices = devices
+        self.error = error
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def scan_devices(self):
+        """ Returns the connected devices. """
+        self.proceed.wait(5)
+
+        if self.error:
+            raise IOError("Router not reachable")
+
+        return list(self.devices)
+
+    def get_device_name(self, device):
+        """ Returns the name of the given device. """
+        return device.upper()
+
+
+class MockLuciSession(object):
+    """ Session that answers like a Luci router whose tokens expire. """
+
+    def __init__(self):
+        self.token = None
+        self.logins = 0
+
+    def request(self, method, url, params=None, data=None, **kwargs):
+        """ Answers a JSON RPC request. """
+        # pylint: disable=unused-argument
+        request = json.loads(data)
+
+        if url.endswith('/auth'):
+            self.logins += 1
+            self.token = 'token{}'.format(self.logins)
+
+            return MockLuciResponse(200, self.token)
+
+        if params is None or params.get('auth') != self.token:
+            return MockLuciResponse(403)
+
+        if request['method'] == 'net.arptable':
+            return MockLuciResponse(
+                200, [{'HW address': 'aa:bb:cc:dd:ee:01'}])
+
+        return MockLuciResponse(
+            200, {'cfg1': {'.type': 'host', 'mac': 'aa:bb:cc:dd:ee:01',
+                           'name': 'phone'}})
+
+    def expire_token(self):
+        """ Makes the router forget the token. """
+        self.token = None
+
+    def close(self):
+        """ Closes the session. """
+        pass
+
+
+class MockLuciResponse(object):
+    """ Response to a JSON RPC request. """
+
+    def __init__(self, status_code, result=None):
+        self.status_code = status_code
+        self.result = result
+
+    def json(self):
+        """ Returns the body. """
+        return {'result': self.result}
+
+
 class TestComponentsDeviceTracker(unittest.TestCase):
     """ Tests homeassistant.components.device_tracker module. """
 
@@ -67,6 +164,13 @@ class TestComponentsDeviceTracker(unittest.TestCase):
             self.hass, {device_tracker.DOMAIN: {CONF_PLATFORM: 'nonexisting'}}
         ))
 
+        # Test with a non-existing component in a second section
+        self.assertFalse(device_tracker.setup(self.hass, {
+            device_tracker.DOMAIN: {CONF_PLATFORM: 'test'},
+            '{} 2'.format(device_tracker.DOMAIN): {
+                CONF_PLATFORM: 'nonexisting'}
+        }))
+
         # Test with a bad known device file around
         with open(self.known_dev_path, 'w') as fil:
             fil.write("bad data\nbad data\n")
@@ -188,3 +292,379 @@ class TestComponentsDeviceTracker(unittest.TestCase):
         self.assertTrue(device_tracker.is_on(self.hass, dev1))
         self.assertFalse(device_tracker.is_on(self.hass, dev2))
         self.assertTrue(device_tracker.is_on(self.hass, dev3))
+
+    def test_push_scanner(self):
+        """ Test devices reported by a push scanner. """
+        with open(self.known_dev_path, 'w') as fil:
+            fil.write('device,name,track,picture\n')
+            fil.write('dev1,Device 1,1,\n')
+
+        scanner = MockPushScanner()
+        device_tracker.DeviceTracker(self.hass, scanner)
+        dev1 = device_tracker.ENTITY_ID_FORMAT.format('Device_1')
+
+        self.assertEqual(1, scanner.scans)
+        self.assertFalse(device_tracker.is_on(self.hass, dev1))
+
+        scanner.report('dev1', True)
+
+        self.assertTrue(device_tracker.is_on(self.hass, dev1))
+
+        # Ticks between reconciliations do not scan
+        now = datetime.now() + timedelta(minutes=1)
+        self.hass.bus.fire(ha.EVENT_TIME_CHANGED, {ha.ATTR_NOW: now})
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(1, scanner.scans)
+
+        # Reconciliation finds dev1 gone and unknown dev2
+        scanner.devices.append('dev2')
+        now += device_tracker.RECONCILE_INTERVAL
+        self.hass.bus.fire(ha.EVENT_TIME_CHANGED, {ha.ATTR_NOW: now})
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(2, scanner.scans)
+        self.assertFalse(device_tracker.is_on(self.hass, dev1))
+
+        with open(self.known_dev_path) as fil:
+            self.assertEqual('dev2,unknown_device,0,\n', list(fil)[-1])
+
+    def test_known_devices(self):
+        """ Test the known devices registry. """
+        with open(self.known_dev_path, 'w') as fil:
+            fil.write('device,name,track,picture\n')
+            fil.write('dev1,Device 1,1,\n')
+
+        known = device_tracker.KnownDevices(self.known_dev_path)
+
+        self.assertTrue(known.load())
+        self.assertFalse(known.changed_on_disk())
+        self.assertEqual('dev1', known.entity_ids['device_tracker.Device_1'])
+
+        # New devices are only written on flush
+        known.add('dev2', 'Device 2')
+
+        with open(self.known_dev_path) as fil:
+            self.assertEqual(2, len(list(fil)))
+
+        # Changes made by others are kept when we flush
+        with open(self.known_dev_path, 'a') as fil:
+            fil.write('dev3,Device 1,1,\n')
+
+        self.assertTrue(known.changed_on_disk())
+        self.assertTrue(known.flush())
+        self.assertFalse(known.changed_on_disk())
+        self.assertFalse(os.path.isfile(self.known_dev_path + '.tmp'))
+
+        with open(self.known_dev_path) as fil:
+            self.assertEqual(['dev1,Device 1,1,\n', 'dev3,Device 1,1,\n',
+                              'dev2,Device 2,0,\n'], list(fil)[1:])
+
+        self.assertEqual(
+            {'device_tracker.Device_1': 'dev1',
+             'device_tracker.Device_1_2': 'dev3'}, known.entity_ids)
+
+    def test_incremental_reload(self):
+        """ Test reloading only updates the devices that changed. """
+        with open(self.known_dev_path, 'w') as fil:
+            fil.write('device,name,track,picture\n')
+            fil.write('dev1,Device 1,1,\n')
+            fil.write('dev2,Device 2,1,\n')
+
+        scanner = MockScanner(['dev1', 'dev2', 'dev3'])
+        tracker = device_tracker.DeviceTracker(self.hass, scanner)
+        all_devices = self.hass.group_registry.groups[
+            device_tracker.ENTITY_ID_ALL_DEVICES]
+        dev1 = device_tracker.ENTITY_ID_FORMAT.format('Device_1')
+        dev2 = device_tracker.ENTITY_ID_FORMAT.format('Device_2')
+        dev3 = device_tracker.ENTITY_ID_FORMAT.format('Device_3')
+        dev2_state = self.hass.states.get(dev2)
+
+        with open(self.known_dev_path, 'w') as fil:
+            fil.write('device,name,track,picture\n')
+            fil.write('dev1,Device 1,0,\n')
+            fil.write('dev2,Device 2,1,\n')
+            fil.write('dev3,Device 3,1,http://example.com/dev3.jpg\n')
+
+        tracker.reload_known_devices()
+
+        self.assertIsNone(self.hass.states.get(dev1))
+        self.assertIs(dev2_state, self.hass.states.get(dev2))
+        self.assertTrue(device_tracker.is_on(self.hass, dev3))
+        self.assertEqual(
+            'http://example.com/dev3.jpg',
+            self.hass.states.get(dev3).attributes[ATTR_ENTITY_PICTURE])
+
+        # The group is updated instead of set up again
+        self.assertIs(all_devices, self.hass.group_registry.groups[
+            device_tracker.ENTITY_ID_ALL_DEVICES])
+        self.assertEqual({dev2, dev3}, set(all_devices.member_ids))
+        self.assertEqual(2, all_devices.on_count)
+
+    def test_multiple_scanners(self):
+        """ Test merging the results of multiple scanners. """
+        with open(self.known_dev_path, 'w') as fil:
+            fil.write('device,name,track,picture\n')
+            fil.write('dev1,Device 1,1,\n')
+            fil.write('dev2,Device 2,1,\n')
+
+        fast = device_tracker.ScannerSource(MockScanner(['dev1']))
+        slow = device_tracker.ScannerSource(MockScanner(['dev2']))
+        failing = device_tracker.ScannerSource(MockScanner([], True))
+
+        tracker = device_tracker.DeviceTracker(self.hass, fast, slow, failing)
+        dev1 = device_tracker.ENTITY_ID_FORMAT.format('Device_1')
+        dev2 = device_tracker.ENTITY_ID_FORMAT.format('Device_2')
+
+        self.assertTrue(device_tracker.is_on(self.hass, dev1))
+        self.assertTrue(device_tracker.is_on(self.hass, dev2))
+        self.assertEqual((1, 0), (fast.scans, fast.errors))
+        self.assertIsNotNone(fast.last_latency)
+        self.assertEqual(1, failing.error_rate)
+
+        # A slow scan does not hold up the other scanners
+        slow.scanner.proceed.clear()
+        slow.scanner.devices = []
+        now = datetime.now() + device_tracker.TIME_DEVICE_NOT_FOUND
+        slow_scan = threading.Thread(
+            target=tracker.scan_source, args=(slow, now))
+        slow_scan.start()
+
+        fast.scanner.devices = ['dev2']
+        later = now + timedelta(seconds=10)
+        self.hass.bus.fire(ha.EVENT_TIME_CHANGED, {ha.ATTR_NOW: later})
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(2, fast.scans)
+        self.assertEqual(1, slow.scans)
+        self.assertFalse(device_tracker.is_on(self.hass, dev1))
+        self.assertTrue(device_tracker.is_on(self.hass, dev2))
+
+        # The slow scan started before dev2 was seen so it is ignored
+        slow.scanner.proceed.set()
+        slow_scan.join(5)
+
+        self.assertEqual(2, slow.scans)
+        self.assertTrue(tracker.tracked['dev2']['present'])
+
+    def test_mac_address_case(self):
+        """ Test MAC addresses are merged regardless of their case. """
+        with open(self.known_dev_path, 'w') as fil:
+            fil.write('device,name,track,picture\n')
+            fil.write('aa:bb:cc:dd:ee:01,Phone,1,\n')
+
+        lower = device_tracker.ScannerSource(
+            MockScanner(['aa:bb:cc:dd:ee:01']))
+        upper = device_tracker.ScannerSource(
+            MockScanner(['AA:BB:CC:DD:EE:01', 'aa:bb:cc:dd:ee:02']))
+
+        tracker = device_tracker.DeviceTracker(self.hass, lower, upper)
+        phone = device_tracker.ENTITY_ID_FORMAT.format('Phone')
+
+        self.assertEqual(['AA:BB:CC:DD:EE:01'], list(tracker.tracked))
+        self.assertTrue(device_tracker.is_on(self.hass, phone))
+
+        with open(self.known_dev_path) as fil:
+            self.assertEqual(
+                ['aa:bb:cc:dd:ee:01,Phone,1,\n',
+                 'AA:BB:CC:DD:EE:02,AA:BB:CC:DD:EE:02,0,\n'],
+                list(fil)[1:])
+
+    def test_luci_token_expiry(self):
+        """ Test Luci authenticates again when its token expired. """
+        http_sessions = luci.HTTP_SESSIONS
+        luci.HTTP_SESSIONS = util.HTTPSessionPool(
+            session_factory=MockLuciSession)
+
+        try:
+            scanner = luci.LuciDeviceScanner({
+                'host': 'router', 'username': 'root', 'password': 'secret'})
+            router = luci.HTTP_SESSIONS.session('http://router/')
+
+            self.assertTrue(scanner.success_init)
+            self.assertEqual(1, router.logins)
+
+            router.expire_token()
+
+            self.assertEqual(
+                ['aa:bb:cc:dd:ee:01'], scanner.scan_devices())
+            self.assertEqual(2, router.logins)
+
+            router.expire_token()
+
+            self.assertEqual(
+                'phone', scanner.get_device_name('aa:bb:cc:dd:ee:01'))
+            self.assertEqual(3, router.logins)
+
+        finally:
+            luci.HTTP_SESSIONS = http_sessions
+
+    def test_syslog_scanner(self):
+        """ Test the syslog scanner reports devices. """
+        scanner = syslog.SyslogDeviceScanner(0, '127.0.0.1')
+        reports = []
+        scanner.listen(lambda *args: reports.append(args))
+
+        lines = [
+            'dnsmasq-dhcp[123]: DHCPACK(br-lan) 192.168.1.2 '
+            'aa:bb:cc:dd:ee:01 phone',
+            'dhcpd: DHCPACK on 192.168.1.3 to aa:bb:cc:dd:ee:02 (laptop) '
+            'via eth0',
+            'hostapd: wlan0: AP-STA-CONNECTED aa:bb:cc:dd:ee:03',
+            'kernel: unrelated message',
+            'hostapd: wlan0: STA aa:bb:cc:dd:ee:01 IEEE 802.11: '
+            'disassociated',
+        ]
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto('\n'.join(lines).encode(),
+                        ('127.0.0.1', scanner.port))
+
+        for _ in range(50):
+            if len(reports) == 4:
+                break
+            time.sleep(0.05)
+
+        scanner.stop()
+
+        self.assertEqual([
+            ('AA:BB:CC:DD:EE:01', True, 'phone'),
+            ('AA:BB:CC:DD:EE:02', True, 'laptop'),
+            ('AA:BB:CC:DD:EE:03', True, None),
+            ('AA:BB:CC:DD:EE:01', False, None),
+        ], reports)
+        self.assertEqual(['AA:BB:CC:DD:EE:02', 'AA:BB:CC:DD:EE:03'],
+                         sorted(scanner.scan_devices()))
+        self.assertEqual('phone', scanner.get_device_name('AA:BB:CC:DD:EE:01'))
+
+    def test_syslog_lease_expires(self):
+        """ Test a device only seen through DHCP leaves when its lease
+            expires. """
+        with open(self.known_dev_path, 'w') as fil:
+            fil.write('device,name,track,picture\n')
+            fil.write('AA:BB:CC:DD:EE:01,Phone,1,\n')
+            fil.write('AA:BB:CC:DD:EE:02,Laptop,1,\n')
+
+        scanner = syslog.SyslogDeviceScanner(0, '127.0.0.1', lease_time=0.2)
+        scanner.stop()
+
+        scanner.handle_line('dnsmasq-dhcp[123]: DHCPACK(br-lan) 192.168.1.2 '
+                            'aa:bb:cc:dd:ee:01 phone')
+        scanner.handle_line('hostapd: wlan0: AP-STA-CONNECTED '
+                            'aa:bb:cc:dd:ee:02')
+        scanner.handle_line('dnsmasq-dhcp[123]: DHCPACK(br-lan) 192.168.1.3 '
+                            'aa:bb:cc:dd:ee:02 laptop')
+
+        source = device_tracker.ScannerSource(scanner)
+        tracker = device_tracker.DeviceTracker(self.hass, source)
+        phone = device_tracker.ENTITY_ID_FORMAT.format('Phone')
+        laptop = device_tracker.ENTITY_ID_FORMAT.format('Laptop')
+
+        self.assertTrue(device_tracker.is_on(self.hass, phone))
+
+        time.sleep(0.3)
+
+        tracker.scan_source(
+            source, datetime.now() + device_tracker.TIME_DEVICE_NOT_FOUND)
+
+        self.assertFalse(device_tracker.is_on(self.hass, phone))
+        self.assertTrue(device_tracker.is_on(self.hass, laptop))
+
+    def test_nmap_parse(self):
+        """ Test the nmap tracker splits targets and parses results. """
+        self.assertEqual(
+            [['192.168.1.0/26', '10.0.0.1-20'], ['192.168.1.64/26'],
+             ['192.168.1.128/26'], ['192.168.1.192/26']],
+            nmap_tracker._split_targets('192.168.1.0/24,10.0.0.1-20', 4))
+
+        xml = io.BytesIO(b"""<?xml version="1.0"?>
+<nmaprun>
+<host><status state="up"/>
+<address addr="192.168.1.1" addrtype="ipv4"/>
+<address addr="AA:BB:CC:DD:EE:01" addrtype="mac"/>
+<hostnames><hostname name="router.lan" type="PTR"/></hostnames>
+</host>
+<host><status state="down"/>
+<address addr="192.168.1.2" addrtype="ipv4"/>
+</host>
+<host><status state="up"/>
+<address addr="192.168.1.3" addrtype="ipv4"/>
+<hostnames/>
+</host>
+</nmaprun>""")
+
+        self.assertEqual(
+            [('192.168.1.1', 'AA:BB:CC:DD:EE:01', 'router.lan'),
+             ('192.168.1.3', None, '192.168.1.3')],
+            list(nmap_tracker._parse_hosts(xml)))
+
+        arp_path = self.hass.get_config_path('arp')
+
+        with open(arp_path, 'w') as fil:
+            fil.write('IP address  HW type  Flags  HW address  Mask  Device\n')
+            fil.write('192.168.1.3  0x1  0x2  aa:bb:cc:dd:ee:03  *  eth0\n')
+            fil.write('192.168.1.4  0x1  0x0  00:00:00:00:00:00  *  eth0\n')
+
+        try:
+            self.assertEqual({'192.168.1.3': 'aa:bb:cc:dd:ee:03'},
+                             nmap_tracker._read_arp_table(arp_path))
+        finally:
+            os.remove(arp_path)
+
+    def test_nmap_reports_hosts_while_sweeping(self):
+        """ Test hosts are reported before nmap finished the sweep. """
+        bin_dir = self.hass.get_config_path('fake_nmap')
+        release_path = os.path.join(bin_dir, 'release')
+        os.makedirs(bin_dir, exist_ok=True)
+
+        with open(os.path.join(bin_dir, 'nmap'), 'w') as fil:
+            fil.write("""#!/bin/sh
+# Enough on stderr to fill a pipe
+head -c 300000 /dev/zero | tr '\\0' x >&2
+echo '<?xml version="1.0"?><nmaprun><host><status state="up"/>'
+echo '<address addr="192.168.1.1" addrtype="ipv4"/>'
+echo '<address addr="AA:BB:CC:DD:EE:01" addrtype="mac"/>'
+echo '<hostnames><hostname name="router.lan"/></hostnames></host>'
+while [ ! -e "{}" ]; do sleep 0.05; done
+echo '<host><status state="up"/>'
+echo '<address addr="192.168.1.2" addrtype="ipv4"/>'
+echo '<address addr="AA:BB:CC:DD:EE:02" addrtype="mac"/>'
+echo '<hostnames/></host></nmaprun>'
+""".format(release_path))
+
+        os.chmod(os.path.join(bin_dir, 'nmap'), 0o755)
+        path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + path
+
+        try:
+            scanner = nmap_tracker.NmapDeviceScanner(
+                {'hosts': '192.168.1.1/31'})
+            devices = []
+
+            for _ in range(50):
+                devices = scanner.scan_devices()
+
+                if devices:
+                    break
+
+                time.sleep(0.05)
+
+            self.assertEqual(['AA:BB:CC:DD:EE:01'], devices)
+            self.assertEqual('router.lan',
+                             scanner.get_device_name('AA:BB:CC:DD:EE:01'))
+
+            open(release_path, 'w').close()
+
+            for _ in range(50):
+                if not scanner._sweeping:
+                    break
+
+                time.sleep(0.05)
+
+            self.assertEqual(['AA:BB:CC:DD:EE:01', 'AA:BB:CC:DD:EE:02'],
+                             sorted(scanner.scan_devices()))
+
+        finally:
+            os.environ['PATH'] = path
+            open(release_path, 'w').close()
+            shutil.rmtree(bin_dir)
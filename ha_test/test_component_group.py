@@ -124,6 +124,105 @@ class TestComponentsGroup(unittest.TestCase):
         # Test that non strings are ignored
         self.assertEqual([], group.expand_entity_ids(self.hass, [5, True]))
 
+    def test_expand_nested_groups(self):
+        """ Test that nested groups are expanded and cycles are cut. """
+        group.setup_group(self.hass, 'nested',
+                          [self.group_name, 'switch.AC'])
+
+        self.assertEqual(
+            ['light.Bowl', 'light.Ceiling', 'switch.AC'],
+            group.expand_entity_ids(
+                self.hass, [group.ENTITY_ID_FORMAT.format('nested')]))
+
+        # A group that contains itself through another group
+        group.setup_group(self.hass, 'init_group',
+                          ['light.Bowl', group.ENTITY_ID_FORMAT.format(
+                              'nested')])
+
+        self.assertEqual(
+            ['light.Bowl', 'switch.AC'],
+            group.expand_entity_ids(self.hass, [self.group_name]))
+
+        group.remove_group(self.hass, 'nested')
+
+        self.assertEqual(
+            ['light.Bowl', 'group.nested'],
+            group.expand_entity_ids(self.hass, [self.group_name]))
+
+    def test_expand_cache(self):
+        """ Test that expansions are cached till membership changes. """
+        ent_ids = [self.group_name, 'light.Ceiling', self.mixed_group_name]
+
+        self.assertEqual(
+            ['light.Bowl', 'light.Ceiling', 'switch.AC'],
+            group.expand_entity_ids(self.hass, ent_ids))
+        self.assertIn(tuple(ent_ids),
+                      self.hass.group_registry.expand_cache)
+
+        self.hass.states.set('light.Kitchen', STATE_OFF)
+        group.setup_group(self.hass, 'mixed_group',
+                          ['light.Bowl', 'light.Kitchen'], False)
+
+        self.assertEqual({}, self.hass.group_registry.expand_cache)
+        self.assertEqual(
+            ['light.Bowl', 'light.Ceiling', 'light.Kitchen'],
+            group.expand_entity_ids(self.hass, ent_ids))
+
+        # Unhashable entity ids are ignored and not cached
+        self.assertEqual(
+            ['light.Bowl', 'light.Ceiling'],
+            group.expand_entity_ids(self.hass, [self.group_name, ['a']]))
+
+    def test_on_count(self):
+        """ Test that the group counts the members that are on. """
+        group_obj = self.hass.group_registry.groups[self.group_name]
+
+        self.assertEqual(1, group_obj.on_count)
+
+        self.hass.states.set('light.Ceiling', STATE_ON)
+        self.hass._pool.block_till_done()
+        self.hass.states.set('light.Ceiling', STATE_ON, {'brightness': 5})
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(2, group_obj.on_count)
+
+        self.hass.states.set('light.Bowl', STATE_OFF)
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(1, group_obj.on_count)
+        self.assertTrue(group.is_on(self.hass, self.group_name))
+
+    def test_state_changed_out_of_order(self):
+        """ Test that a stale state change does not override the current
+            state of a member. """
+        group_obj = self.hass.group_registry.groups[self.group_name]
+        stale = self.hass.states.get('light.Ceiling')
+
+        self.hass.states.set('light.Ceiling', STATE_ON)
+        self.hass._pool.block_till_done()
+
+        group_obj.state_changed('light.Ceiling', None, stale)
+
+        self.assertEqual(2, group_obj.on_count)
+
+    def test_groups_per_instance(self):
+        """ Test that groups of other instances are not expanded. """
+        other = ha.HomeAssistant()
+
+        try:
+            other.states.set('light.Bowl', STATE_ON)
+            group.setup_group(other, 'init_group', ['light.Bowl'], False)
+
+            self.assertEqual(
+                ['light.Bowl', 'light.Ceiling'],
+                group.expand_entity_ids(self.hass, [self.group_name]))
+            self.assertEqual(
+                ['light.Bowl'],
+                group.expand_entity_ids(other, [self.group_name]))
+
+        finally:
+            other.stop()
+
     def test_get_entity_ids(self):
         """ Test get_entity_ids method. """
         # Get entity IDs from our group
@@ -6,8 +6,11 @@ Tests Home Assistant HTTP component does what it should do.
 """
 # pylint: disable=protected-access,too-many-public-methods
 import re
+import os
 import unittest
 import json
+import time
+from http.client import HTTPConnection
 
 import requests
 
@@ -96,6 +99,141 @@ class TestHTTP(unittest.TestCase):
         # Test we cannot POST to /
         self.assertEqual(405, requests.post(_url("")).status_code)
 
+    def test_register_path(self):
+        """ Test registering a path from outside the handler. """
+
+        def handle_custom(handler, path_match, data):
+            """ Returns the matched name and the received data. """
+            # pylint: disable=protected-access
+            handler._write_json({'name': path_match.group('name'),
+                                 'data': data})
+
+        http.register_path(
+            'POST', re.compile(r'/api/custom/(?P<name>[a-z]+)'),
+            handle_custom)
+
+        req = requests.post(
+            _url("/api/custom/hello"), data=json.dumps({"test": 1}),
+            headers=HA_HEADERS)
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual(
+            {'name': 'hello', 'data': {'test': 1}}, req.json())
+
+        # Password is checked for custom API paths too
+        req = requests.post(_url("/api/custom/hello"))
+
+        self.assertEqual(401, req.status_code)
+
+        req = requests.get(_url("/api/custom/hello"), headers=HA_HEADERS)
+
+        self.assertEqual(405, req.status_code)
+
+    def test_route_table(self):
+        """ Test finding routes in the route table. """
+        routes = http.RouteTable([
+            ('GET', '/api/states', 'states'),
+            ('GET', re.compile(r'/api/states/(?P<entity_id>[a-z\.]+)'),
+             'state'),
+            ('POST', re.compile(r'/api/(?P<path>[a-z/]+)'), 'catch_all'),
+        ])
+
+        self.assertEqual(
+            ('states', '/api/states', True),
+            routes.match('GET', '/api/states'))
+
+        callback, path_match, _ = routes.match('GET', '/api/states/light.a')
+
+        self.assertEqual('state', callback)
+        self.assertEqual('light.a', path_match.group('entity_id'))
+
+        # Falls back to routes with a shorter literal prefix
+        self.assertEqual(
+            'catch_all', routes.match('POST', '/api/states/light.a')[0])
+        self.assertEqual(
+            (None, None, True), routes.match('DELETE', '/api/states/light'))
+        self.assertEqual(
+            (None, None, False), routes.match('GET', '/not_existing'))
+
+    def test_static_etag(self):
+        """ Test caching headers and compression of static files. """
+        with open(os.path.join(os.path.dirname(http.__file__),
+                               'www_static', 'favicon.ico'), 'rb') as inp:
+            content = inp.read()
+
+        req = requests.get(_url("/static/favicon.ico"),
+                           headers={'Accept-Encoding': 'identity'})
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual(content, req.content)
+
+        etag = req.headers['ETag']
+
+        req = requests.get(_url("/static/favicon.ico"),
+                           headers={'Accept-Encoding': 'identity',
+                                    'If-None-Match': etag})
+
+        self.assertEqual(304, req.status_code)
+        self.assertEqual(b'', req.content)
+
+        # The gzipped file has a different ETag
+        req = requests.get(_url("/static/favicon.ico"),
+                           headers={'Accept-Encoding': 'gzip',
+                                    'If-None-Match': etag})
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual('gzip', req.headers['Content-Encoding'])
+        self.assertEqual(content, req.content)
+        self.assertNotEqual(etag, req.headers['ETag'])
+
+    def test_keep_alive(self):
+        """ Test that multiple requests can use the same connection. """
+        conn = HTTPConnection("127.0.0.1", SERVER_PORT)
+
+        for path in (remote.URL_API, "/not-existing", remote.URL_API_STATES):
+            conn.request("GET", path, headers=HA_HEADERS)
+
+            resp = conn.getresponse()
+            resp.read()
+
+            self.assertEqual(11, resp.version)
+            self.assertIsNotNone(resp.getheader('Content-Length'))
+            self.assertFalse(resp.will_close)
+
+        conn.close()
+
+    def test_idle_connections_and_streams_free_threads(self):
+        """ Test that idle connections and streams do not take up the
+            threads of the server. """
+        conns = []
+        streams = []
+
+        for _ in range(http.HTTP_POOL_SIZE):
+            conn = HTTPConnection("127.0.0.1", SERVER_PORT, timeout=5)
+            conn.request("GET", remote.URL_API, headers=HA_HEADERS)
+            conn.getresponse().read()
+            conns.append(conn)
+
+            streams.append(requests.get(
+                _url(http.URL_API_STREAM), headers=HA_HEADERS,
+                stream=True, timeout=5))
+
+        req = requests.get(_url(remote.URL_API), headers=HA_HEADERS,
+                           timeout=5)
+
+        self.assertEqual(200, req.status_code)
+
+        # Idle connections can still be used
+        conns[0].request("GET", remote.URL_API, headers=HA_HEADERS)
+
+        self.assertEqual(200, conns[0].getresponse().status)
+
+        for conn in conns:
+            conn.close()
+
+        for stream in streams:
+            stream.close()
+
     def test_api_password(self):
         """ Test if we get access denied if we omit or provide
             a wrong api password. """
@@ -119,6 +257,53 @@ class TestHTTP(unittest.TestCase):
 
         self.assertEqual(hass.states.all(), remote_data)
 
+    def test_api_json_output(self):
+        """ Test compact, pretty and streamed JSON output. """
+        req = requests.get(_url(remote.URL_API_STATES), headers=HA_HEADERS)
+
+        self.assertNotIn('\n', req.text)
+
+        req = requests.get(_url(remote.URL_API_STATES),
+                           params={'pretty': 1}, headers=HA_HEADERS)
+
+        self.assertIn('\n    ', req.text)
+
+        # Stream the states in small chunks
+        old_size, http.JSON_STREAM_SIZE = http.JSON_STREAM_SIZE, 10
+
+        req = requests.get(_url(remote.URL_API_STATES), headers=HA_HEADERS)
+
+        http.JSON_STREAM_SIZE = old_size
+
+        self.assertEqual('chunked', req.headers['Transfer-Encoding'])
+        self.assertEqual(
+            hass.states.all(),
+            [ha.State.from_dict(item) for item in req.json()])
+
+    def test_api_get_states_since(self):
+        """ Test if the API returns the state changes since a version. """
+        version = hass.states.version
+
+        hass.states.set("test.since", "on")
+
+        req = requests.get(
+            _url(remote.URL_API_STATES), params={'since': version},
+            headers=HA_HEADERS)
+
+        data = req.json()
+
+        self.assertFalse(data['full'])
+        self.assertEqual(hass.states.version, data['version'])
+        self.assertEqual(
+            [hass.states.get("test.since")],
+            [ha.State.from_dict(item) for item in data['states']])
+
+        req = requests.get(
+            _url(remote.URL_API_STATES), params={'since': 'abcd'},
+            headers=HA_HEADERS)
+
+        self.assertEqual(422, req.status_code)
+
     def test_api_get_state(self):
         """ Test if the debug interface allows us to get a state. """
         req = requests.get(
@@ -323,6 +508,105 @@ class TestHTTP(unittest.TestCase):
 
         self.assertEqual(1, len(test_value))
 
+    def test_api_call_service_wait(self):
+        """ Test if the API waits for a service when asked to. """
+        test_value = []
+
+        def listener(service_call):   # pylint: disable=unused-argument
+            """ Slow service that records it has been executed. """
+            time.sleep(0.1)
+            test_value.append(1)
+
+        hass.services.register("test_domain", "slow_service", listener)
+
+        req = requests.post(
+            _url(remote.URL_API_SERVICES_SERVICE.format(
+                "test_domain", "slow_service")),
+            params={'wait': 1},
+            headers=HA_HEADERS)
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual(1, len(test_value))
+
+        # wait=false does not wait
+        req = requests.post(
+            _url(remote.URL_API_SERVICES_SERVICE.format(
+                "test_domain", "slow_service")),
+            params={'wait': 'false'},
+            headers=HA_HEADERS)
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual(1, len(test_value))
+
+        hass._pool.block_till_done()
+
+    def test_api_fire_event_bulk(self):
+        """ Test if the API allows us to fire a batch of events. """
+        test_value = []
+
+        def listener(event):   # pylint: disable=unused-argument
+            """ Helper method that will verify our event got called. """
+            test_value.append(event.data.get("test"))
+
+        hass.bus.listen("test.bulk_event", listener)
+
+        req = requests.post(
+            _url(remote.URL_API_EVENTS_BULK),
+            data=json.dumps({"events": [
+                {"event_type": "test.bulk_event"},
+                {"event_type": "test.bulk_event", "data": {"test": 1}}]}),
+            headers=HA_HEADERS)
+
+        hass._pool.block_till_done()
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual([1, None], sorted(test_value, key=str))
+
+        req = requests.post(
+            _url(remote.URL_API_EVENTS_BULK),
+            data=json.dumps({"events": [{"data": {}}]}),
+            headers=HA_HEADERS)
+
+        self.assertEqual(422, req.status_code)
+
+    def test_api_stream(self):
+        """ Test streaming events filtered by entity id. """
+        req = requests.get(
+            _url(http.URL_API_STREAM),
+            params={'entity_id': 'test.stream'},
+            headers=HA_HEADERS, stream=True, timeout=5)
+
+        self.assertEqual(200, req.status_code)
+        self.assertEqual(
+            'text/event-stream', req.headers['content-type'])
+
+        hass.states.set('test.not_streamed', 'on')
+        hass.states.set('test.stream', 'on')
+
+        lines = req.iter_lines(chunk_size=1, decode_unicode=True)
+
+        self.assertEqual(
+            'event: {}'.format(ha.EVENT_STATE_CHANGED), next(lines))
+
+        event = json.loads(next(lines)[len('data: '):])
+
+        self.assertEqual('test.stream', event['data']['entity_id'])
+        self.assertEqual('on', event['data']['new_state']['state'])
+
+        req.close()
+
+    def test_stream_drops_slow_subscriber(self):
+        """ Test that a subscriber with a full buffer is disconnected. """
+        stream = http.EventStream(hass, ['test_stream_event'])
+
+        for _ in range(http.STREAM_BUFFER_SIZE + 1):
+            hass.bus.fire('test_stream_event')
+
+        hass._pool.block_till_done()
+
+        self.assertTrue(stream.closed)
+        self.assertNotIn('test_stream_event', hass.bus.listeners)
+
     def test_api_event_forward(self):
         """ Test setting up event forwarding. """
 
@@ -7,6 +7,9 @@ Tests switch component.
 # pylint: disable=too-many-public-methods,protected-access
 import unittest
 import os
+import copy
+import time
+import threading
 
 import homeassistant as ha
 import homeassistant.loader as loader
@@ -15,10 +18,50 @@ from homeassistant.const import (
     ATTR_ENTITY_ID, STATE_ON, STATE_OFF, CONF_TYPE,
     SERVICE_TURN_ON, SERVICE_TURN_OFF)
 import homeassistant.components.light as light
+import homeassistant.components.light.hue as hue
 
 from helpers import mock_service, get_test_home_assistant
 
 
+class MockBridge(object):
+    """ Records the requests made to a Hue bridge. """
+
+    def __init__(self, lights=None, delay=0):
+        self.requests = []
+        self.lights = lights or {}
+        self.groups = {}
+        self.delay = delay
+
+    def get_api(self):
+        """ Returns the state of the lights after a delay. """
+        self.requests.append(('get_api',))
+        time.sleep(self.delay)
+        return {'lights': copy.deepcopy(self.lights)}
+
+    def set_light(self, light_id, command):
+        """ Records setting lights. """
+        self.requests.append(('set_light', light_id, command))
+
+    def get_group(self):
+        """ Returns the groups. """
+        self.requests.append(('get_group',))
+        return copy.deepcopy(self.groups)
+
+    def set_group(self, group_id, parameter, value=None):
+        """ Records setting a group. """
+        if value is None:
+            self.requests.append(('set_group', group_id, parameter))
+        else:
+            self.requests.append(('set_group', group_id, parameter, value))
+        return [{'success': {}}]
+
+    def create_group(self, name, lights):
+        """ Records creating a group. """
+        self.requests.append(('create_group', name, lights))
+        self.groups['3'] = {'name': name, 'lights': lights}
+        return [{'success': {'id': '3'}}]
+
+
 class TestLight(unittest.TestCase):
     """ Test the switch module. """
 
@@ -274,3 +317,91 @@ class TestLight(unittest.TestCase):
         self.assertEqual(
             {light.ATTR_XY_COLOR: [.4, .6], light.ATTR_BRIGHTNESS: 100},
             data)
+
+    def test_hue_batch(self):
+        """ Test Hue sends one request for a batch of lights. """
+        bridge = MockBridge({
+            light_id: {'name': light_id, 'state': {'on': False}}
+            for light_id in ('1', '2', '3')})
+        cache = hue.HueBridgeCache(bridge)
+        cache.refresh()
+        lights = cache.lights
+        bridge.requests.clear()
+
+        hue.HueLight.turn_on_many(list(lights.values()), brightness=100)
+        hue.HueLight.turn_off_many([lights['1'], lights['3']])
+        hue.HueLight.turn_on_many([lights['3'], lights['1']])
+
+        # A forced refresh right after the first one is throttled
+        cache._last_fetch = None
+        hue.HueLight.update_many(list(lights.values()))
+
+        on_command = {'on': True, 'bri': 100, 'alert': 'none'}
+
+        self.assertEqual([
+            ('set_group', 0, on_command),
+            ('get_group',),
+            ('create_group', hue.HUE_GROUP_NAME, ['1', '3']),
+            ('set_group', 3, {'on': False}),
+            ('set_group', 3, {'on': True, 'alert': 'none'}),
+            ('get_api',),
+        ], bridge.requests)
+
+        # After a restart the group is reused
+        cache = hue.HueBridgeCache(bridge)
+        cache.refresh()
+        lights = cache.lights
+        bridge.requests.clear()
+
+        hue.HueLight.turn_off_many([lights['1'], lights['2']])
+
+        self.assertEqual([
+            ('get_group',),
+            ('set_group', 3, 'lights', ['1', '2']),
+            ('set_group', 3, {'on': False}),
+        ], bridge.requests)
+
+    def test_hue_cache(self):
+        """ Test Hue fetches once and only updates changed lights. """
+        bridge = MockBridge({
+            light_id: {'name': light_id,
+                       'state': {'on': True, 'reachable': True,
+                                 'bri': 100, 'xy': [.4, .6]}}
+            for light_id in ('1', '2')}, 0.1)
+        cache = hue.HueBridgeCache(bridge)
+
+        threads = [threading.Thread(target=cache.refresh)
+                   for _ in range(3)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(bridge.requests))
+
+        light_1, light_2 = cache.lights['1'], cache.lights['2']
+        light_1.entity_id, light_2.entity_id = 'light.hue_1', 'light.hue_2'
+
+        hue.HueLight.update_many([light_1])
+        self.assertEqual(1, len(bridge.requests))
+
+        light_1.update_ha_state(self.hass)
+        light_2.update_ha_state(self.hass)
+
+        self.assertFalse(light_1.changed)
+
+        bridge.lights['2']['state']['on'] = False
+        cache._last_fetch = None
+
+        light_1.update_ha_state(self.hass)
+
+        self.assertEqual(2, len(bridge.requests))
+        self.assertFalse(light_1.changed)
+        self.assertTrue(light_2.changed)
+        self.assertEqual(STATE_ON, self.hass.states.get('light.hue_2').state)
+
+        light_2.update_ha_state(self.hass)
+
+        self.assertEqual(STATE_OFF, self.hass.states.get('light.hue_2').state)
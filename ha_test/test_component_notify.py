@@ -0,0 +1,115 @@
+"""
+ha_test.test_component_notify
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests notify component.
+"""
+# pylint: disable=too-many-public-methods,protected-access
+import unittest
+import json
+from time import sleep
+from datetime import time
+
+import homeassistant as ha
+import homeassistant.components.notify as notify
+
+
+class MockSession(object):
+    """ Records the posts made to Pushbullet. """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        """ Records a post and returns a succesful response. """
+        self.posts.append((url, kwargs))
+
+        return MockResponse()
+
+
+class MockResponse(object):
+    """ Successful Pushbullet response. """
+    # pylint: disable=too-few-public-methods
+    status_code = 200
+    text = ""
+
+
+class TestNotify(unittest.TestCase):
+    """ Test the notify module. """
+
+    def setUp(self):  # pylint: disable=invalid-name
+        self.hass = ha.HomeAssistant()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """ Stop down stuff we started. """
+        self.hass.stop()
+
+    def test_setup(self):
+        """ Test setup with missing configuration. """
+        self.assertFalse(notify.setup(self.hass, {}))
+        self.assertFalse(notify.setup(
+            self.hass, {notify.DOMAIN: {notify.CONF_API_KEYS: 'abc'}}))
+        self.assertFalse(notify.setup(
+            self.hass, {notify.DOMAIN: {
+                notify.CONF_API_KEYS: 'abc',
+                notify.CONF_ENTITY_IDS: 'light.bowl',
+                notify.CONF_QUIET_TIME_START: 'invalid',
+                notify.CONF_QUIET_TIME_END: '07,00'}}))
+
+    def test_in_quiet_time(self):
+        """ Test quiet time calculation. """
+        self.assertTrue(
+            notify._in_quiet_time(time(12, 0), time(10, 0), time(14, 0)))
+        self.assertFalse(
+            notify._in_quiet_time(time(15, 0), time(10, 0), time(14, 0)))
+
+        # Quiet time that spans midnight
+        self.assertTrue(
+            notify._in_quiet_time(time(23, 30), time(23, 0), time(7, 0)))
+        self.assertTrue(
+            notify._in_quiet_time(time(6, 0), time(23, 0), time(7, 0)))
+        self.assertFalse(
+            notify._in_quiet_time(time(12, 0), time(23, 0), time(7, 0)))
+
+    def test_notifier_coalesces(self):
+        """ Test that queued notifications are combined. """
+        notify.BATCH_DELAY, old_delay = 0.1, notify.BATCH_DELAY
+
+        session = MockSession()
+        notifier = notify.PushbulletNotifier(session, ['key1', 'key2'])
+
+        notifier.notify('light.living_room', 'on')
+        notifier.notify('device_tracker.paulus', 'home')
+        notifier.notify('light.living_room', 'off')
+        notifier.stop()
+        notifier.join(5)
+
+        notify.BATCH_DELAY = old_delay
+
+        self.assertEqual(2, len(session.posts))
+        self.assertEqual(
+            ('key1', ''), session.posts[0][1]['auth'])
+        self.assertEqual(
+            "Device Tracker: Paulus is Home\nLight: Living Room is Off",
+            json.loads(session.posts[0][1]['data'])['body'])
+
+    def test_notifier_batch_deadline(self):
+        """ Test that a steady stream of changes does not delay a note. """
+        notify.BATCH_DELAY, old_delay = 0.2, notify.BATCH_DELAY
+
+        session = MockSession()
+        notifier = notify.PushbulletNotifier(session, ['key1'])
+
+        for _ in range(12):
+            notifier.notify('light.living_room', 'on')
+            sleep(.05)
+
+        sent = len(session.posts)
+
+        notifier.stop()
+        notifier.join(5)
+
+        notify.BATCH_DELAY = old_delay
+
+        self.assertGreater(sent, 0)
@@ -8,11 +8,14 @@ Provides tests to verify that Home Assistant core works.
 # pylint: disable=too-few-public-methods
 import os
 import unittest
+import json
 import time
 import threading
+import asyncio
 from datetime import datetime
 
 import homeassistant as ha
+import homeassistant.util as util
 
 
 class TestHomeAssistant(unittest.TestCase):
@@ -119,11 +122,147 @@ class TestHomeAssistant(unittest.TestCase):
         self.assertEqual(2, len(specific_runs))
         self.assertEqual(3, len(wildcard_runs))
 
+    def test_track_time_change_between_events(self):
+        """ Test a time pattern that falls between two time events. """
+        runs = []
+
+        self.hass.track_time_change(lambda x: runs.append(x), second=[5])
+
+        self._send_time_changed(datetime(2014, 5, 24, 12, 0, 0))
+        self.hass._pool.block_till_done()
+        self.assertEqual(0, len(runs))
+        self.assertEqual(datetime(2014, 5, 24, 12, 0, 5),
+                         self.hass.scheduler.next_deadline)
+
+        # The scheduler is woken up by the Timer when an action is due
+        self.hass.scheduler.process(datetime(2014, 5, 24, 12, 0, 5))
+        self.hass._pool.block_till_done()
+        self.assertEqual(1, len(runs))
+
+        self._send_time_changed(datetime(2014, 5, 24, 12, 0, 10))
+        self.hass._pool.block_till_done()
+        self.assertEqual(1, len(runs))
+        self.assertEqual(datetime(2014, 5, 24, 12, 1, 5),
+                         self.hass.scheduler.next_deadline)
+
+    def test_track_time_change_minute_only(self):
+        """ Test a pattern without seconds fires once per time event. """
+        runs = []
+
+        self.hass.track_time_change(lambda x: runs.append(x), minute=[0, 15])
+
+        self._send_time_changed(datetime(2014, 5, 24, 11, 59, 50))
+        self.hass._pool.block_till_done()
+
+        # Wake up the scheduler every second of the matching minute
+        for second in range(60):
+            self.hass.scheduler.process(
+                datetime(2014, 5, 24, 12, 0, second))
+
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(60 // ha.TIMER_INTERVAL, len(runs))
+        self.assertEqual(datetime(2014, 5, 24, 12, 15, 0),
+                         self.hass.scheduler.next_deadline)
+
+    def test_next_time_match(self):
+        """ Test calculating the next time a pattern matches. """
+        # pylint: disable=protected-access
+        pmp = ha._process_match_param
+
+        def next_match(now, year=None, month=None, day=None,
+                       hour=None, minute=None, second=None):
+            """ Calculates next match for pattern. """
+            return ha._next_time_match(
+                now, pmp(year), pmp(month), pmp(day),
+                pmp(hour), pmp(minute), pmp(second))
+
+        now = datetime(2014, 5, 24, 12, 0, 15, 500)
+
+        self.assertEqual(datetime(2014, 5, 24, 12, 0, 30),
+                         next_match(now, second=[0, 30]))
+        self.assertEqual(datetime(2014, 5, 24, 12, 1, 10),
+                         next_match(now, second=10))
+        self.assertEqual(datetime(2014, 5, 25, 7, 0, 0),
+                         next_match(now, hour=7, minute=0, second=0))
+        self.assertEqual(datetime(2014, 12, 31, 0, 0, 0),
+                         next_match(now, month=12, day=31, hour=0,
+                                    minute=0, second=0))
+        self.assertEqual(datetime(2016, 2, 29, 0, 0, 0),
+                         next_match(now, month=2, day=29, hour=0,
+                                    minute=0, second=0))
+        self.assertIsNone(next_match(now, year=2013))
+        self.assertIsNone(next_match(now, month=2, day=30))
+
     def _send_time_changed(self, now):
         """ Send a time changed event. """
         self.hass.bus.fire(ha.EVENT_TIME_CHANGED, {ha.ATTR_NOW: now})
 
 
+class TestAsyncioHomeAssistant(unittest.TestCase):
+    """ Tests Home Assistant running on an asyncio event loop. """
+
+    def setUp(self):     # pylint: disable=invalid-name
+        """ things to be run when tests are started. """
+        self.hass = ha.HomeAssistant(use_asyncio=True)
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """ Stop down stuff we started. """
+        self.hass.stop()
+
+    def test_listeners_and_services(self):
+        """ Test sync and coroutine listeners and services. """
+        runs = []
+
+        @util.coroutine
+        def async_listener(event):
+            """ Coroutine listener. """
+            yield from asyncio.sleep(0)
+            runs.append(('async', event.event_type))
+
+        self.hass.bus.listen('test_event', async_listener)
+        self.hass.bus.listen('test_event', lambda event: runs.append('sync'))
+        self.hass.bus.listen_once('test_event', async_listener)
+
+        @util.coroutine
+        def async_service(call):
+            """ Coroutine service. """
+            yield from asyncio.sleep(0)
+            runs.append(('service', call.service))
+
+        self.hass.services.register('test_domain', 'test', async_service)
+
+        self.hass.bus.fire('test_event')
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(3, len(runs))
+        self.assertEqual(2, runs.count(('async', 'test_event')))
+        self.assertIn('sync', runs)
+
+        self.hass.services.call('test_domain', 'test')
+        self.hass._pool.block_till_done()
+
+        self.assertEqual(('service', 'test'), runs[-1])
+
+    def test_coroutine_in_thread_pool(self):
+        """ Test that coroutine listeners work without asyncio mode. """
+        hass = ha.HomeAssistant()
+        runs = []
+
+        @util.coroutine
+        def async_listener(event):
+            """ Coroutine listener. """
+            yield from asyncio.sleep(0)
+            runs.append(event.event_type)
+
+        hass.bus.listen('test_event', async_listener)
+        hass.bus.fire('test_event')
+        hass._pool.block_till_done()
+        hass.stop()
+
+        self.assertEqual(['test_event'], runs)
+
+
 class TestEvent(unittest.TestCase):
     """ Test Event class. """
     def test_repr(self):
@@ -187,6 +326,52 @@ class TestEventBus(unittest.TestCase):
         self.assertEqual(1, len(runs))
 
 
+    def test_listen_state_change(self):
+        """ Test the indexed state_changed listeners. """
+        runs = []
+        listener = lambda event: runs.append(event.data['entity_id'])
+
+        old_count = self.bus.listeners.get(ha.EVENT_STATE_CHANGED, 0)
+
+        self.bus.listen_state_change(
+            ['light.Bowl', 'light.Ceiling'], listener, 'off', 'on')
+
+        self.assertEqual(old_count + 1,
+                         self.bus.listeners[ha.EVENT_STATE_CHANGED])
+
+        def fire(entity_id, old_state, new_state):
+            """ Fire a state_changed event. """
+            self.bus.fire(ha.EVENT_STATE_CHANGED, {
+                'entity_id': entity_id,
+                'old_state': ha.State(entity_id, old_state),
+                'new_state': ha.State(entity_id, new_state)})
+            self.bus._pool.block_till_done()
+
+        fire('light.Bowl', 'off', 'on')
+        fire('light.Bowl', 'on', 'off')
+        fire('light.Kitchen', 'off', 'on')
+        fire('light.Ceiling', 'off', 'on')
+        self.assertEqual(['light.Bowl', 'light.Ceiling'], runs)
+
+        self.bus.remove_listener(ha.EVENT_STATE_CHANGED, listener)
+        self.assertEqual(old_count,
+                         self.bus.listeners.get(ha.EVENT_STATE_CHANGED, 0))
+
+        fire('light.Bowl', 'off', 'on')
+        self.assertEqual(2, len(runs))
+
+        # Repeated entity ids and states call the listener once
+        self.bus.listen_state_change(
+            ['light.Bowl', 'light.Bowl'], listener, ['off', 'off'], 'on')
+
+        fire('light.Bowl', 'off', 'on')
+        self.assertEqual(3, len(runs))
+
+        self.bus.remove_listener(ha.EVENT_STATE_CHANGED, listener)
+        self.assertEqual(old_count,
+                         self.bus.listeners.get(ha.EVENT_STATE_CHANGED, 0))
+
+
 class TestState(unittest.TestCase):
     """ Test EventBus methods. """
 
@@ -207,6 +392,38 @@ class TestState(unittest.TestCase):
                          str(ha.State("happy.happy", "on", {"brightness": 144},
                                       datetime(1984, 12, 8, 12, 0, 0))))
 
+    def test_immutable(self):
+        """ Test that a state cannot be changed. """
+        attributes = {"brightness": 144}
+        state = ha.State("happy.happy", "on", attributes)
+
+        with self.assertRaises(AttributeError):
+            state.state = "off"
+
+        with self.assertRaises(TypeError):
+            state.attributes["brightness"] = 100
+
+        # Changing the passed in dict should not change the state
+        attributes["brightness"] = 100
+        self.assertEqual(144, state.attributes["brightness"])
+
+    def test_as_json(self):
+        """ Test state.as_json """
+        state = ha.State("happy.happy", "on", {"brightness": 144})
+
+        self.assertEqual(state.as_dict(), json.loads(state.as_json()))
+        self.assertIs(state.as_json(), state.as_json())
+
+    def test_copy(self):
+        """ Test state.copy """
+        state = ha.State("happy.happy", "on", {"brightness": 144})
+
+        self.assertEqual(state, state.copy())
+        self.assertEqual("off", state.copy(state="off").state)
+        self.assertEqual({}, state.copy(attributes={}).attributes)
+        self.assertEqual(
+            state.last_changed, state.copy(state="off").last_changed)
+
 
 class TestStateMachine(unittest.TestCase):
     """ Test EventBus methods. """
@@ -239,6 +456,78 @@ class TestStateMachine(unittest.TestCase):
         self.assertEqual(1, len(ent_ids))
         self.assertTrue('light.Bowl' in ent_ids)
 
+    def test_domain_queries(self):
+        """ Test the per domain query methods. """
+        self.states.set("light.Kitchen", "off")
+
+        self.assertEqual(
+            ['on', 'off'],
+            [state.state for state in self.states.all('light')])
+        self.assertEqual([], self.states.all('sensor'))
+        self.assertEqual(
+            {'light': 2, 'switch': 1}, self.states.domain_counts())
+
+        self.assertEqual(
+            ['light.Bowl', 'light.Kitchen'],
+            self.states.entity_ids_matching('light.*'))
+        self.assertEqual(
+            ['light.Kitchen', 'switch.AC'],
+            sorted(self.states.entity_ids_matching('*.[KA]*')))
+        self.assertEqual([], self.states.entity_ids_matching('sensor.*'))
+
+        self.states.remove('light.Bowl')
+        self.states.remove('switch.AC')
+
+        self.assertEqual(['light.Kitchen'], self.states.entity_ids('light'))
+        self.assertEqual({'light': 1}, self.states.domain_counts())
+
+    def test_changes_since(self):
+        """ Test getting the changes since a version. """
+        version = self.states.version
+
+        self.states.set("light.Bowl", "off")
+        self.states.set("light.Kitchen", "on")
+        self.states.remove("switch.AC")
+
+        self.assertEqual(version + 3, self.states.version)
+        self.assertEqual(
+            version + 1, self.states.get("light.Bowl").version)
+
+        changes = self.states.changes_since(version)
+
+        self.assertFalse(changes['full'])
+        self.assertEqual(self.states.version, changes['version'])
+        self.assertEqual(
+            ['light.Bowl', 'light.Kitchen'],
+            sorted(state.entity_id for state in changes['states']))
+        self.assertEqual(['switch.AC'], changes['removed'])
+
+        changes = self.states.changes_since(version + 2)
+
+        self.assertEqual([], changes['states'])
+        self.assertEqual(['switch.AC'], changes['removed'])
+
+        # Unknown versions result in all states
+        for unknown in (0, self.states.version + 1):
+            changes = self.states.changes_since(unknown)
+
+            self.assertTrue(changes['full'])
+            self.assertEqual(2, len(changes['states']))
+
+    def test_get_does_not_copy(self):
+        """ Test that get and all return the stored states. """
+        state = self.states.get('light.Bowl')
+
+        self.assertIs(state, self.states.get('light.Bowl'))
+        self.assertIn(state, self.states.all())
+
+        # all returns a snapshot that is not affected by later changes
+        states = self.states.all()
+        self.states.set('light.Bowl', 'off')
+
+        self.assertIs(state, states[states.index(state)])
+        self.assertEqual('on', state.state)
+
     def test_remove(self):
         """ Test remove method. """
         self.assertTrue('light.Bowl' in self.states.entity_ids())
@@ -317,3 +606,36 @@ class TestServiceRegistry(unittest.TestCase):
         """ Test has_service method. """
         self.assertTrue(
             self.services.has_service("test_domain", "test_service"))
+
+    def test_call_blocking(self):
+        """ Test blocking service calls wait for the service. """
+        calls = []
+
+        def service(call):
+            """ Slow service that returns a result. """
+            time.sleep(0.1)
+            calls.append(call)
+            return call.data['value'] * 2
+
+        self.services.register("test_domain", "slow", service)
+
+        self.assertEqual(
+            42, self.services.call(
+                "test_domain", "slow", {'value': 21}, blocking=True))
+        self.assertEqual(1, len(calls))
+        self.assertNotIn(ha.ATTR_SERVICE_CALL_ID, calls[0].data)
+
+        self.assertRaises(
+            ha.ServiceCallTimeoutError, self.services.call,
+            "test_domain", "slow", {'value': 1}, True, 0.01)
+        self.assertEqual({}, self.services._pending_calls)
+
+        def broken(call):
+            """ Service that fails. """
+            raise ValueError(call.service)
+
+        self.services.register("test_domain", "broken", broken)
+
+        self.assertRaises(
+            ValueError, self.services.call,
+            "test_domain", "broken", blocking=True)
@@ -6,13 +6,17 @@ Tests component helpers.
 """
 # pylint: disable=protected-access,too-many-public-methods
 import unittest
+import logging
+import threading
+import time
 
-from helpers import get_test_home_assistant
+from helpers import get_test_home_assistant, MockToggleDevice
 
 import homeassistant as ha
 import homeassistant.loader as loader
 from homeassistant.const import STATE_ON, STATE_OFF, ATTR_ENTITY_ID
-from homeassistant.helpers import extract_entity_ids
+from homeassistant.helpers import (
+    extract_entity_ids, DeviceUpdater, ToggleDevice, turn_on_devices)
 
 
 class TestComponentsCore(unittest.TestCase):
@@ -47,3 +51,129 @@ class TestComponentsCore(unittest.TestCase):
 
         self.assertEqual(['light.Ceiling', 'light.Kitchen'],
                          extract_entity_ids(self.hass, call))
+
+    def test_turn_on_devices(self):
+        """ Test devices are turned on with a batch call per type. """
+        plain = MockToggleDevice('Plain', STATE_OFF)
+        batch_1 = BatchDevice('Batch 1', STATE_OFF)
+        batch_2 = BatchDevice('Batch 2', STATE_OFF)
+
+        turn_on_devices([batch_1, plain, batch_2], brightness=100)
+
+        self.assertEqual(
+            [(['Batch 1', 'Batch 2'], {'brightness': 100})],
+            BatchDevice.batches)
+        self.assertEqual(('turn_on', {'brightness': 100}), plain.last_call())
+
+
+class BatchDevice(MockToggleDevice):
+    """ Mock device that records batch calls. """
+    batches = []
+
+    @classmethod
+    def turn_on_many(cls, devices, **kwargs):
+        """ Records the batch. """
+        cls.batches.append(([device.name for device in devices], kwargs))
+
+
+class SlowDevice(ToggleDevice):
+    """ Device that takes a while to update. """
+
+    def __init__(self, entity_id, delay, tracker):
+        self.entity_id = entity_id
+        self.delay = delay
+        self.tracker = tracker
+        self.updates = 0
+
+    def is_on(self):
+        """ Sleeps while recording how many devices update at once. """
+        with self.tracker['lock']:
+            self.tracker['running'] += 1
+            self.tracker['max'] = max(
+                self.tracker['max'], self.tracker['running'])
+
+        time.sleep(self.delay)
+
+        with self.tracker['lock']:
+            self.tracker['running'] -= 1
+
+        self.updates += 1
+
+        return True
+
+
+class TestDeviceUpdater(unittest.TestCase):
+    """ Tests the DeviceUpdater. """
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """ Init needed objects. """
+        self.hass = get_test_home_assistant()
+        self.tracker = {'lock': threading.Lock(), 'running': 0, 'max': 0}
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """ Stop down stuff we started. """
+        self.hass.stop()
+
+    def test_update_concurrently(self):
+        """ Test devices are updated concurrently within the limit. """
+        devices = [SlowDevice('switch.slow_{}'.format(idx), 0.1,
+                              self.tracker)
+                   for idx in range(6)]
+
+        updater = DeviceUpdater(self.hass, devices,
+                                logging.getLogger(__name__),
+                                max_concurrent=3, timeout=5)
+
+        start = time.monotonic()
+        updater.update(wait=True)
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(3, self.tracker['max'])
+        self.assertEqual(
+            [STATE_ON] * 6,
+            [self.hass.states.get(device.entity_id).state
+             for device in devices])
+
+    def test_skip_busy_device(self):
+        """ Test a device is skipped while it is still being updated. """
+        slow = SlowDevice('switch.slow', 0.5, self.tracker)
+
+        logger = logging.getLogger(__name__)
+        updater = DeviceUpdater(self.hass, [slow], logger, timeout=0.1)
+
+        updater.update()
+        time.sleep(0.2)
+
+        updater.update()
+
+        self.assertEqual({id(slow)}, updater._hanging)
+
+        time.sleep(0.5)
+
+        self.assertEqual(1, slow.updates)
+        self.assertEqual(set(), updater._hanging)
+
+    def test_replace_hanging_worker(self):
+        """ Test a hanging device does not hold up its platform. """
+        hanging = SlowDevice('switch.hanging', 0.6, self.tracker)
+        fast = SlowDevice('switch.fast', 0, self.tracker)
+
+        updater = DeviceUpdater(self.hass, [hanging, fast],
+                                logging.getLogger(__name__),
+                                max_concurrent=1, timeout=0.1)
+
+        updater.update(wait=True)
+
+        self.assertEqual(0, fast.updates)
+
+        time.sleep(0.1)
+        updater.update()
+        time.sleep(0.1)
+
+        self.assertEqual(1, fast.updates)
+        self.assertEqual({id(hanging)}, updater._hanging)
+
+        time.sleep(0.4)
+
+        self.assertEqual(1, hanging.updates)
+        self.assertEqual(set(), updater._hanging)
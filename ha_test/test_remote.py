@@ -8,6 +8,7 @@ Uses port 8125 as a port that nothing runs on
 """
 # pylint: disable=protected-access,too-many-public-methods
 import unittest
+import json
 
 import homeassistant as ha
 import homeassistant.remote as remote
@@ -170,7 +171,31 @@ class TestRemoteMethods(unittest.TestCase):
         self.assertEqual(1, len(test_value))
 
         # Should not raise an exception
-        remote.call_service(broken_api, "test_domain", "test_service")
+        self.assertFalse(
+            remote.call_service(broken_api, "test_domain", "test_service"))
+
+    def test_call_service_blocking(self):
+        """ Test Python API services.call waiting for the service. """
+        test_value = []
+
+        def listener(service_call):   # pylint: disable=unused-argument
+            """ Records it has been executed. """
+            test_value.append(1)
+
+        def failing(service_call):   # pylint: disable=unused-argument
+            """ Service that fails. """
+            raise ValueError("Failed")
+
+        hass.services.register("test_domain", "blocking_service", listener)
+        hass.services.register("test_domain", "failing_service", failing)
+
+        self.assertTrue(remote.call_service(
+            master_api, "test_domain", "blocking_service", blocking=True))
+        self.assertEqual(1, len(test_value))
+
+        self.assertRaises(
+            ha.HomeAssistantError, remote.call_service,
+            master_api, "test_domain", "failing_service", blocking=True)
 
 
 class TestRemoteClasses(unittest.TestCase):
@@ -209,6 +234,21 @@ class TestRemoteClasses(unittest.TestCase):
         self.assertEqual("remote.statemachine test",
                          slave.states.get("remote.test").state)
 
+    def test_statemachine_sync(self):
+        """ Tests if changes that were not forwarded are synced. """
+        hass.states.set("remote.sync_test", "on")
+        hass._pool.block_till_done()
+        slave._pool.block_till_done()
+
+        self.assertIsNotNone(slave.states.get("remote.sync_test"))
+
+        # Removals are not forwarded as events
+        hass.states.remove("remote.sync_test")
+
+        self.assertTrue(slave.states.sync())
+        self.assertIsNone(slave.states.get("remote.sync_test"))
+        self.assertEqual(hass.states.version, slave.states.version)
+
     def test_eventbus_fire(self):
         """ Test if events fired from the eventbus get fired. """
         test_value = []
@@ -228,6 +268,78 @@ class TestRemoteClasses(unittest.TestCase):
 
         self.assertEqual(1, len(test_value))
 
+    def test_services_call_blocking(self):
+        """ Test a slave waiting for a service executed by the master. """
+        test_value = []
+
+        def listener(service_call):   # pylint: disable=unused-argument
+            """ Helper method that will verify our service got called. """
+            test_value.append(1)
+
+        hass.services.register("test_domain", "blocking_service", listener)
+
+        slave.services.call(
+            "test_domain", "blocking_service", blocking=True, timeout=5)
+
+        self.assertEqual(1, len(test_value))
+
+    def test_event_forwarder_retry(self):
+        """ Test that events for an unreachable target are kept. """
+        forwarder = remote.EventForwarder(hass)
+        forwarder.connect(broken_api)
+
+        hass.bus.fire("test.forward_event")
+        hass._pool.block_till_done()
+
+        stats = forwarder.stats["127.0.0.1:8125"]
+
+        self.assertEqual(1, stats['pending'])
+        self.assertEqual(0, stats['forwarded'])
+        self.assertEqual(remote.FORWARD_RETRY_DELAY, stats['retry_delay'])
+
+        self.assertTrue(forwarder.disconnect(broken_api))
+        self.assertEqual({}, forwarder.stats)
+
+    def test_forward_target_drops_oldest(self):
+        """ Test that a target drops events when it falls behind. """
+        target = remote.ForwardTarget(hass, broken_api)
+
+        # Pretend a batch is already being sent
+        target._sending = True
+
+        for index in range(remote.FORWARD_MAX_PENDING + 2):
+            target.add(ha.Event("test.forward_event", {"index": index}))
+
+        stats = target.stats
+
+        self.assertEqual(remote.FORWARD_MAX_PENDING, stats['pending'])
+        self.assertEqual(2, stats['dropped'])
+        self.assertEqual(2, target._queue[0][1].data["index"])
+
+        target.stop()
+
+    def test_forward_target_without_bulk(self):
+        """ Test events are sent one at a time to an API without the bulk
+            endpoint. """
+        old_api = MockOldAPI()
+        target = remote.ForwardTarget(hass, old_api)
+
+        target.add(ha.Event("test.forward_event", {"index": 0}))
+        hass._pool.block_till_done()
+
+        target.add(ha.Event("test.forward_event", {"index": 1}))
+        hass._pool.block_till_done()
+
+        self.assertEqual(2, target.stats['forwarded'])
+        self.assertEqual(0, target.stats['pending'])
+        self.assertEqual([
+            (remote.URL_API_EVENTS_BULK, None),
+            (remote.URL_API_EVENTS_EVENT.format("test.forward_event"), 0),
+            (remote.URL_API_EVENTS_EVENT.format("test.forward_event"), 1),
+        ], old_api.requests)
+
+        target.stop()
+
     def test_json_encoder(self):
         """ Test the JSON Encoder. """
         ha_json_enc = remote.JSONEncoder()
@@ -237,3 +349,38 @@ class TestRemoteClasses(unittest.TestCase):
 
         # Default method raises TypeError if non HA object
         self.assertRaises(TypeError, ha_json_enc.default, 1)
+
+        # Compact output uses the cached JSON of states
+        data = {'states': [state], 1: None, 'event': ha.Event('test')}
+
+        self.assertEqual(
+            json.loads(json.dumps(data, indent=4, cls=remote.JSONEncoder)),
+            json.loads(json.dumps(data, cls=remote.JSONEncoder)))
+
+
+class MockOldAPI(object):
+    """ API of an older version without the bulk events endpoint. """
+    # pylint: disable=too-few-public-methods
+
+    host = "old"
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, method, path, data=None, session=None):
+        """ Records the request. """
+        if path == remote.URL_API_EVENTS_BULK:
+            self.requests.append((path, None))
+            return MockResponse(404)
+
+        self.requests.append((path, data['index']))
+        return MockResponse(200)
+
+
+class MockResponse(object):
+    """ Response with a status code. """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ""
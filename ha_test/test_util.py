@@ -7,6 +7,7 @@ Tests Home Assistant util methods.
 # pylint: disable=too-many-public-methods
 import unittest
 import time
+import threading
 from datetime import datetime, timedelta
 
 import homeassistant.util as util
@@ -254,3 +255,168 @@ class TestUtil(unittest.TestCase):
 
         self.assertEqual(4, len(calls1))
         self.assertEqual(3, len(calls2))
+
+    def test_http_session_pool(self):
+        """ Test sessions are shared per host and 401 authenticates. """
+        pool = util.HTTPSessionPool(session_factory=MockSession)
+
+        self.assertIs(pool.session('http://router/cgi-bin/luci'),
+                      pool.session('http://router/update.cgi'))
+        self.assertIsNot(pool.session('http://router/'),
+                         pool.session('http://other/'))
+
+        session = pool.session('http://router/')
+        session.statuses = [401, 200]
+
+        response = pool.request(
+            'POST', 'http://router/rpc', lambda: {'params': {'auth': 'new'}},
+            params={'auth': 'old'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['old', 'new'], [
+            kwargs['params']['auth'] for _, _, kwargs in session.requests])
+        self.assertEqual(pool.timeout, session.requests[0][2]['timeout'])
+
+        # Failed authentication is not retried
+        session.statuses = [401, 200]
+
+        self.assertEqual(401, pool.request(
+            'GET', 'http://router/rpc', lambda: None).status_code)
+
+        # Only the given statuses authenticate again
+        session.statuses = [403, 200]
+
+        self.assertEqual(403, pool.request(
+            'GET', 'http://router/rpc', lambda: {}).status_code)
+
+        session.statuses = [403, 200]
+
+        self.assertEqual(200, pool.request(
+            'GET', 'http://router/rpc', lambda: {},
+            (util.HTTP_UNAUTHORIZED, util.HTTP_FORBIDDEN)).status_code)
+
+
+class MockSession(object):
+    """ Records requests and answers with the given status codes. """
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+
+    def request(self, method, url, **kwargs):
+        """ Records the request. """
+        self.requests.append((method, url, kwargs))
+
+        return MockResponse(self.statuses.pop(0) if self.statuses else 200)
+
+    def close(self):
+        """ Closes the session. """
+        pass
+
+
+class MockResponse(object):
+    """ Response with a status code. """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class TestThreadPool(unittest.TestCase):
+    """ Tests the ThreadPool. """
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """ Create a pool with a single worker. """
+        self.handled = []
+        self.release = threading.Event()
+
+        def job_handler(job):
+            """ Block on the first job, record the others. """
+            if job == 'block':
+                self.release.wait(5)
+            else:
+                self.handled.append(job)
+
+        self.pool = util.ThreadPool(1, job_handler, max_pending_jobs=100)
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """ Stop the pool. """
+        self.release.set()
+        self.pool.stop()
+
+    def test_priority_order(self):
+        """ Test that jobs are handled by priority, then FIFO. """
+        self.pool.add_job(1, 'block')
+
+        self.pool.add_job(3, 'low_1')
+        self.pool.add_job(1, 'high_1')
+        self.pool.add_job(3, 'low_2')
+        self.pool.add_job(1, 'high_2')
+
+        self.release.set()
+        self.pool.block_till_done()
+
+        self.assertEqual(['high_1', 'high_2', 'low_1', 'low_2'],
+                         self.handled)
+
+    def test_no_jobs_dropped(self):
+        """ Test that a burst of jobs does not get dropped. """
+        self.pool.add_job(1, 'block')
+
+        for i in range(50):
+            self.pool.add_job(2, i)
+
+        self.release.set()
+        self.pool.block_till_done()
+
+        self.assertEqual(list(range(50)), self.handled)
+
+        metrics = self.pool.metrics
+        self.assertEqual(0, metrics['pending_jobs'])
+        self.assertEqual(50, metrics['priorities'][2]['handled_jobs'])
+        self.assertEqual(1, metrics['priorities'][1]['handled_jobs'])
+
+    def test_backpressure(self):
+        """ Test that add_job blocks if too many jobs are pending. """
+        self.pool.max_pending_jobs = 2
+        self.pool.add_job(1, 'block')
+
+        # Wait till the worker picked up the blocking job
+        while not self.pool.current_jobs:
+            time.sleep(.01)
+
+        self.pool.add_job(1, 'first')
+        self.pool.add_job(1, 'second')
+
+        adder = threading.Thread(target=self.pool.add_job, args=(1, 'third'))
+        adder.start()
+        adder.join(.2)
+
+        # Queue is full, so the third job is still waiting to be added
+        self.assertTrue(adder.is_alive())
+
+        self.release.set()
+        adder.join(5)
+        self.pool.block_till_done()
+
+        self.assertEqual(['first', 'second', 'third'], self.handled)
+        self.assertEqual(0, self.pool.metrics['spilled_jobs'])
+
+    def test_grow(self):
+        """ Test that the pool grows when all workers are busy. """
+        self.pool.max_worker_count = 2
+        self.pool.add_job(1, 'block')
+
+        while not self.pool.current_jobs:
+            time.sleep(.01)
+
+        self.pool.add_job(1, 'other')
+
+        # Second worker handles the job while the first one is blocked
+        for _ in range(100):
+            if self.handled:
+                break
+            time.sleep(.01)
+
+        self.assertEqual(['other'], self.handled)
+        self.assertEqual(2, self.pool.metrics['worker_count'])
@@ -12,16 +12,24 @@ import logging
 import threading
 import enum
 import re
+import fnmatch
+import json
+import asyncio
+import heapq
+import types
+import itertools
+import random
 import datetime as dt
 import functools as ft
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
-from homeassistant.helpers import validate_config
 from homeassistant.const import (
     EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP,
     SERVICE_HOMEASSISTANT_STOP, EVENT_TIME_CHANGED, EVENT_STATE_CHANGED,
-    EVENT_CALL_SERVICE, ATTR_NOW, ATTR_DOMAIN, ATTR_SERVICE, MATCH_ALL)
+    EVENT_CALL_SERVICE, EVENT_SERVICE_EXECUTED, ATTR_NOW, ATTR_DOMAIN,
+    ATTR_SERVICE, ATTR_SERVICE_CALL_ID, MATCH_ALL)
 import homeassistant.util as util
-import homeassistant.external.pypushbullet.pushbullet as pushbullet
 
 DOMAIN = "homeassistant"
 
@@ -31,21 +39,36 @@ TIMER_INTERVAL = 10  # seconds
 # Number of worker threads
 POOL_NUM_THREAD = 4
 
+# Number of worker threads the pool is allowed to grow to when busy
+POOL_MAX_NUM_THREAD = 10
+
+# Seconds a blocking service call waits for the service by default
+SERVICE_CALL_LIMIT = 10
+
 # Pattern for validating entity IDs (format: <domain>.<entity>)
 ENTITY_ID_PATTERN = re.compile(r"^(?P<domain>\w+)\.(?P<entity>\w+)$")
 
+# Characters that make a pattern a glob
+_GLOB_CHARS = re.compile(r"[*?[]")
+
 _LOGGER = logging.getLogger(__name__)
 
 
 class HomeAssistant(object):
     """ Core class to route all communication to right components. """
 
-    def __init__(self, config):
-        self._pool = pool = create_worker_pool()
+    def __init__(self, use_asyncio=False):
+        if use_asyncio:
+            self._pool = pool = create_async_worker_pool()
+            self.loop = pool.loop
+        else:
+            self._pool = pool = create_worker_pool()
+            self.loop = None
 
-        self.bus = EventBus(config, pool)
+        self.bus = EventBus(pool)
         self.services = ServiceRegistry(self.bus, pool)
         self.states = StateMachine(self.bus)
+        self.scheduler = Scheduler(self.bus, pool)
 
         self.config_dir = os.path.join(os.getcwd(), 'config')
 
@@ -80,28 +103,7 @@ class HomeAssistant(object):
         """
         Adds a listener that fires once at or after a spefic point in time.
         """
-
-        @ft.wraps(action)
-        def point_in_time_listener(event):
-            """ Listens for matching time_changed events. """
-            now = event.data[ATTR_NOW]
-
-            if now >= point_in_time and \
-               not hasattr(point_in_time_listener, 'run'):
-
-                # Set variable so that we will never run twice.
-                # Because the event bus might have to wait till a thread comes
-                # available to execute this listener it might occur that the
-                # listener gets lined up twice to be executed. This will make
-                # sure the second time it does nothing.
-                point_in_time_listener.run = True
-
-                self.bus.remove_listener(EVENT_TIME_CHANGED,
-                                         point_in_time_listener)
-
-                action(now)
-
-        self.bus.listen(EVENT_TIME_CHANGED, point_in_time_listener)
+        self.scheduler.schedule(action, point_in_time)
 
     # pylint: disable=too-many-arguments
     def track_time_change(self, action,
@@ -109,38 +111,21 @@ class HomeAssistant(object):
                           hour=None, minute=None, second=None):
         """ Adds a listener that will fire if time matches a pattern. """
 
-        # We do not have to wrap the function with time pattern matching logic
-        # if no pattern given
+        # Time patterns are kept by the scheduler which knows the next time
+        # each pattern will match. Without a pattern we fire on every event.
         if any((val is not None for val in
                 (year, month, day, hour, minute, second))):
 
-            pmp = _process_match_param
-            year, month, day = pmp(year), pmp(month), pmp(day)
-            hour, minute, second = pmp(hour), pmp(minute), pmp(second)
-
-            @ft.wraps(action)
-            def time_listener(event):
-                """ Listens for matching time_changed events. """
-                now = event.data[ATTR_NOW]
-
-                mat = _matcher
-
-                if mat(now.year, year) and \
-                   mat(now.month, month) and \
-                   mat(now.day, day) and \
-                   mat(now.hour, hour) and \
-                   mat(now.minute, minute) and \
-                   mat(now.second, second):
-
-                    action(now)
+            self.scheduler.schedule_pattern(
+                action, year, month, day, hour, minute, second)
 
         else:
             @ft.wraps(action)
             def time_listener(event):
                 """ Fires every time event that comes in. """
-                action(event.data[ATTR_NOW])
+                return action(event.data[ATTR_NOW])
 
-        self.bus.listen(EVENT_TIME_CHANGED, time_listener)
+            self.bus.listen(EVENT_TIME_CHANGED, time_listener)
 
     def stop(self):
         """ Stops Home Assistant and shuts down all threads. """
@@ -225,6 +210,78 @@ def _matcher(subject, pattern):
     return MATCH_ALL == pattern or subject in pattern
 
 
+def _next_match(value, pattern):
+    """ Returns the smallest value in pattern that is larger than value.
+        Returns None if there is no such value. """
+    return min((val for val in pattern if val > value), default=None)
+
+
+# pylint: disable=too-many-arguments,too-many-branches
+def _next_time_match(now, year, month, day, hour, minute, second):
+    """ Returns the first datetime after now that matches the time pattern.
+        Returns None if the pattern will not match in the coming years.
+
+    The pattern values are either a list of allowed values or `MATCH_ALL`.
+    """
+    mat = _matcher
+    cand = now.replace(microsecond=0) + dt.timedelta(seconds=1)
+
+    # Every pattern that matches at all matches within a leap year cycle
+    last_year = now.year + 8
+
+    while cand.year <= last_year:
+        if not mat(cand.year, year):
+            nxt = _next_match(cand.year, year)
+
+            if nxt is None:
+                return None
+
+            cand = dt.datetime(nxt, 1, 1)
+
+        elif not mat(cand.month, month):
+            nxt = _next_match(cand.month, month)
+
+            if nxt is None or nxt > 12:
+                cand = dt.datetime(cand.year + 1, 1, 1)
+            else:
+                cand = dt.datetime(cand.year, nxt, 1)
+
+        elif not mat(cand.day, day):
+            cand = dt.datetime(cand.year, cand.month, cand.day) + \
+                dt.timedelta(days=1)
+
+        elif not mat(cand.hour, hour):
+            nxt = _next_match(cand.hour, hour)
+
+            if nxt is None or nxt > 23:
+                cand = dt.datetime(cand.year, cand.month, cand.day) + \
+                    dt.timedelta(days=1)
+            else:
+                cand = cand.replace(hour=nxt, minute=0, second=0)
+
+        elif not mat(cand.minute, minute):
+            nxt = _next_match(cand.minute, minute)
+
+            if nxt is None or nxt > 59:
+                cand = cand.replace(minute=0, second=0) + \
+                    dt.timedelta(hours=1)
+            else:
+                cand = cand.replace(minute=nxt, second=0)
+
+        elif not mat(cand.second, second):
+            nxt = _next_match(cand.second, second)
+
+            if nxt is None or nxt > 59:
+                cand = cand.replace(second=0) + dt.timedelta(minutes=1)
+            else:
+                cand = cand.replace(second=nxt)
+
+        else:
+            return cand
+
+    return None
+
+
 class JobPriority(util.OrderedEnum):
     """ Provides priorities for bus events. """
     # pylint: disable=no-init,too-few-public-methods
@@ -247,31 +304,86 @@ class JobPriority(util.OrderedEnum):
             return JobPriority.EVENT_DEFAULT
 
 
-def create_worker_pool(thread_count=POOL_NUM_THREAD):
+def create_worker_pool(thread_count=POOL_NUM_THREAD,
+                       max_thread_count=POOL_MAX_NUM_THREAD):
     """ Creates a worker pool to be used. """
 
     def job_handler(job):
         """ Called whenever a job is available to do. """
         try:
             func, arg = job
-            func(arg)
+            result = func(arg)
+
+            # Coroutine listeners and services are run till completion
+            # on an event loop for this job.
+            if asyncio.iscoroutine(result):
+                loop = asyncio.new_event_loop()
+
+                try:
+                    loop.run_until_complete(result)
+                finally:
+                    loop.close()
+
         except Exception:  # pylint: disable=broad-except
             # Catch any exception our service/event_listener might throw
             # We do not want to crash our ThreadPool
             _LOGGER.exception("BusHandler:Exception doing job")
 
-    def busy_callback(current_jobs, pending_jobs_count):
-        """ Callback to be called when the pool queue gets too big. """
+    return util.ThreadPool(thread_count, job_handler, _pool_busy_callback,
+                           max_thread_count)
+
+
+def create_async_worker_pool(thread_count=POOL_NUM_THREAD):
+    """ Creates a worker pool that runs an asyncio event loop.
+
+    Coroutine listeners and services run on the event loop. Other listeners
+    and services run in an executor with thread_count threads. """
+
+    def job_handler(job):
+        """ Called from an executor thread to do a job. """
+        try:
+            func, arg = job
+            result = func(arg)
+
+            if asyncio.iscoroutine(result):
+                return _handle_coroutine_job(result)
+
+        except Exception:  # pylint: disable=broad-except
+            # Catch any exception our service/event_listener might throw
+            _LOGGER.exception("BusHandler:Exception doing job")
+
+    def coroutine_factory(job):
+        """ Returns a coroutine for jobs that call a coroutine function. """
+        func, arg = job
+
+        if asyncio.iscoroutinefunction(func):
+            return _handle_coroutine_job(func(arg))
 
-        _LOGGER.error(
-            "WorkerPool:All %d threads are busy and %d jobs pending",
-            thread_count, pending_jobs_count)
+        return None
 
-        for start, job in current_jobs:
-            _LOGGER.error("WorkerPool:Current job from %s: %s",
-                          util.datetime_to_str(start), job)
+    return util.AsyncioPool(thread_count, job_handler, _pool_busy_callback,
+                            coroutine_factory)
 
-    return util.ThreadPool(thread_count, job_handler, busy_callback)
+
+@util.coroutine
+def _handle_coroutine_job(coro):
+    """ Runs the coroutine of a job and logs the exceptions it raises. """
+    try:
+        yield from coro
+    except Exception:  # pylint: disable=broad-except
+        _LOGGER.exception("BusHandler:Exception doing job")
+
+
+def _pool_busy_callback(current_jobs, pending_jobs_count):
+    """ Callback to be called when the pool queue gets too big. """
+
+    _LOGGER.error(
+        "WorkerPool:All %d threads are busy and %d jobs pending",
+        len(current_jobs), pending_jobs_count)
+
+    for start, job in current_jobs:
+        _LOGGER.error("WorkerPool:Current job from %s: %s",
+                      util.datetime_to_str(start), job)
 
 
 class EventOrigin(enum.Enum):
@@ -296,6 +408,12 @@ class Event(object):
         self.data = data or {}
         self.origin = origin
 
+    def as_dict(self):
+        """ Returns a dict representation of this Event. """
+        return {'event_type': self.event_type,
+                'data': dict(self.data),
+                'origin': str(self.origin)}
+
     def __repr__(self):
         # pylint: disable=maybe-no-member
         if self.data:
@@ -312,92 +430,127 @@ class EventBus(object):
     and events.
     """
 
-    def __init__(self, config, pool=None):
-        self.domain = "pushbullet"
-        self.conf_api_keys = "api_keys"
-        self.conf_entity_ids = "entity_ids"
-        self.conf_quiet_time_start = "quiet_time_start"
-        self.conf_quiet_time_end = "quiet_time_end"
-        self.api_keys = dict()
-        self.notify_entity_ids = dict()
-        self.quiet_time_start = dict()
-        self.quiet_time_end = dict()
+    def __init__(self, pool=None):
+        # Listeners are stored in tuples that get replaced whenever a listener
+        # is added or removed. This allows fire to iterate over a snapshot
+        # without holding the lock.
         self._listeners = {}
+        # Index of state_changed listeners that only care about specific
+        # entities. Format: entity_id -> from_state -> to_state -> listeners
+        self._state_listeners = {}
+        # Keys under which each indexed state listener is registered
+        self._state_listener_keys = {}
         self._lock = threading.Lock()
         self._pool = pool or create_worker_pool()
 
-        # Validate that all required config options are given
-        if validate_config(config, {self.domain: [self.conf_api_keys, self.conf_entity_ids]}, _LOGGER):
-            self.api_keys = config[self.domain][self.conf_api_keys].split(",")
-            self.notify_entity_ids = config[self.domain][self.conf_entity_ids].split(",")
-
-        if validate_config(config, {self.domain: [self.conf_quiet_time_start, self.conf_quiet_time_end]}, _LOGGER):
-            self.quiet_time_start = config[self.domain][self.conf_quiet_time_start].split(",")
-            self.quiet_time_end = config[self.domain][self.conf_quiet_time_end].split(",")
-
     @property
     def listeners(self):
         """ Dict with events that is being listened for and the number
         of listeners.
         """
         with self._lock:
-            return {key: len(self._listeners[key])
-                    for key in self._listeners}
+            listeners = {key: len(self._listeners[key])
+                         for key in self._listeners}
+
+            if self._state_listener_keys:
+                listeners[EVENT_STATE_CHANGED] = \
+                    listeners.get(EVENT_STATE_CHANGED, 0) + \
+                    len(self._state_listener_keys)
+
+            return listeners
 
     def fire(self, event_type, event_data=None, origin=EventOrigin.local):
         """ Fire an event. """
-        with self._lock:
-            # Copy the list of the current listeners because some listeners
-            # remove themselves as a listener while being executed which
-            # causes the iterator to be confused.
-            get = self._listeners.get
-            listeners = get(MATCH_ALL, []) + get(event_type, [])
-
-            event = Event(event_type, event_data, origin)
-            _LOGGER.info("Bus:Handling %s", event)
-
-            quietStartComplete = None
-            quietEndComplete = None
-
-            if (len(self.quiet_time_start) > 0) and (len(self.quiet_time_end) > 0):
-                currDateTime = dt.datetime.now()
-                currDateOnly = dt.date(currDateTime.year, currDateTime.month, currDateTime.day)
-
-                quietStartTimeOnly = dt.time(int(self.quiet_time_start[0]), int(self.quiet_time_start[1]), 0)
-                quietStartComplete = dt.datetime.combine(currDateOnly, quietStartTimeOnly)
-
-                quietEndTimeOnly = dt.time(int(self.quiet_time_end[0]), int(self.quiet_time_end[1]), 0)
-                quietEndComplete = dt.datetime.combine(currDateOnly, quietEndTimeOnly)
-
-            if (quietStartComplete is not None) and (quietEndComplete is not None) and (event.event_type == EVENT_STATE_CHANGED) and (len(self.api_keys) > 0) and (len(self.notify_entity_ids) > 0):
-                if not(quietStartComplete < dt.datetime.now() < quietEndComplete):
-                    for notify_entity_id in self.notify_entity_ids:
-                        if ("old_state" in event_data):
-                            if (notify_entity_id == event_data["entity_id"]):
-                                new_state = event_data["new_state"]
-                                for api_key in self.api_keys:
-                                    splittedEntity = util.split_entity_id(event_data["entity_id"])
-                                    push_obj = pushbullet.PushBullet(api_key)
-                                    push_obj.pushNote("", "Home Assistant" , splittedEntity[0].replace("_", " ").title() + ": " + splittedEntity[1].replace("_", " ").title() + " is " + new_state.state.replace("_", " ").title())
-                                break
-            if not listeners:
-                return
+        # The listener tuples are never mutated, only replaced, so it is
+        # safe to iterate over them while listeners remove themselves.
+        get = self._listeners.get
+
+        event = Event(event_type, event_data, origin)
+        _LOGGER.info("Bus:Handling %s", event)
+
+        priority = JobPriority.from_event_type(event_type)
+        add_job = self._pool.add_job
+
+        for func in get(MATCH_ALL, ()):
+            add_job(priority, (func, event))
 
-            for func in listeners:
-                self._pool.add_job(JobPriority.from_event_type(event_type),
-                                   (func, event))
+        for func in get(event_type, ()):
+            add_job(priority, (func, event))
+
+        if event_type == EVENT_STATE_CHANGED and self._state_listeners:
+            for func in self._matching_state_listeners(event.data):
+                add_job(priority, (func, event))
+
+    def _matching_state_listeners(self, event_data):
+        """ Generator for the indexed state listeners that match
+            the state change described by event_data. """
+        entity_index = self._state_listeners.get(event_data.get('entity_id'))
+
+        # State listeners are only interested in changes, not new entities
+        if not entity_index or 'old_state' not in event_data:
+            return
+
+        old_state = event_data['old_state'].state
+        new_state = event_data['new_state'].state
+
+        for from_state in (old_state, MATCH_ALL):
+            to_index = entity_index.get(from_state)
+
+            if to_index:
+                for to_state in (new_state, MATCH_ALL):
+                    yield from to_index.get(to_state, ())
 
     def listen(self, event_type, listener):
         """ Listen for all events or events of a specific type.
 
         To listen to all events specify the constant ``MATCH_ALL``
         as event_type.
+
+        The listener can be a coroutine function. Coroutines run on the
+        event loop when Home Assistant uses asyncio.
         """
         with self._lock:
-            if event_type in self._listeners:
-                self._listeners[event_type].append(listener)
-            else:
-                self._listeners[event_type] = [listener]
+            self._listeners[event_type] = \
+                self._listeners.get(event_type, ()) + (listener,)
+
+    def listen_state_change(self, entity_ids, listener,
+                            from_state=None, to_state=None):
+        """ Listen for state_changed events of specific entities.
+
+        Listeners are indexed by entity_id, from_state and to_state so only
+        matching listeners get called. entity_ids, from_state and to_state
+        can be string or list. Use list to match multiple.
+
+        Remove the listener with remove_listener(EVENT_STATE_CHANGED, ..).
+        """
+        from_state = _process_match_param(from_state)
+        to_state = _process_match_param(to_state)
+
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+
+        if from_state == MATCH_ALL:
+            from_state = [MATCH_ALL]
+
+        if to_state == MATCH_ALL:
+            to_state = [MATCH_ALL]
+
+        # Repeated entity ids or states should not call the listener twice
+        keys = list(OrderedDict.fromkeys(
+            (entity_id, from_key, to_key)
+            for entity_id in entity_ids
+            for from_key in from_state
+            for to_key in to_state))
+
+        with self._lock:
+            for entity_id, from_key, to_key in keys:
+                to_index = self._state_listeners.setdefault(
+                    entity_id, {}).setdefault(from_key, {})
+
+                to_index[to_key] = to_index.get(to_key, ()) + (listener,)
+
+            self._state_listener_keys[listener] = \
+                self._state_listener_keys.get(listener, []) + keys
 
     def listen_once(self, event_type, listener):
         """ Listen once for event of a specific type.
@@ -420,40 +573,76 @@ class EventBus(object):
 
                 self.remove_listener(event_type, onetime_listener)
 
-                listener(event)
+                return listener(event)
 
         self.listen(event_type, onetime_listener)
 
     def remove_listener(self, event_type, listener):
         """ Removes a listener of a specific event_type. """
         with self._lock:
-            try:
-                self._listeners[event_type].remove(listener)
+            if event_type == EVENT_STATE_CHANGED and \
+               listener in self._state_listener_keys:
+
+                self._remove_state_listener(listener)
+                return
 
-                # delete event_type list if empty
-                if not self._listeners[event_type]:
-                    self._listeners.pop(event_type)
+            listeners = self._listeners.get(event_type, ())
 
-            except (KeyError, ValueError):
-                # KeyError is key event_type listener did not exist
-                # ValueError if listener did not exist within event_type
-                pass
+            if listener not in listeners:
+                return
+
+            listeners = tuple(func for func in listeners if func != listener)
+
+            # delete event_type entry if no listeners are left
+            if listeners:
+                self._listeners[event_type] = listeners
+            else:
+                self._listeners.pop(event_type)
+
+    def _remove_state_listener(self, listener):
+        """ Removes an indexed state listener. Lock should be held. """
+        # A listener registered twice has the same keys twice
+        for entity_id, from_key, to_key in \
+                set(self._state_listener_keys.pop(listener)):
+
+            entity_index = self._state_listeners[entity_id]
+            to_index = entity_index[from_key]
+
+            listeners = tuple(func for func in to_index.get(to_key, ())
+                              if func != listener)
+
+            # Clean up the index levels that became empty
+            if listeners:
+                to_index[to_key] = listeners
+            else:
+                to_index.pop(to_key, None)
+
+                if not to_index:
+                    entity_index.pop(from_key)
+
+                    if not entity_index:
+                        self._state_listeners.pop(entity_id)
 
 
 class State(object):
-    """ Object to represent a state within the state machine. """
+    """
+    Object to represent a state within the state machine.
 
-    __slots__ = ['entity_id', 'state', 'attributes', 'last_changed']
+    States are immutable so they can be shared without copying. Use
+    State.copy to get a state with a different state or attributes.
+    """
+
+    __slots__ = ['entity_id', 'state', 'attributes', 'last_changed', 'version',
+                 '_json']
 
-    def __init__(self, entity_id, state, attributes=None, last_changed=None):
+    # pylint: disable=too-many-arguments
+    def __init__(self, entity_id, state, attributes=None, last_changed=None,
+                 version=0):
         if not ENTITY_ID_PATTERN.match(entity_id):
             raise InvalidEntityFormatError((
                 "Invalid entity id encountered: {}. "
                 "Format should be <domain>.<entity>").format(entity_id))
 
-        self.entity_id = entity_id
-        self.state = state
-        self.attributes = attributes or {}
         last_changed = last_changed or dt.datetime.now()
 
         # Strip microsecond from last_changed else we cannot guarantee
@@ -461,15 +650,31 @@ class State(object):
         # This behavior occurs because to_dict uses datetime_to_str
         # which strips microseconds
         if last_changed.microsecond:
-            self.last_changed = last_changed - dt.timedelta(
+            last_changed = last_changed - dt.timedelta(
                 microseconds=last_changed.microsecond)
-        else:
-            self.last_changed = last_changed
 
-    def copy(self):
-        """ Creates a copy of itself. """
-        return State(self.entity_id, self.state,
-                     dict(self.attributes), self.last_changed)
+        init = super().__setattr__
+        init('entity_id', entity_id)
+        init('state', state)
+        init('attributes', types.MappingProxyType(dict(attributes or {})))
+        init('last_changed', last_changed)
+        init('version', version)
+        init('_json', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "State is immutable. Use State.copy to change {}".format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError("State is immutable")
+
+    def copy(self, state=None, attributes=None):
+        """ Creates a copy of itself.
+            Optionally replaces the state and attributes of the copy. """
+        return State(self.entity_id,
+                     self.state if state is None else state,
+                     self.attributes if attributes is None else attributes,
+                     self.last_changed, self.version)
 
     def as_dict(self):
         """ Converts State to a dict to be used within JSON.
@@ -477,8 +682,18 @@ class State(object):
 
         return {'entity_id': self.entity_id,
                 'state': self.state,
-                'attributes': self.attributes,
-                'last_changed': util.datetime_to_str(self.last_changed)}
+                'attributes': dict(self.attributes),
+                'last_changed': util.datetime_to_str(self.last_changed),
+                'version': self.version}
+
+    def as_json(self):
+        """ Returns the state as compact JSON.
+            The result is cached because states are immutable. """
+        if self._json is None:
+            super().__setattr__(
+                '_json', json.dumps(self.as_dict(), separators=(',', ':')))
+
+        return self._json
 
     @classmethod
     def from_dict(cls, json_dict):
@@ -496,7 +711,8 @@ class State(object):
             last_changed = util.str_to_datetime(last_changed)
 
         return cls(json_dict['entity_id'], json_dict['state'],
-                   json_dict.get('attributes'), last_changed)
+                   json_dict.get('attributes'), last_changed,
+                   json_dict.get('version', 0))
 
     def __eq__(self, other):
         return (self.__class__ == other.__class__ and
@@ -518,27 +734,94 @@ class StateMachine(object):
 
     def __init__(self, bus):
         self._states = {}
+        self._domains = {}
         self._bus = bus
         self._lock = threading.Lock()
 
+        # Every change gets a new version. Versions continue from the time
+        # we started so a client that synced with a previous run will know
+        # it has to do a full sync.
+        self._base_version = self._version = int(time.time() * 1000)
+
+        # Latest version per changed entity id, ordered by version.
+        # Entities that are no longer in _states have been removed.
+        self._changes = OrderedDict()
+
+    @property
+    def version(self):
+        """ Version of the latest change to the state machine. """
+        return self._version
+
     def entity_ids(self, domain_filter=None):
         """ List of entity ids that are being tracked. """
         if domain_filter is not None:
-            return [entity_id for entity_id in self._states.keys()
-                    if util.split_entity_id(entity_id)[0] == domain_filter]
+            return list(self._domains.get(domain_filter, {}).keys())
         else:
             return list(self._states.keys())
 
-    def all(self):
-        """ Returns a list of all states. """
-        return [state.copy() for state in self._states.values()]
+    def entity_ids_matching(self, pattern):
+        """ List of entity ids that match a glob pattern like light.*
+
+        If the domain part of the pattern contains no wildcards only the
+        entities within that domain are checked. """
+        domain = util.split_entity_id(pattern)[0]
+
+        if _GLOB_CHARS.search(domain):
+            entity_ids = list(self._states.keys())
+        else:
+            entity_ids = list(self._domains.get(domain, {}).keys())
+
+        return [entity_id for entity_id in entity_ids
+                if fnmatch.fnmatchcase(entity_id, pattern)]
+
+    def domain_counts(self):
+        """ Returns a dict with the number of entities per domain. """
+        return {domain: len(states) for domain, states
+                in list(self._domains.items())}
+
+    def all(self, domain_filter=None):
+        """ Returns a snapshot list of all states.
+            States are immutable so they are not copied. """
+        if domain_filter is not None:
+            return list(self._domains.get(domain_filter, {}).values())
+        else:
+            return list(self._states.values())
 
     def get(self, entity_id):
         """ Returns the state of the specified entity. """
-        state = self._states.get(entity_id)
+        return self._states.get(entity_id)
+
+    def changes_since(self, version):
+        """
+        Returns the changes made after version as a dict with the keys:
+        version - version of the latest change
+        full - True if states contains all states because the given version
+               is unknown. The caller should discard the states it has.
+        states - list of states that changed
+        removed - list of entity ids that were removed
+        """
+        with self._lock:
+            if not self._base_version <= version <= self._version:
+                return {'version': self._version, 'full': True,
+                        'states': list(self._states.values()),
+                        'removed': []}
+
+            states, removed = [], []
 
-        # Make a copy so people won't mutate the state
-        return state.copy() if state else None
+            # Python 3.4 cannot reverse the items view of an OrderedDict
+            for entity_id in reversed(self._changes):
+                if self._changes[entity_id] <= version:
+                    break
+
+                state = self._states.get(entity_id)
+
+                if state:
+                    states.append(state)
+                else:
+                    removed.append(entity_id)
+
+            return {'version': self._version, 'full': False,
+                    'states': states, 'removed': removed}
 
     def is_state(self, entity_id, state):
         """ Returns True if entity exists and is specified state. """
@@ -550,7 +833,12 @@ class StateMachine(object):
 
         Returns boolean to indicate if a entity was removed. """
         with self._lock:
-            return self._states.pop(entity_id, None) is not None
+            if not self._discard(entity_id):
+                return False
+
+            self._log_change(entity_id)
+
+            return True
 
     def set(self, entity_id, new_state, attributes=None):
         """ Set the state of an entity, add entity if it does not exist.
@@ -567,8 +855,10 @@ class StateMachine(object):
                old_state.state != new_state or \
                old_state.attributes != attributes:
 
-                state = self._states[entity_id] = \
-                    State(entity_id, new_state, attributes)
+                state = State(entity_id, new_state, attributes,
+                              version=self._log_change(entity_id))
+
+                self._store(state)
 
                 event_data = {'entity_id': entity_id, 'new_state': state}
 
@@ -577,6 +867,44 @@ class StateMachine(object):
 
                 self._bus.fire(EVENT_STATE_CHANGED, event_data)
 
+    def _store(self, state):
+        """ Stores state and adds it to the domain index.
+            Lock should be held. """
+        self._states[state.entity_id] = state
+
+        domain = util.split_entity_id(state.entity_id)[0]
+
+        try:
+            self._domains[domain][state.entity_id] = state
+        except KeyError:
+            self._domains[domain] = {state.entity_id: state}
+
+    def _log_change(self, entity_id):
+        """ Records a change of entity_id and returns its version.
+            Lock should be held. """
+        self._version += 1
+
+        self._changes.pop(entity_id, None)
+        self._changes[entity_id] = self._version
+
+        return self._version
+
+    def _discard(self, entity_id):
+        """ Removes entity from the states and the domain index.
+            Lock should be held. Returns if the entity was removed. """
+        if self._states.pop(entity_id, None) is None:
+            return False
+
+        domain = util.split_entity_id(entity_id)[0]
+        domain_states = self._domains[domain]
+
+        domain_states.pop(entity_id)
+
+        if not domain_states:
+            self._domains.pop(domain)
+
+        return True
+
     def track_change(self, entity_ids, action, from_state=None, to_state=None):
         """
         Track specific state changes.
@@ -586,26 +914,16 @@ class StateMachine(object):
         Returns the listener that listens on the bus for EVENT_STATE_CHANGED.
         Pass the return value into hass.bus.remove_listener to remove it.
         """
-        from_state = _process_match_param(from_state)
-        to_state = _process_match_param(to_state)
-
-        # Ensure it is a list with entity ids we want to match on
-        if isinstance(entity_ids, str):
-            entity_ids = [entity_ids]
-
         @ft.wraps(action)
         def state_listener(event):
-            """ The listener that listens for specific state changes. """
-            if event.data['entity_id'] in entity_ids and \
-                    'old_state' in event.data and \
-                    _matcher(event.data['old_state'].state, from_state) and \
-                    _matcher(event.data['new_state'].state, to_state):
-
-                action(event.data['entity_id'],
-                       event.data['old_state'],
-                       event.data['new_state'])
+            """ The listener that listens for specific state changes.
+                The bus only calls it for matching state changes. """
+            return action(event.data['entity_id'],
+                          event.data['old_state'],
+                          event.data['new_state'])
 
-        self._bus.listen(EVENT_STATE_CHANGED, state_listener)
+        self._bus.listen_state_change(
+            entity_ids, state_listener, from_state, to_state)
 
         return state_listener
 
@@ -637,7 +955,11 @@ class ServiceRegistry(object):
         self._lock = threading.Lock()
         self._pool = pool or create_worker_pool()
         self._bus = bus
+        self._pending_calls = {}
+        self._call_id_prefix = '{:08x}'.format(random.getrandbits(32))
+        self._call_ids = itertools.count()
         bus.listen(EVENT_CALL_SERVICE, self._event_to_service_call)
+        bus.listen(EVENT_SERVICE_EXECUTED, self._event_service_executed)
 
     @property
     def services(self):
@@ -651,14 +973,19 @@ class ServiceRegistry(object):
         return service in self._services.get(domain, [])
 
     def register(self, domain, service, service_func):
-        """ Register a service. """
+        """ Register a service.
+
+        The service_func can be a coroutine function. Coroutines run on the
+        event loop when Home Assistant uses asyncio. """
         with self._lock:
             if domain in self._services:
                 self._services[domain][service] = service_func
             else:
                 self._services[domain] = {service: service_func}
 
-    def call(self, domain, service, service_data=None):
+    # pylint: disable=too-many-arguments
+    def call(self, domain, service, service_data=None, blocking=False,
+             timeout=SERVICE_CALL_LIMIT):
         """
         Fires event to call specified service.
 
@@ -666,28 +993,248 @@ class ServiceRegistry(object):
         This event will be picked up by this ServiceRegistry and any
         other ServiceRegistry that is listening on the EventBus.
 
+        If blocking is True this method waits up to timeout seconds for the
+        service to be executed and returns what the service returned.
+        Raises ServiceCallTimeoutError if the service did not finish in time
+        and re-raises exceptions raised by the service. Services executed by
+        a remote instance always return None.
+
         Because the service is sent as an event you are not allowed to use
-        the keys ATTR_DOMAIN and ATTR_SERVICE in your service_data.
+        the keys ATTR_DOMAIN, ATTR_SERVICE and ATTR_SERVICE_CALL_ID in your
+        service_data.
         """
         event_data = service_data or {}
         event_data[ATTR_DOMAIN] = domain
         event_data[ATTR_SERVICE] = service
 
+        if not blocking:
+            self._bus.fire(EVENT_CALL_SERVICE, event_data)
+            return None
+
+        call_id = '{}-{}'.format(self._call_id_prefix, next(self._call_ids))
+        future = self._pending_calls[call_id] = Future()
+        event_data[ATTR_SERVICE_CALL_ID] = call_id
+
         self._bus.fire(EVENT_CALL_SERVICE, event_data)
 
+        try:
+            return future.result(timeout)
+
+        except FutureTimeoutError:
+            raise ServiceCallTimeoutError(
+                "Service {}/{} did not finish within {} seconds".format(
+                    domain, service, timeout))
+
+        finally:
+            self._pending_calls.pop(call_id, None)
+
     def _event_to_service_call(self, event):
         """ Calls a service from an event. """
         service_data = dict(event.data)
         domain = service_data.pop(ATTR_DOMAIN, None)
         service = service_data.pop(ATTR_SERVICE, None)
+        call_id = service_data.pop(ATTR_SERVICE_CALL_ID, None)
 
         with self._lock:
             if domain in self._services and service in self._services[domain]:
+                service_func = self._services[domain][service]
                 service_call = ServiceCall(domain, service, service_data)
 
-                self._pool.add_job(JobPriority.EVENT_SERVICE,
-                                   (self._services[domain][service],
-                                    service_call))
+                if call_id is None:
+                    job = (service_func, service_call)
+
+                elif asyncio.iscoroutinefunction(service_func):
+                    job = (self._execute_coroutine_service,
+                           (service_func, service_call, call_id))
+
+                else:
+                    job = (self._execute_service,
+                           (service_func, service_call, call_id))
+
+                self._pool.add_job(JobPriority.EVENT_SERVICE, job)
+
+    def _execute_service(self, job):
+        """ Executes a blocking service call and reports it is done. """
+        service_func, service_call, call_id = job
+
+        try:
+            result = service_func(service_call)
+
+        except Exception as err:
+            self._service_executed(call_id, error=err)
+            raise
+
+        if asyncio.iscoroutine(result):
+            return self._finish_coroutine(result, call_id)
+
+        self._service_executed(call_id, result)
+
+    @util.coroutine
+    def _execute_coroutine_service(self, job):
+        """ Executes a blocking call to a coroutine service on the loop. """
+        service_func, service_call, call_id = job
+
+        yield from self._finish_coroutine(service_func(service_call), call_id)
+
+    @util.coroutine
+    def _finish_coroutine(self, coro, call_id):
+        """ Waits for a service coroutine and reports it is done. """
+        try:
+            result = yield from coro
+
+        except Exception as err:
+            self._service_executed(call_id, error=err)
+            raise
+
+        self._service_executed(call_id, result)
+
+    def _service_executed(self, call_id, result=None, error=None):
+        """ Hands the outcome to a local caller and fires an event for
+            callers that wait through another ServiceRegistry. """
+        future = self._pending_calls.pop(call_id, None)
+
+        if future is not None:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+        self._bus.fire(EVENT_SERVICE_EXECUTED,
+                       {ATTR_SERVICE_CALL_ID: call_id})
+
+    def _event_service_executed(self, event):
+        """ Releases a caller waiting for a service executed elsewhere. """
+        future = self._pending_calls.pop(
+            event.data.get(ATTR_SERVICE_CALL_ID), None)
+
+        if future is not None:
+            future.set_result(None)
+
+
+class Scheduler(object):
+    """
+    Calls actions at points in time or when the time matches a pattern.
+
+    Pending actions are kept in a heap ordered by the time they are due so
+    only due actions are looked at when time passes. Time is driven by the
+    time_changed events. The Timer will wake up in between events when an
+    action is due before the next event.
+    """
+
+    def __init__(self, bus, pool=None, interval=None):
+        self._pool = pool or create_worker_pool()
+        # Seconds between time_changed events
+        self.interval = interval or TIMER_INTERVAL
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        # Patterns that are waiting for the first time_changed event
+        # to find out when they are due.
+        self._unanchored = []
+        self._last_now = None
+
+        bus.listen(EVENT_TIME_CHANGED, self._time_changed_listener)
+
+    @property
+    def next_deadline(self):
+        """ Returns the time the next action is due or None. """
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def schedule(self, action, point_in_time):
+        """ Calls action once at or after point_in_time. """
+        with self._lock:
+            self._push(point_in_time, action, None)
+
+    # pylint: disable=too-many-arguments
+    def schedule_pattern(self, action, year=None, month=None, day=None,
+                         hour=None, minute=None, second=None):
+        """ Calls action every time the time matches the pattern. """
+        pmp = _process_match_param
+        pattern = (pmp(year), pmp(month), pmp(day),
+                   pmp(hour), pmp(minute), pmp(second))
+
+        # Patterns that do not pin the second match on every time_changed
+        # event, not on every second.
+        if pattern[5] == MATCH_ALL:
+            pattern = pattern[:5] + (list(range(0, 60, self.interval)),)
+
+        with self._lock:
+            if self._last_now is None:
+                self._unanchored.append((action, pattern))
+            else:
+                self._push_pattern(self._last_now, action, pattern)
+
+    def wait(self, timeout):
+        """ Blocks till timeout passed or an earlier action is scheduled. """
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def wakeup(self):
+        """ Wakes up the threads waiting on the scheduler. """
+        self._wakeup.set()
+
+    def process(self, now):
+        """ Calls all actions that are due at now. """
+        due = []
+
+        with self._lock:
+            self._last_now = now
+
+            for action, pattern in self._unanchored:
+                if all(_matcher(val, pat) for val, pat
+                       in zip(_time_fields(now), pattern)):
+
+                    due.append(action)
+
+                self._push_pattern(now, action, pattern)
+
+            self._unanchored = []
+
+            heap = self._heap
+
+            while heap and heap[0][0] <= now:
+                _, _, action, pattern = heapq.heappop(heap)
+
+                due.append(action)
+
+                if pattern is not None:
+                    self._push_pattern(now, action, pattern)
+
+        for action in due:
+            self._pool.add_job(JobPriority.EVENT_TIME, (action, now))
+
+    def _time_changed_listener(self, event):
+        """ Processes the actions that are due at the time of the event. """
+        self.process(event.data[ATTR_NOW])
+
+    def _push(self, deadline, action, pattern):
+        """ Adds an action to the heap. Lock should be held. """
+        entry = (deadline, next(self._seq), action, pattern)
+
+        heapq.heappush(self._heap, entry)
+
+        # Let the Timer know it has to wake up earlier
+        if self._heap[0] is entry:
+            self.wakeup()
+
+    def _push_pattern(self, now, action, pattern):
+        """ Adds a pattern action for the first match after now.
+            Lock should be held. """
+        deadline = _next_time_match(now, *pattern)
+
+        if deadline is None:
+            _LOGGER.warning(
+                "Time pattern for %s will never match again", action)
+        else:
+            self._push(deadline, action, pattern)
+
+
+def _time_fields(now):
+    """ Returns the fields of a datetime that time patterns match on. """
+    return (now.year, now.month, now.day, now.hour, now.minute, now.second)
 
 
 class Timer(threading.Thread):
@@ -713,7 +1260,7 @@ class Timer(threading.Thread):
         """ Start the timer. """
 
         self.hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP,
-                                  lambda event: self._stop.set())
+                                  lambda event: self.stop())
 
         _LOGGER.info("Timer:starting")
 
@@ -721,6 +1268,7 @@ class Timer(threading.Thread):
 
         calc_now = dt.datetime.now
         interval = self.interval
+        scheduler = self.hass.scheduler
 
         while not self._stop.isSet():
             now = calc_now()
@@ -739,14 +1287,30 @@ class Timer(threading.Thread):
                 slp_seconds = interval - now.second % interval + \
                     .5 - now.microsecond/1000000.0
 
-                time.sleep(slp_seconds)
+                # Wake up earlier if the scheduler has an action due before
+                # the next event.
+                deadline = scheduler.next_deadline
+
+                if deadline is not None and \
+                   (deadline - now).total_seconds() < slp_seconds:
 
-                now = calc_now()
+                    scheduler.wait(max((deadline - now).total_seconds(), 0))
+                    scheduler.process(calc_now())
+
+                else:
+                    scheduler.wait(slp_seconds)
+
+                continue
 
             last_fired_on_second = now.second
 
             self.hass.bus.fire(EVENT_TIME_CHANGED, {ATTR_NOW: now})
 
+    def stop(self):
+        """ Stops the timer. """
+        self._stop.set()
+        self.hass.scheduler.wakeup()
+
 
 class HomeAssistantError(Exception):
     """ General Home Assistant exception occured. """
@@ -761,3 +1325,8 @@ class InvalidEntityFormatError(HomeAssistantError):
 class NoEntitySpecifiedError(HomeAssistantError):
     """ When no entity is specified. """
     pass
+
+
+class ServiceCallTimeoutError(HomeAssistantError):
+    """ When a blocking service call did not finish in time. """
+    pass
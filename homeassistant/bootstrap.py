@@ -17,6 +17,7 @@ from collections import defaultdict
 import homeassistant
 import homeassistant.loader as loader
 import homeassistant.components as core_components
+from homeassistant.const import CONF_USE_ASYNCIO
 
 
 # pylint: disable=too-many-branches, too-many-statements
@@ -33,12 +34,20 @@ def from_config_dict(config, hass=None):
     config = defaultdict(dict, config)
 
     if hass is None:
-        hass = homeassistant.HomeAssistant(config)
+        hass = homeassistant.HomeAssistant(
+            config[homeassistant.DOMAIN].get(CONF_USE_ASYNCIO) == '1')
 
     logger = logging.getLogger(__name__)
 
     loader.prepare(hass)
 
+    # DEPRECATED, still supported for now.
+    if 'pushbullet' in config:
+        logger.warning(
+            'Please rename the [pushbullet] section of your config '
+            'to [notify]')
+
+        config.setdefault('notify', config.pop('pushbullet'))
 
     # Filter out the repeating and common config section [homeassistant]
     components = (key for key in config.keys()
@@ -49,15 +58,14 @@ def from_config_dict(config, hass=None):
         logger.info("Home Assistant core initialized")
 
         for domain in loader.load_order_components(components):
-            if domain is not "pushbullet":
-                try:
-                    if loader.get_component(domain).setup(hass, config):
-                        logger.info("component %s initialized", domain)
-                    else:
-                        logger.error("component %s failed to initialize", domain)
+            try:
+                if loader.get_component(domain).setup(hass, config):
+                    logger.info("component %s initialized", domain)
+                else:
+                    logger.error("component %s failed to initialize", domain)
 
-                except Exception:  # pylint: disable=broad-except
-                    logger.exception("Error during setup of component %s", domain)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error during setup of component %s", domain)
 
     else:
         logger.error(("Home Assistant core failed to initialize. "
@@ -85,7 +93,9 @@ def from_config_file(config_path, hass=None, enable_logging=True):
             config_dict[section][key] = val
 
     if hass is None:
-        hass = homeassistant.HomeAssistant(defaultdict(dict, config_dict))
+        hass = homeassistant.HomeAssistant(
+            config_dict.get(homeassistant.DOMAIN, {}).get(
+                CONF_USE_ASYNCIO) == '1')
 
         # Set config dir to directory holding config file
         hass.config_dir = os.path.abspath(os.path.dirname(config_path))
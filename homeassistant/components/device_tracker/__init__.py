@@ -3,20 +3,42 @@ homeassistant.components.tracker
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 Provides functionality to keep track of devices.
+
+Device scanners are polled every time the time changes. Scanners that extend
+PushDeviceScanner report devices joining and leaving the network as it
+happens and are only polled every RECONCILE_INTERVAL to catch missed reports.
+
+Multiple platforms can be combined by adding a section per platform:
+
+[device_tracker]
+platform=nmap_tracker
+hosts=192.168.1.1/24
+
+[device_tracker 2]
+platform=luci
+host=192.168.1.1
+username=admin
+password=secret
+
+Devices are merged by their id, MAC addresses are compared regardless of
+their case.
 """
 import logging
+import re
 import threading
+import time
 import os
 import csv
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 from homeassistant.loader import get_component
-from homeassistant.helpers import validate_config
+from homeassistant.helpers import validate_config, config_per_platform
 import homeassistant.util as util
 
 from homeassistant.const import (
     STATE_HOME, STATE_NOT_HOME, ATTR_ENTITY_PICTURE, ATTR_FRIENDLY_NAME,
-    CONF_PLATFORM, CONF_TYPE)
+    CONF_PLATFORM, CONF_TYPE, EVENT_HOMEASSISTANT_STOP)
 from homeassistant.components import group
 
 DOMAIN = "device_tracker"
@@ -34,9 +56,20 @@ ENTITY_ID_FORMAT = DOMAIN + '.{}'
 # it does not show up on scans
 TIME_DEVICE_NOT_FOUND = timedelta(minutes=3)
 
+# How often to poll scanners that report devices as they come and go
+RECONCILE_INTERVAL = timedelta(minutes=5)
+
+# How often to write new devices to the known devices file
+FLUSH_INTERVAL = timedelta(seconds=30)
+
 # Filename to save known devices to
 KNOWN_DEVICES_FILE = "known_devices.csv"
 
+# Columns of the known devices file
+KNOWN_DEVICES_FIELDS = ("device", "name", "track", "picture")
+
+RE_MAC_ADDRESS = re.compile(r'^([0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}$')
+
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -48,6 +81,15 @@ def is_on(hass, entity_id=None):
     return hass.states.is_state(entity, STATE_HOME)
 
 
+def _normalize_device(device):
+    """ Returns the id used to merge the sightings of device. MAC addresses
+        are upper-cased, other ids are returned as they are. """
+    if isinstance(device, str) and RE_MAC_ADDRESS.match(device):
+        return device.upper()
+
+    return device
+
+
 def setup(hass, config):
     """ Sets up the device tracker. """
 
@@ -57,257 +99,632 @@ def setup(hass, config):
 
         return False
 
-    tracker_type = config[DOMAIN].get(CONF_PLATFORM)
+    sources = []
 
-    if tracker_type is None:
-        tracker_type = config[DOMAIN][CONF_TYPE]
+    for platform, p_config in config_per_platform(config, DOMAIN, _LOGGER):
+        tracker_implementation = get_component(
+            'device_tracker.{}'.format(platform))
 
-        _LOGGER.warning((
-            "Please update your config for %s to use 'platform' "
-            "instead of 'type'"), tracker_type)
+        if tracker_implementation is None:
+            _LOGGER.error("Unknown device_tracker type specified: %s.",
+                          platform)
 
-    tracker_implementation = get_component(
-        'device_tracker.{}'.format(tracker_type))
+            return False
 
-    if tracker_implementation is None:
-        _LOGGER.error("Unknown device_tracker type specified.")
+        # Scanners read their settings from the device_tracker section
+        device_scanner = tracker_implementation.get_scanner(
+            hass, {DOMAIN: p_config})
 
-        return False
+        if device_scanner is None:
+            _LOGGER.error("Failed to initialize device scanner for %s",
+                          platform)
 
-    device_scanner = tracker_implementation.get_scanner(hass, config)
+            return False
 
-    if device_scanner is None:
-        _LOGGER.error("Failed to initialize device scanner for %s",
-                      tracker_type)
-
-        return False
+        # Scan as often as the scanner refreshes its results
+        sources.append(ScannerSource(
+            device_scanner,
+            getattr(tracker_implementation, 'MIN_TIME_BETWEEN_SCANS', None)))
 
-    tracker = DeviceTracker(hass, device_scanner)
+    tracker = DeviceTracker(hass, *sources)
 
     # We only succeeded if we got to parse the known devices file
     return not tracker.invalid_known_devices_file
 
 
+class PushDeviceScanner(object):
+    """
+    Base class for device scanners that report devices joining and leaving
+    the network as it happens.
+
+    Implementations call report when they learn about a device. The device
+    tracker still calls scan_devices every RECONCILE_INTERVAL, which should
+    return the devices that are currently connected.
+    """
+
+    def __init__(self):
+        self._listener = None
+
+    def listen(self, listener):
+        """ Sets the method that is called with device, is_home and name
+            when a device is reported. """
+        self._listener = listener
+
+    def report(self, device, is_home, name=None):
+        """ Reports that a device joined or left the network. """
+        if self._listener is not None:
+            self._listener(device, is_home, name)
+
+    def scan_devices(self):
+        """ Returns a list containing the ids of connected devices. """
+        return []
+
+    # pylint: disable=unused-argument, no-self-use
+    def get_device_name(self, device):
+        """ Returns the name of the given device or None if we don't know. """
+        return None
+
+
+class KnownDevices(object):
+    """
+    Registry of the devices in the known devices file.
+
+    All devices are kept in memory, indexed by device id and the entity ids
+    of the tracked devices by entity id. New devices are kept in memory till
+    flush writes them to the file in one atomic replace. The file is only
+    read again if it changed on disk. Not thread safe, the DeviceTracker
+    guards it with its lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Dict mapping device -> dict with the values of its row
+        self.devices = OrderedDict()
+        # Dict mapping entity id -> device for tracked devices
+        self.entity_ids = {}
+        # Dict mapping device -> entity id for tracked devices
+        self.device_entity_ids = {}
+        # Did we encounter an invalid known devices file
+        self.invalid = False
+
+        self._fieldnames = list(KNOWN_DEVICES_FIELDS)
+        # Devices that have not been written to the file yet
+        self._new_devices = OrderedDict()
+        self._stat = None
+
+    def _file_stat(self):
+        """ Returns what identifies the current version of the file. """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    @property
+    def has_new_devices(self):
+        """ Are there new devices that are not written to the file yet. """
+        return bool(self._new_devices)
+
+    def changed_on_disk(self):
+        """ Returns True if the file changed since it was read or written. """
+        return self._file_stat() != self._stat
+
+    def load(self):
+        """ Reads the file. Returns False if it is invalid. """
+        stat = self._file_stat()
+        devices = OrderedDict()
+
+        if stat is not None:
+            try:
+                with open(self.path) as inp:
+                    reader = csv.DictReader(inp)
+
+                    for row in reader:
+                        devices[_normalize_device(row['device'])] = {
+                            'name': row['name'],
+                            'track': row['track'] == '1',
+                            'picture': row['picture'],
+                            'row': row,
+                        }
+
+                    self._fieldnames = reader.fieldnames
+
+            except KeyError:
+                self.invalid = True
+
+                return False
+
+        self._stat = stat
+
+        # Devices we found that are not in the file yet
+        for device, info in self._new_devices.items():
+            devices.setdefault(device, info)
+
+        self.devices = devices
+        self._index_entity_ids()
+
+        return True
+
+    def add(self, device, name):
+        """ Adds a new device that is not tracked. """
+        info = {'name': name, 'track': False, 'picture': '',
+                'row': {'device': device, 'name': name, 'track': '0',
+                        'picture': ''}}
+
+        device = _normalize_device(device)
+
+        self.devices[device] = self._new_devices[device] = info
+
+    def flush(self):
+        """ Writes new devices to the file. Returns if successful. """
+        if not self._new_devices or self.invalid:
+            return True
+
+        # Do not overwrite changes that someone else made to the file
+        if self.changed_on_disk() and not self.load():
+            return False
+
+        tmp_path = self.path + '.tmp'
+
+        try:
+            with open(tmp_path, 'w') as outp:
+                writer = csv.DictWriter(outp, self._fieldnames,
+                                        extrasaction='ignore')
+
+                writer.writeheader()
+                writer.writerows(info['row'] for info in self.devices.values())
+
+            os.replace(tmp_path, self.path)
+
+        except IOError:
+            _LOGGER.exception(
+                "Error updating %s with %d new devices",
+                self.path, len(self._new_devices))
+
+            return False
+
+        _LOGGER.info("Added %d new devices to %s",
+                     len(self._new_devices), self.path)
+
+        self._new_devices.clear()
+        self._stat = self._file_stat()
+
+        return True
+
+    def _index_entity_ids(self):
+        """ Assigns entity ids to the tracked devices. Devices that were
+            tracked before keep their entity id. """
+        old_entity_ids = self.device_entity_ids
+
+        self.entity_ids = {}
+        self.device_entity_ids = {}
+        need_entity_id = []
+
+        for device, info in self.devices.items():
+            if not info['track']:
+                continue
+
+            if device in old_entity_ids:
+                self._set_entity_id(device, old_entity_ids[device])
+            else:
+                need_entity_id.append(device)
+
+        for device in need_entity_id:
+            self._set_entity_id(device, util.ensure_unique_string(
+                ENTITY_ID_FORMAT.format(
+                    util.slugify(self.devices[device]['name'])),
+                self.entity_ids))
+
+    def _set_entity_id(self, device, entity_id):
+        """ Indexes the entity id of a device. """
+        self.entity_ids[entity_id] = device
+        self.device_entity_ids[device] = entity_id
+
+
+class ScannerSource(object):
+    """
+    A device scanner that is scanned on its own schedule.
+
+    Keeps statistics about the scans. Scans of one source never overlap,
+    a scan that is due while the previous one is still running is skipped.
+    """
+
+    def __init__(self, scanner, interval=None):
+        self.scanner = scanner
+
+        # Scanners that push reports are polled less often
+        self.is_push = isinstance(scanner, PushDeviceScanner)
+
+        if interval is None:
+            interval = RECONCILE_INTERVAL if self.is_push else timedelta(0)
+
+        self.interval = interval
+        self.last_scan = None
+        # Dict mapping device -> id as reported by the last scan
+        self._scanned = {}
+
+        self.scans = 0
+        self.errors = 0
+        # Seconds the last scan and all scans together took
+        self.last_latency = None
+        self.total_latency = 0
+
+        self._scanning = threading.Lock()
+
+    def __repr__(self):
+        return "<ScannerSource {}: scans={}, errors={}>".format(
+            type(self.scanner).__name__, self.scans, self.errors)
+
+    @property
+    def error_rate(self):
+        """ Fraction of the scans that failed. """
+        return self.errors / self.scans if self.scans else 0
+
+    @property
+    def average_latency(self):
+        """ Average seconds a scan took or None if not scanned yet. """
+        return self.total_latency / self.scans if self.scans else None
+
+    def is_due(self, now):
+        """ Returns if the source should be scanned at now. """
+        return self.last_scan is None or now - self.last_scan >= self.interval
+
+    def get_device_name(self, device):
+        """ Returns the name the scanner knows for device or None. """
+        return self.scanner.get_device_name(self._scanned.get(device, device))
+
+    def scan(self, now):
+        """ Scans for devices. Returns a set with the found devices or None
+            if the scan failed or the source was already being scanned. """
+        if not self._scanning.acquire(False):
+            return None
+
+        try:
+            self.last_scan = now
+            start = time.time()
+
+            try:
+                self._scanned = {_normalize_device(device): device
+                                 for device in self.scanner.scan_devices()}
+
+                return set(self._scanned)
+
+            except Exception:  # pylint: disable=broad-except
+                self.errors += 1
+
+                _LOGGER.exception("Error scanning for devices with %s",
+                                  type(self.scanner).__name__)
+
+                return None
+
+            finally:
+                self.scans += 1
+                self.last_latency = time.time() - start
+                self.total_latency += self.last_latency
+
+        finally:
+            self._scanning.release()
+
+
 class DeviceTracker(object):
-    """ Class that tracks which devices are home and which are not. """
+    """
+    Class that tracks which devices are home and which are not.
 
-    def __init__(self, hass, device_scanner):
+    Every device scanner is scanned in its own job so a slow scanner does
+    not hold up the others. The results are merged per device, the most
+    recent sighting of a device decides if it is present.
+    """
+
+    def __init__(self, hass, *device_scanners):
         self.hass = hass
 
-        self.device_scanner = device_scanner
+        self.sources = [
+            scanner if isinstance(scanner, ScannerSource)
+            else ScannerSource(scanner) for scanner in device_scanners]
+
+        self.last_flush = None
 
         self.lock = threading.Lock()
 
-        # Dictionary to keep track of known devices and devices we track
+        # Dictionary to keep track of the devices we track
         self.tracked = {}
-        self.untracked_devices = set()
 
-        # Did we encounter an invalid known devices file
-        self.invalid_known_devices_file = False
+        self.known_devices = KnownDevices(
+            hass.get_config_path(KNOWN_DEVICES_FILE))
 
         # Wrap it in a func instead of lambda so it can be identified in
         # the bus by its __name__ attribute.
         def update_device_state(now):
-            """ Triggers update of the device states. """
-            self.update_devices(now)
+            """ Triggers update of the device states. Reloads the known
+                devices file if it changed. """
+            if self.known_devices.changed_on_disk():
+                self.reload_known_devices()
+            else:
+                self.update_states(now)
 
         # pylint: disable=unused-argument
         def reload_known_devices_service(service):
             """ Reload known devices file. """
-            group.remove_group(self.hass, GROUP_NAME_ALL_DEVICES)
-
-            self._read_known_devices_file()
+            self.reload_known_devices()
 
-            self.update_devices(datetime.now())
-
-            if self.tracked:
-                group.setup_group(
-                    self.hass, GROUP_NAME_ALL_DEVICES,
-                    self.device_entity_ids, False)
-
-        reload_known_devices_service(None)
+        self._load_known_devices()
 
         if self.invalid_known_devices_file:
             return
 
         hass.track_time_change(update_device_state)
 
+        for source in self.sources:
+            self._track_source(source)
+
         hass.services.register(DOMAIN,
                                SERVICE_DEVICE_TRACKER_RELOAD,
                                reload_known_devices_service)
 
+        hass.bus.listen_once(
+            EVENT_HOMEASSISTANT_STOP, lambda event: self.flush())
+
+    @property
+    def invalid_known_devices_file(self):
+        """ Did we encounter an invalid known devices file. """
+        return self.known_devices.invalid
+
     @property
     def device_entity_ids(self):
         """ Returns a set containing all device entity ids
             that are being tracked. """
         return set(device['entity_id'] for device in self.tracked.values())
 
-    def _update_state(self, now, device, is_home):
-        """ Update the state of a device. """
-        dev_info = self.tracked[device]
+    def _load_known_devices(self):
+        """ Loads the known devices file, scans all sources and sets up the
+            group with all devices. """
+        self._read_known_devices_file()
 
-        if is_home:
-            # Update last seen if at home
-            dev_info['last_seen'] = now
-        else:
-            # State remains at home if it has been seen in the last
-            # TIME_DEVICE_NOT_FOUND
-            is_home = now - dev_info['last_seen'] < TIME_DEVICE_NOT_FOUND
+        now = datetime.now()
 
-        state = STATE_HOME if is_home else STATE_NOT_HOME
+        self.update_devices(now, True)
+        self.flush(now)
 
-        self.hass.states.set(
-            dev_info['entity_id'], state,
-            dev_info['state_attr'])
+        if self.tracked:
+            group.setup_group(
+                self.hass, GROUP_NAME_ALL_DEVICES,
+                self.device_entity_ids, False)
 
-    def update_devices(self, now):
-        """ Update device states based on the found devices. """
-        self.lock.acquire()
+    def reload_known_devices(self):
+        """ Reloads the known devices file. Only the devices that were
+            added, removed or changed are updated. """
+        changes = self._read_known_devices_file()
+
+        if changes is None:
+            return
 
-        found_devices = set(self.device_scanner.scan_devices())
+        added, changed, removed = changes
 
-        for device in self.tracked:
-            is_home = device in found_devices
+        now = datetime.now()
 
-            self._update_state(now, device, is_home)
+        if added:
+            # Scan the sources that are due to find out if they are home
+            self.update_devices(now)
+            self.flush(now)
+
+        elif changed:
+            with self.lock:
+                for device in changed:
+                    self._update_state(now, device)
+
+        if not added and not removed:
+            return
 
-            if is_home:
-                found_devices.remove(device)
+        if not self.tracked:
+            group.remove_group(self.hass, GROUP_NAME_ALL_DEVICES)
 
-        # Did we find any devices that we didn't know about yet?
-        new_devices = found_devices - self.untracked_devices
+        elif not group.update_group_members(
+                self.hass, GROUP_NAME_ALL_DEVICES, self.device_entity_ids):
+            group.setup_group(
+                self.hass, GROUP_NAME_ALL_DEVICES,
+                self.device_entity_ids, False)
 
-        if new_devices:
-            self.untracked_devices.update(new_devices)
+    def flush(self, now=None):
+        """ Writes new devices to the known devices file. """
+        with self.lock:
+            self.last_flush = now or datetime.now()
+            self.known_devices.flush()
 
-            # Write new devices to known devices file
-            if not self.invalid_known_devices_file:
+    def _track_source(self, source):
+        """ Scans source in its own job when it is due. """
 
-                known_dev_path = self.hass.get_config_path(KNOWN_DEVICES_FILE)
+        def scan_device_source(now):
+            """ Scans the source if it is due. """
+            if source.is_due(now):
+                self.scan_source(source, now)
 
-                try:
-                    # If file does not exist we will write the header too
-                    is_new_file = not os.path.isfile(known_dev_path)
+        self.hass.track_time_change(scan_device_source)
 
-                    with open(known_dev_path, 'a') as outp:
-                        _LOGGER.info(
-                            "Found %d new devices, updating %s",
-                            len(new_devices), known_dev_path)
+        if source.is_push:
+            source.scanner.listen(
+                lambda device, is_home, name:
+                self.device_reported(source, device, is_home, name))
 
-                        writer = csv.writer(outp)
+    def _update_state(self, now, device):
+        """ Update the state of a device. Lock should be held. """
+        dev_info = self.tracked[device]
 
-                        if is_new_file:
-                            writer.writerow((
-                                "device", "name", "track", "picture"))
+        # State remains at home if it has been seen in the last
+        # TIME_DEVICE_NOT_FOUND
+        is_home = (dev_info['present'] or
+                   now - dev_info['last_seen'] < TIME_DEVICE_NOT_FOUND)
 
-                        for device in new_devices:
-                            # See if the device scanner knows the name
-                            # else defaults to unknown device
-                            name = (self.device_scanner.get_device_name(device)
-                                    or "unknown_device")
+        state = STATE_HOME if is_home else STATE_NOT_HOME
 
-                            writer.writerow((device, name, 0, ""))
+        self.hass.states.set(
+            dev_info['entity_id'], state,
+            dev_info['state_attr'])
 
-                except IOError:
-                    _LOGGER.exception(
-                        "Error updating %s with %d new devices",
-                        known_dev_path, len(new_devices))
+    def _sighting(self, when, device, is_home):
+        """ Records if a device was seen at when. Sightings older than the
+            latest sighting of the device are ignored. If sources disagree
+            at the same time the device is present. Lock should be held. """
+        dev_info = self.tracked[device]
 
-        self.lock.release()
+        if when > dev_info['sighted']:
+            dev_info['sighted'] = when
+            dev_info['present'] = is_home
 
-    # pylint: disable=too-many-branches
-    def _read_known_devices_file(self):
-        """ Parse and process the known devices file. """
-        known_dev_path = self.hass.get_config_path(KNOWN_DEVICES_FILE)
+        elif when == dev_info['sighted']:
+            dev_info['present'] = dev_info['present'] or is_home
 
-        # Return if no known devices file exists
-        if not os.path.isfile(known_dev_path):
+        if is_home:
+            dev_info['last_seen'] = max(dev_info['last_seen'], when)
+
+    def update_states(self, now):
+        """ Update the states of all devices. """
+        with self.lock:
+            for device in self.tracked:
+                self._update_state(now, device)
+
+            self._flush_if_due(now)
+
+    def _flush_if_due(self, now):
+        """ Writes new devices to the known devices file if FLUSH_INTERVAL
+            passed since the last write. Lock should be held. """
+        if self.known_devices.has_new_devices and \
+           (self.last_flush is None or
+                now - self.last_flush >= FLUSH_INTERVAL):
+            self.last_flush = now
+            self.known_devices.flush()
+
+    def update_devices(self, now, force_scan=False):
+        """ Scans the sources that are due, or all if force_scan is True,
+            one after the other and updates the device states. """
+        for source in self.sources:
+            if force_scan or source.is_due(now):
+                self.scan_source(source, now, False)
+
+        self.update_states(now)
+
+    def scan_source(self, source, now, update_states=True):
+        """ Scans a source and merges the found devices. """
+        found_devices = source.scan(now)
+
+        if found_devices is None:
             return
 
-        self.lock.acquire()
+        # Look up the names of new devices without holding the lock,
+        # scanners might have to ask the router for them.
+        names = {device: source.get_device_name(device)
+                 for device in found_devices
+                 if device not in self.known_devices.devices}
 
-        self.untracked_devices.clear()
+        with self.lock:
+            for device in self.tracked:
+                self._sighting(now, device, device in found_devices)
 
-        with open(known_dev_path) as inp:
-            default_last_seen = datetime(1990, 1, 1)
+            self._add_new_devices(found_devices, names)
 
-            # To track which devices need an entity_id assigned
-            need_entity_id = []
+            if update_states:
+                for device in self.tracked:
+                    self._update_state(now, device)
 
-            # All devices that are still in this set after we read the CSV file
-            # have been removed from the file and thus need to be cleaned up.
-            removed_devices = set(self.tracked.keys())
+                self._flush_if_due(now)
 
-            try:
-                for row in csv.DictReader(inp):
-                    device = row['device']
-
-                    if row['track'] == '1':
-                        if device in self.tracked:
-                            # Device exists
-                            removed_devices.remove(device)
-                        else:
-                            # We found a new device
-                            need_entity_id.append(device)
-
-                            self.tracked[device] = {
-                                'name': row['name'],
-                                'last_seen': default_last_seen
-                            }
-
-                        # Update state_attr with latest from file
-                        state_attr = {
-                            ATTR_FRIENDLY_NAME: row['name']
-                        }
+    def device_reported(self, source, device, is_home, name=None):
+        """ Updates a device reported by a scanner that pushes reports. """
+        now = datetime.now()
+        reported_device = device
+        device = _normalize_device(device)
+
+        with self.lock:
+            if device in self.tracked:
+                self._sighting(now, device, is_home)
+
+                self._update_state(now, device)
 
-                        if row['picture']:
-                            state_attr[ATTR_ENTITY_PICTURE] = row['picture']
+            elif is_home:
+                self._add_new_devices(
+                    {device},
+                    {device: name or
+                     source.scanner.get_device_name(reported_device)})
+
+    def _add_new_devices(self, found_devices, names):
+        """ Adds the devices that we didn't know about yet to the known
+            devices. names is a dict with the names of devices.
+            Lock should be held. """
+        known_devices = self.known_devices.devices
+
+        for device in found_devices:
+            if device not in known_devices:
+                # Defaults to unknown device if the scanner does not know
+                self.known_devices.add(
+                    device, names.get(device) or "unknown_device")
+
+    def _read_known_devices_file(self):
+        """ Parse and process the known devices file. Returns a tuple with
+            lists of the added and changed devices and of the removed entity
+            ids, or None if the file is invalid. """
+        with self.lock:
+            if not self.known_devices.load():
+                _LOGGER.warning(
+                    ("Invalid known devices file: %s. "
+                     "We won't update it with new found devices."),
+                    self.known_devices.path)
 
-                        self.tracked[device]['state_attr'] = state_attr
+                return None
 
-                    else:
-                        self.untracked_devices.add(device)
+            default_last_seen = datetime(1990, 1, 1)
+            entity_ids = self.known_devices.device_entity_ids
+            added, changed, removed = [], [], []
 
-                # Remove existing devices that we no longer track
-                for device in removed_devices:
-                    entity_id = self.tracked[device]['entity_id']
+            # Remove existing devices that we no longer track
+            for device in list(self.tracked):
+                if device not in entity_ids:
+                    entity_id = self.tracked.pop(device)['entity_id']
 
                     _LOGGER.info("Removing entity %s", entity_id)
 
                     self.hass.states.remove(entity_id)
+                    removed.append(entity_id)
 
-                    self.tracked.pop(device)
+            for device, entity_id in entity_ids.items():
+                info = self.known_devices.devices[device]
 
-                # Setup entity_ids for the new devices
-                used_entity_ids = [info['entity_id'] for device, info
-                                   in self.tracked.items()
-                                   if device not in need_entity_id]
+                # Update state_attr with latest from file
+                state_attr = {
+                    ATTR_FRIENDLY_NAME: info['name']
+                }
 
-                for device in need_entity_id:
-                    name = self.tracked[device]['name']
+                if info['picture']:
+                    state_attr[ATTR_ENTITY_PICTURE] = info['picture']
 
-                    entity_id = util.ensure_unique_string(
-                        ENTITY_ID_FORMAT.format(util.slugify(name)),
-                        used_entity_ids)
+                dev_info = self.tracked.get(device)
 
-                    used_entity_ids.append(entity_id)
+                if dev_info is None:
+                    dev_info = self.tracked[device] = {
+                        'last_seen': default_last_seen,
+                        'sighted': default_last_seen,
+                        'present': False
+                    }
 
-                    self.tracked[device]['entity_id'] = entity_id
+                    added.append(device)
 
-                if not self.tracked:
-                    _LOGGER.warning(
-                        "No devices to track. Please update %s.",
-                        known_dev_path)
+                elif dev_info['entity_id'] != entity_id:
+                    self.hass.states.remove(dev_info['entity_id'])
+                    removed.append(dev_info['entity_id'])
+                    added.append(device)
 
-                _LOGGER.info("Loaded devices from %s", known_dev_path)
+                elif dev_info['state_attr'] != state_attr:
+                    changed.append(device)
 
-            except KeyError:
-                self.invalid_known_devices_file = True
+                dev_info['name'] = info['name']
+                dev_info['entity_id'] = entity_id
+                dev_info['state_attr'] = state_attr
 
+            if not self.tracked:
                 _LOGGER.warning(
-                    ("Invalid known devices file: %s. "
-                     "We won't update it with new found devices."),
-                    known_dev_path)
+                    "No devices to track. Please update %s.",
+                    self.known_devices.path)
 
-            finally:
-                self.lock.release()
+            _LOGGER.info("Loaded devices from %s", self.known_devices.path)
+
+            return added, changed, removed
@@ -8,12 +8,16 @@ import requests
 
 from homeassistant.const import CONF_HOST, CONF_USERNAME, CONF_PASSWORD
 from homeassistant.helpers import validate_config
-from homeassistant.util import Throttle
+from homeassistant.util import (
+    Throttle, HTTP_SESSIONS, HTTP_UNAUTHORIZED, HTTP_FORBIDDEN)
 from homeassistant.components.device_tracker import DOMAIN
 
 # Return cached results if last scan was less then this time ago
 MIN_TIME_BETWEEN_SCANS = timedelta(seconds=5)
 
+# Luci answers requests with an expired token with 403
+AUTH_FAILED_STATUSES = (HTTP_UNAUTHORIZED, HTTP_FORBIDDEN)
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -54,8 +58,10 @@ class LuciDeviceScanner(object):
 
         self.last_results = {}
 
-        self.token = _get_token(host, username, password)
         self.host = host
+        self.username = username
+        self.password = password
+        self.token = _get_token(host, username, password)
 
         self.mac2name = None
         self.success_init = self.token is not None
@@ -75,6 +81,7 @@ class LuciDeviceScanner(object):
             if self.mac2name is None:
                 url = 'http://{}/cgi-bin/luci/rpc/uci'.format(self.host)
                 result = _req_json_rpc(url, 'get_all', 'dhcp',
+                                       reauthenticate=self._reauthenticate,
                                        params={'auth': self.token})
                 if result:
                     hosts = [x for x in result.values()
@@ -99,6 +106,7 @@ class LuciDeviceScanner(object):
 
             url = 'http://{}/cgi-bin/luci/rpc/sys'.format(self.host)
             result = _req_json_rpc(url, 'net.arptable',
+                                   reauthenticate=self._reauthenticate,
                                    params={'auth': self.token})
             if result:
                 self.last_results = [x['HW address'] for x in result]
@@ -107,12 +115,24 @@ class LuciDeviceScanner(object):
 
             return False
 
+    def _reauthenticate(self):
+        """ Gets a new token when the old one expired. Returns the params
+            to retry the request with or None if it failed. """
+        _LOGGER.info("Token expired, authenticating again")
+
+        self.token = _get_token(self.host, self.username, self.password)
+
+        return None if self.token is None else {'params': {'auth': self.token}}
+
 
-def _req_json_rpc(url, method, *args, **kwargs):
-    """ Perform one JSON RPC operation. """
+def _req_json_rpc(url, method, *args, reauthenticate=None, **kwargs):
+    """ Perform one JSON RPC operation. Connections to the router are kept
+        open between operations. """
     data = json.dumps({'method': method, 'params': args})
     try:
-        res = requests.post(url, data=data, timeout=5, **kwargs)
+        res = HTTP_SESSIONS.request('POST', url, reauthenticate,
+                                    AUTH_FAILED_STATUSES,
+                                    data=data, timeout=5, **kwargs)
     except requests.exceptions.Timeout:
         _LOGGER.exception("Connection to the router timed out")
         return
@@ -128,7 +148,7 @@ def _req_json_rpc(url, method, *args, **kwargs):
         except KeyError:
             _LOGGER.exception("No result in response from luci")
             return
-    elif res.status_code == 401:
+    elif res.status_code in AUTH_FAILED_STATUSES:
         # Authentication error
         _LOGGER.exception(
             "Failed to authenticate, "
@@ -35,6 +35,8 @@ class NetgearDeviceScanner(object):
         username, password = config[CONF_USERNAME], config[CONF_PASSWORD]
 
         self.last_results = []
+        # Dict mapping mac -> name of the last results
+        self.mac2name = {}
 
         try:
             # Pylint does not play nice if not every folders has an __init__.py
@@ -74,13 +76,7 @@ class NetgearDeviceScanner(object):
     def get_device_name(self, mac):
         """ Returns the name of the given device or None if we don't know. """
 
-        filter_named = [device.name for device in self.last_results
-                        if device.mac == mac]
-
-        if filter_named:
-            return filter_named[0]
-        else:
-            return None
+        return self.mac2name.get(mac)
 
     @Throttle(MIN_TIME_BETWEEN_SCANS)
     def _update_info(self):
@@ -93,3 +89,7 @@ class NetgearDeviceScanner(object):
             _LOGGER.info("Scanning")
 
             self.last_results = self._api.get_attached_devices()
+
+            # The first device wins if a mac is listed twice
+            self.mac2name = {device.mac: device.name for device
+                             in reversed(self.last_results or [])}
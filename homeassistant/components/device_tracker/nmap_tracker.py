@@ -1,13 +1,20 @@
-""" Supports scanning using nmap. """
+""" Supports scanning using nmap.
+
+Devices are found with a ping sweep (nmap -sn). Large networks are split in
+smaller networks that are swept by parallel nmap processes. The XML output
+of nmap is parsed while it streams in so hosts are reported as soon as nmap
+has found them, before the sweep completes. MAC addresses that nmap did not
+report are looked up in the ARP table of the kernel.
+"""
 import logging
 from datetime import timedelta
 import threading
-from collections import namedtuple
+import queue
+import tempfile
 import subprocess
 import re
-
-from libnmap.process import NmapProcess
-from libnmap.parser import NmapParser, NmapParserException
+import ipaddress
+from xml.etree import ElementTree
 
 from homeassistant.const import CONF_HOSTS
 from homeassistant.helpers import validate_config
@@ -17,6 +24,15 @@ from homeassistant.components.device_tracker import DOMAIN
 # Return cached results if last scan was less then this time ago
 MIN_TIME_BETWEEN_SCANS = timedelta(seconds=5)
 
+# Number of nmap processes to sweep the network with
+NMAP_WORKERS = 4
+
+# Networks are not split in networks smaller than this many addresses
+NMAP_MIN_SUBNET_SIZE = 64
+
+# The ARP table of the kernel
+ARP_TABLE_FILE = "/proc/net/arp"
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -31,8 +47,6 @@ def get_scanner(hass, config):
 
     return scanner if scanner.success_init else None
 
-Device = namedtuple("Device", ["mac", "name"])
-
 
 def _arp(ip_address):
     """ Get the MAC address for a given IP """
@@ -46,78 +60,227 @@ def _arp(ip_address):
     return ''
 
 
+def _read_arp_table(path=ARP_TABLE_FILE):
+    """ Returns a dict mapping IP address -> MAC address from the ARP table
+        of the kernel or None if it cannot be read. """
+    try:
+        with open(path) as inp:
+            # Skip the header
+            next(inp, None)
+
+            table = {}
+
+            for line in inp:
+                fields = line.split()
+
+                # Incomplete entries have an all zero MAC address. MAC
+                # addresses keep the case of arp -n used before.
+                if len(fields) >= 4 and fields[3] != '00:00:00:00:00:00':
+                    table[fields[0]] = fields[3]
+
+            return table
+
+    except IOError:
+        return None
+
+
+def _split_targets(hosts, workers=NMAP_WORKERS):
+    """ Splits the hosts to scan in a list of targets per worker.
+        Large networks are split so they can be swept in parallel. Host
+        names and ranges are passed to nmap as they are. """
+    targets = []
+    split_bits = (workers - 1).bit_length()
+
+    for host in hosts.replace(',', ' ').split():
+        try:
+            network = ipaddress.ip_network(host, strict=False)
+
+        except ValueError:
+            targets.append(host)
+            continue
+
+        min_bits = (NMAP_MIN_SUBNET_SIZE - 1).bit_length()
+        new_prefix = min(network.prefixlen + split_bits,
+                         network.max_prefixlen - min_bits)
+
+        if new_prefix > network.prefixlen:
+            targets.extend(str(subnet) for subnet
+                           in network.subnets(new_prefix=new_prefix))
+        else:
+            targets.append(str(network))
+
+    return [targets[idx::workers]
+            for idx in range(min(workers, len(targets)))]
+
+
+def _parse_hosts(stream):
+    """ Parses nmap XML output while it streams in.
+        Yields a tuple (ip, mac, name) for every host that is up. """
+    for _, elem in ElementTree.iterparse(stream):
+        if elem.tag != 'host':
+            continue
+
+        status = elem.find('status')
+
+        if status is not None and status.get('state') == 'up':
+            addresses = {address.get('addrtype'): address.get('addr')
+                         for address in elem.findall('address')}
+            hostname = elem.find('hostnames/hostname')
+            ip_address = addresses.get('ipv4') or addresses.get('ipv6')
+
+            yield (ip_address, addresses.get('mac'),
+                   hostname.get('name') if hostname is not None
+                   else ip_address)
+
+        # Free the memory of hosts we handled
+        elem.clear()
+
+
 class NmapDeviceScanner(object):
-    """ This class scans for devices using nmap """
+    """ This class scans for devices using nmap.
+
+    Sweeps run in the background. Hosts are reported by scan_devices as soon
+    as nmap found them, devices found by the last complete sweep are kept
+    till the next sweep completes. """
 
     def __init__(self, config):
-        self.last_results = []
+        # Dict mapping mac -> name of the last complete sweep
+        self.last_results = {}
+        # Dict mapping mac -> name of the sweep in progress
+        self.sweep_results = {}
 
         self.lock = threading.Lock()
         self.hosts = config[CONF_HOSTS]
 
+        # Hosts (mac, name) found by the sweep in progress
+        self._found = queue.Queue()
+        self._sweeping = False
+
         self.success_init = True
-        self._update_info()
+        self._start_sweep()
         _LOGGER.info("nmap scanner initialized")
 
     def scan_devices(self):
         """ Scans for new devices and return a
             list containing found device ids. """
+        self._start_sweep()
 
-        self._update_info()
+        with self.lock:
+            self._drain_found()
+
+            devices = dict(self.last_results)
+            devices.update(self.sweep_results)
 
-        return [device.mac for device in self.last_results]
+        return list(devices)
 
     def get_device_name(self, mac):
         """ Returns the name of the given device or None if we don't know. """
+        with self.lock:
+            return self.sweep_results.get(mac) or self.last_results.get(mac)
+
+    @Throttle(MIN_TIME_BETWEEN_SCANS)
+    def _start_sweep(self):
+        """ Starts sweeping the network if no sweep is in progress. """
+        with self.lock:
+            if self._sweeping:
+                return
 
-        filter_named = [device.name for device in self.last_results
-                        if device.mac == mac]
+            self._sweeping = True
 
-        if filter_named:
-            return filter_named[0]
-        else:
-            return None
+        threading.Thread(target=self._run_sweep, daemon=True).start()
 
-    @Throttle(MIN_TIME_BETWEEN_SCANS)
-    def _update_info(self):
-        """ Scans the network for devices.
-            Returns boolean if scanning successful. """
-        if not self.success_init:
-            return False
+    def _drain_found(self):
+        """ Adds the hosts found so far to sweep_results.
+            Lock should be held. """
+        while True:
+            try:
+                mac, name = self._found.get_nowait()
+            except queue.Empty:
+                return
+
+            # The first name found for a device wins
+            self.sweep_results.setdefault(mac, name)
+
+    def _run_sweep(self):
+        """ Sweeps the network with a worker per target.
+            The results become the last results when all workers are done. """
+        _LOGGER.info("Scanning")
+
+        results = []
+
+        workers = [threading.Thread(target=self._sweep,
+                                    args=(targets, results))
+                   for targets in _split_targets(self.hosts)]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
 
         with self.lock:
-            _LOGGER.info("Scanning")
-
-            nmap = NmapProcess(targets=self.hosts, options="-F")
-
-            nmap.run()
-
-            if nmap.rc == 0:
-                try:
-                    results = NmapParser.parse(nmap.stdout)
-                    self.last_results = []
-                    for host in results.hosts:
-                        if host.is_up():
-                            if host.hostnames:
-                                name = host.hostnames[0]
-                            else:
-                                name = host.ipv4
-                            if host.mac:
-                                mac = host.mac
-                            else:
-                                mac = _arp(host.ipv4)
-                            if mac:
-                                device = Device(mac, name)
-                                self.last_results.append(device)
-                    _LOGGER.info("nmap scan successful")
-                    return True
-                except NmapParserException as parse_exc:
-                    _LOGGER.error("failed to parse nmap results: %s",
-                                  parse_exc.msg)
-                    self.last_results = []
-                    return False
-
-            else:
-                self.last_results = []
-                _LOGGER.error(nmap.stderr)
-                return False
+            self._drain_found()
+
+            self.last_results = self.sweep_results
+            self.sweep_results = {}
+            self._sweeping = False
+
+        if all(results):
+            _LOGGER.info("nmap scan successful")
+        else:
+            _LOGGER.warning("nmap scan only partially successful")
+
+    def _sweep(self, targets, results):
+        """ Sweeps targets with nmap, queueing the hosts that are up as they
+            are found. Appends if successful to results. """
+        # Keep stderr out of a pipe so a chatty nmap cannot block on it
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                # Unbuffered so the parser gets output as soon as it is
+                # written instead of when a full buffer has been read.
+                nmap = subprocess.Popen(
+                    ['nmap', '-sn', '-oX', '-'] + targets,
+                    stdout=subprocess.PIPE, stderr=stderr, bufsize=0)
+
+            except OSError:
+                _LOGGER.exception("Failed to run nmap")
+                results.append(False)
+                return
+
+            success = True
+            arp_table = {}
+
+            try:
+                for ip_address, mac, name in _parse_hosts(nmap.stdout):
+                    if mac is None:
+                        mac, arp_table = _lookup_mac(ip_address, arp_table)
+
+                    if mac:
+                        self._found.put((mac, name))
+
+            except ElementTree.ParseError as parse_exc:
+                _LOGGER.error("failed to parse nmap results: %s", parse_exc)
+                success = False
+                nmap.kill()
+
+            finally:
+                nmap.stdout.close()
+
+            if nmap.wait() != 0 and success:
+                stderr.seek(0)
+                _LOGGER.error(stderr.read().decode('utf-8', 'replace'))
+                success = False
+
+        results.append(success)
+
+
+def _lookup_mac(ip_address, arp_table):
+    """ Returns a tuple (mac, arp_table) with the MAC address of ip_address.
+        The ARP table is only read again if ip_address is not in it. """
+    if ip_address not in arp_table:
+        arp_table = _read_arp_table()
+
+        if arp_table is None:
+            return _arp(ip_address), {}
+
+    return arp_table.get(ip_address), arp_table
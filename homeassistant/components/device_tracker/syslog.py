@@ -0,0 +1,200 @@
+"""
+Supports tracking devices from syslog messages sent over UDP.
+
+Point the remote syslog of your router at Home Assistant to report devices
+as soon as they join or leave the network. Understands the DHCP messages of
+dnsmasq and ISC dhcpd and the station messages of hostapd.
+
+Most devices never release their DHCP lease, so a device only seen through
+DHCP is considered gone when its lease expires. Devices connected to
+hostapd stay connected till they disconnect.
+
+Example configuration:
+
+[device_tracker]
+platform=syslog
+# Optional: port to listen on, use 514 if running as root
+port=5514
+# Optional: seconds a DHCP lease lasts, defaults to 12 hours
+lease_time=43200
+"""
+import logging
+import re
+import socket
+import threading
+import time
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.components.device_tracker import (
+    DOMAIN, PushDeviceScanner)
+
+CONF_PORT = "port"
+CONF_LEASE_TIME = "lease_time"
+
+DEFAULT_PORT = 5514
+# Default lease time of dnsmasq on OpenWrt
+DEFAULT_LEASE_TIME = 12 * 60 * 60
+
+# Seconds to wait for a message before checking if we should stop
+RECEIVE_TIMEOUT = 1
+
+_MAC = r'(?P<mac>(?:[0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2})'
+
+# Tuples of pattern matching a log line, if the device joined the network
+# and if the line is about a DHCP lease
+LINE_PATTERNS = [
+    # dnsmasq-dhcp: DHCPACK(br-lan) 192.168.1.23 00:11:22:33:44:55 phone
+    (re.compile(r'DHCPACK\(\S+\) \S+ ' + _MAC + r'(?: (?P<name>\S+))?'),
+     True, True),
+    (re.compile(r'DHCPRELEASE\(\S+\) \S+ ' + _MAC), False, True),
+    # dhcpd: DHCPACK on 192.168.1.23 to 00:11:22:33:44:55 (phone) via eth0
+    (re.compile(r'DHCPACK on \S+ to ' + _MAC + r'(?: \((?P<name>[^)]+)\))?'),
+     True, True),
+    (re.compile(r'DHCPRELEASE of \S+ from ' + _MAC), False, True),
+    # hostapd: wlan0: AP-STA-CONNECTED 00:11:22:33:44:55
+    (re.compile(r'AP-STA-CONNECTED ' + _MAC), True, False),
+    (re.compile(r'AP-STA-DISCONNECTED ' + _MAC), False, False),
+    # hostapd: wlan0: STA 00:11:22:33:44:55 IEEE 802.11: associated
+    (re.compile(r'STA ' + _MAC + r' IEEE 802\.11: associated'), True, False),
+    (re.compile(r'STA ' + _MAC +
+                r' IEEE 802\.11: (?:disassociated|deauthenticated)'),
+     False, False),
+]
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_scanner(hass, config):
+    """ Returns a scanner that listens for syslog messages. """
+    try:
+        port = int(config.get(DOMAIN, {}).get(CONF_PORT, DEFAULT_PORT))
+        lease_time = float(
+            config.get(DOMAIN, {}).get(CONF_LEASE_TIME, DEFAULT_LEASE_TIME))
+
+        scanner = SyslogDeviceScanner(port, lease_time=lease_time)
+
+    except (ValueError, OSError):
+        _LOGGER.exception("Unable to listen for syslog messages")
+
+        return None
+
+    hass.bus.listen_once(
+        EVENT_HOMEASSISTANT_STOP, lambda event: scanner.stop())
+
+    return scanner
+
+
+def parse_line(line):
+    """ Returns a tuple (mac, is_home, name, is_lease) for a log line about
+        a device or None if the line is not about a device. """
+    for pattern, is_home, is_lease in LINE_PATTERNS:
+        match = pattern.search(line)
+
+        if match:
+            return (match.group('mac').upper(), is_home,
+                    match.groupdict().get('name'), is_lease)
+
+    return None
+
+
+class SyslogDeviceScanner(PushDeviceScanner):
+    """ Listens for syslog messages over UDP and reports the devices that
+        join and leave the network. """
+
+    def __init__(self, port, host='', lease_time=DEFAULT_LEASE_TIME):
+        super().__init__()
+
+        self.lease_time = lease_time
+
+        # Dict mapping mac -> name of connected devices
+        self.devices = {}
+        # Dict mapping mac -> time the lease expires of connected devices
+        # only seen through DHCP
+        self.expires = {}
+        # Dict mapping mac -> name of every device we got a name for
+        self.names = {}
+
+        self.lock = threading.Lock()
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.settimeout(RECEIVE_TIMEOUT)
+        self._stop = threading.Event()
+
+        threading.Thread(target=self._listen, daemon=True).start()
+
+        _LOGGER.info("Listening for syslog messages on port %d", self.port)
+
+    @property
+    def port(self):
+        """ Port that we listen on. """
+        return self._socket.getsockname()[1]
+
+    def scan_devices(self):
+        """ Returns a list of the devices that are connected. """
+        now = time.monotonic()
+
+        with self.lock:
+            for mac, expires in list(self.expires.items()):
+                if expires <= now:
+                    del self.devices[mac]
+                    del self.expires[mac]
+
+            return list(self.devices)
+
+    def get_device_name(self, device):
+        """ Returns the name of the given device or None if we don't know. """
+        with self.lock:
+            return self.names.get(device)
+
+    def stop(self):
+        """ Stops listening. """
+        self._stop.set()
+
+    def handle_line(self, line):
+        """ Handles a log line. Reports the device if it is about one. """
+        parsed = parse_line(line)
+
+        if parsed is None:
+            return
+
+        mac, is_home, name, is_lease = parsed
+
+        with self.lock:
+            if name:
+                self.names[mac] = name
+
+            if not is_home:
+                self.devices.pop(mac, None)
+                self.expires.pop(mac, None)
+
+            elif not is_lease:
+                self.devices[mac] = name
+                self.expires.pop(mac, None)
+
+            # Devices connected to hostapd do not expire
+            elif mac not in self.devices or mac in self.expires:
+                self.devices[mac] = name
+                self.expires[mac] = time.monotonic() + self.lease_time
+
+        self.report(mac, is_home, name)
+
+    def _listen(self):
+        """ Receives messages till we are stopped. """
+        with self._socket:
+            while not self._stop.is_set():
+                try:
+                    data = self._socket.recv(4096)
+                except socket.timeout:
+                    continue
+
+                except OSError:
+                    _LOGGER.exception("Error receiving syslog messages")
+                    return
+
+                for line in data.decode('utf-8', 'replace').splitlines():
+                    try:
+                        self.handle_line(line)
+
+                    except Exception:  # pylint: disable=broad-except
+                        _LOGGER.exception("Error handling line: %s", line)
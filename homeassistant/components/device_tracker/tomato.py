@@ -9,7 +9,7 @@ import requests
 
 from homeassistant.const import CONF_HOST, CONF_USERNAME, CONF_PASSWORD
 from homeassistant.helpers import validate_config
-from homeassistant.util import Throttle
+from homeassistant.util import Throttle, HTTP_SESSIONS
 from homeassistant.components.device_tracker import DOMAIN
 
 # Return cached results if last scan was less then this time ago
@@ -44,12 +44,9 @@ class TomatoDeviceScanner(object):
         host, http_id = config[CONF_HOST], config[CONF_HTTP_ID]
         username, password = config[CONF_USERNAME], config[CONF_PASSWORD]
 
-        self.req = requests.Request('POST',
-                                    'http://{}/update.cgi'.format(host),
-                                    data={'_http_id': http_id,
-                                          'exec': 'devlist'},
-                                    auth=requests.auth.HTTPBasicAuth(
-                                        username, password)).prepare()
+        self.url = 'http://{}/update.cgi'.format(host)
+        self.data = {'_http_id': http_id, 'exec': 'devlist'}
+        self.auth = requests.auth.HTTPBasicAuth(username, password)
 
         self.parse_api_pattern = re.compile(r"(?P<param>\w*) = (?P<value>.*);")
 
@@ -57,6 +54,8 @@ class TomatoDeviceScanner(object):
         self.lock = threading.Lock()
 
         self.last_results = {"wldev": [], "dhcpd_lease": []}
+        # Dict mapping mac -> name of the DHCP leases
+        self.mac2name = {}
 
         self.success_init = self._update_tomato_info()
 
@@ -71,13 +70,7 @@ class TomatoDeviceScanner(object):
     def get_device_name(self, device):
         """ Returns the name of the given device or None if we don't know. """
 
-        filter_named = [item[0] for item in self.last_results['dhcpd_lease']
-                        if item[2] == device]
-
-        if not filter_named or not filter_named[0]:
-            return None
-        else:
-            return filter_named[0]
+        return self.mac2name.get(device) or None
 
     @Throttle(MIN_TIME_BETWEEN_SCANS)
     def _update_tomato_info(self):
@@ -88,7 +81,9 @@ class TomatoDeviceScanner(object):
             self.logger.info("Scanning")
 
             try:
-                response = requests.Session().send(self.req, timeout=3)
+                response = HTTP_SESSIONS.request(
+                    'POST', self.url, data=self.data, auth=self.auth,
+                    timeout=3)
 
                 # Calling and parsing the Tomato api here. We only need the
                 # wldev and dhcpd_lease values. For API description see:
@@ -103,6 +98,11 @@ class TomatoDeviceScanner(object):
                             self.last_results[param] = \
                                 json.loads(value.replace("'", '"'))
 
+                    # The first lease wins if a mac is listed twice
+                    self.mac2name = {
+                        item[2]: item[0] for item
+                        in reversed(self.last_results['dhcpd_lease'])}
+
                     return True
 
                 elif response.status_code == 401:
@@ -6,6 +6,7 @@ Provides functionality to group devices that can be turned on or off.
 """
 
 import logging
+import threading
 
 import homeassistant as ha
 import homeassistant.util as util
@@ -22,7 +23,13 @@ ATTR_AUTO = "auto"
 # List of ON/OFF state tuples for groupable states
 _GROUP_TYPES = [(STATE_ON, STATE_OFF), (STATE_HOME, STATE_NOT_HOME), (STATE_NEST, STATE_NEST)]
 
-_GROUPS = {}
+# Maximum number of expansions kept by expand_entity_ids
+EXPAND_CACHE_SIZE = 100
+
+# Guards creating the registry of a Home Assistant instance
+_REGISTRY_LOCK = threading.Lock()
+
+_LOGGER = logging.getLogger(__name__)
 
 
 def _get_group_on_off(state):
@@ -34,6 +41,17 @@ def _get_group_on_off(state):
     return None, None
 
 
+def _get_registry(hass):
+    """ Returns the GroupRegistry of hass, creates it if needed. """
+    with _REGISTRY_LOCK:
+        registry = getattr(hass, 'group_registry', None)
+
+        if registry is None:
+            registry = hass.group_registry = GroupRegistry()
+
+        return registry
+
+
 def is_on(hass, entity_id):
     """ Returns if the group state is in its ON-state. """
     state = hass.states.get(entity_id)
@@ -49,29 +67,56 @@ def is_on(hass, entity_id):
 
 def expand_entity_ids(hass, entity_ids):
     """ Returns the given list of entity ids and expands group ids into
-        the entity ids it represents if found. """
-    found_ids = []
+        the entity ids it represents if found. Nested groups are expanded
+        into the entity ids of their members. """
+    registry = _get_registry(hass)
 
-    for entity_id in entity_ids:
-        try:
-            # If entity_id points at a group, expand it
-            domain, _ = util.split_entity_id(entity_id)
+    try:
+        key = tuple(entity_ids)
 
-            if domain == DOMAIN:
-                found_ids.extend(
-                    ent_id for ent_id
-                    in get_entity_ids(hass, entity_id)
-                    if ent_id not in found_ids)
+        with registry.lock:
+            return list(registry.expand_cache[key])
 
-            else:
-                if entity_id not in found_ids:
-                    found_ids.append(entity_id)
+    except TypeError:
+        # entity_ids contains something that is not hashable
+        key = None
 
-        except AttributeError:
-            # Raised by util.split_entity_id if entity_id is not a string
-            pass
+    except KeyError:
+        pass
 
-    return found_ids
+    found_ids = util.OrderedSet()
+    # Only expansions of groups set up here are invalidated on changes
+    cacheable = key is not None
+
+    with registry.lock:
+        for entity_id in entity_ids:
+            try:
+                # If entity_id points at a group, expand it
+                domain, _ = util.split_entity_id(entity_id)
+
+                if domain == DOMAIN:
+                    group = registry.groups.get(entity_id)
+
+                    if group is not None:
+                        found_ids.update(group.expanded_ids)
+                    else:
+                        cacheable = False
+                        found_ids.update(get_entity_ids(hass, entity_id))
+
+                else:
+                    found_ids.add(entity_id)
+
+            except AttributeError:
+                # Raised by util.split_entity_id if entity_id is not a string
+                pass
+
+        if cacheable:
+            if len(registry.expand_cache) >= EXPAND_CACHE_SIZE:
+                registry.expand_cache.clear()
+
+            registry.expand_cache[key] = tuple(found_ids)
+
+    return list(found_ids)
 
 
 def get_entity_ids(hass, entity_id, domain_filter=None):
@@ -104,13 +149,11 @@ def setup(hass, config):
 def setup_group(hass, name, entity_ids, user_defined=True):
     """ Sets up a group state that is the combined state of
         several states. Supports ON/OFF and DEVICE_HOME/DEVICE_NOT_HOME. """
-    logger = logging.getLogger(__name__)
-
     # In case an iterable is passed in
     entity_ids = list(entity_ids)
 
     if not entity_ids:
-        logger.error(
+        _LOGGER.error(
             'Error setting up group %s: no entities passed in to track', name)
 
         return False
@@ -122,22 +165,21 @@ def setup_group(hass, name, entity_ids, user_defined=True):
     warnings = []
     group_ids = []
     group_on, group_off = None, None
-    group_state = False
 
     for entity_id in entity_ids:
         state = hass.states.get(entity_id)
 
         # Allows for creation of a custom group which does not depend
         # upon an "on/off" state.
-        group_state = None
+        custom_state = None
         try:
-            group_state = state.attributes[ATTR_CUSTOM_GROUP_STATE]
+            custom_state = state.attributes[ATTR_CUSTOM_GROUP_STATE]
         except KeyError as ke:
             warnings.append("ATTR_CUSTOM_GROUP_STATE not found.")
         except AttributeError as ae:
             warnings.append("ATTR_CUSTOM_GROUP_STATE not found.")
-        if group_state is not None:
-            state.state = group_state
+        if custom_state is not None:
+            state = state.copy(state=custom_state)
 
         # Try to determine group type if we didn't yet
         if group_on is None and state:
@@ -165,51 +207,52 @@ def setup_group(hass, name, entity_ids, user_defined=True):
         else:
             group_ids.append(entity_id)
 
-            # Keep track of the group state to init later on
-            group_state = group_state or state.state == group_on
-
     # If none of the entities could be found during setup
     if not group_ids:
-        logger.error('Unable to find any entities to track for group %s', name)
+        _LOGGER.error(
+            'Unable to find any entities to track for group %s', name)
 
         return False
 
     elif warnings:
-        logger.warning(
+        _LOGGER.warning(
             'Warnings during setting up group %s: %s',
             name, ", ".join(warnings))
 
     group_entity_id = ENTITY_ID_FORMAT.format(util.slugify(name))
-    state = group_on if group_state else group_off
-    state_attr = {ATTR_ENTITY_ID: group_ids, ATTR_AUTO: not user_defined}
+    registry = _get_registry(hass)
 
-    # pylint: disable=unused-argument
-    def update_group_state(entity_id, old_state, new_state):
-        """ Updates the group state based on a state change by
-            a tracked entity. """
+    with registry.lock:
+        if group_entity_id in registry.groups:
+            remove_group(hass, name)
 
-        cur_gr_state = hass.states.get(group_entity_id).state
+        group = registry.groups[group_entity_id] = Group(
+            hass, group_entity_id, group_ids, group_on, group_off,
+            not user_defined)
 
-        # if cur_gr_state = OFF and new_state = ON: set ON
-        # if cur_gr_state = ON and new_state = OFF: research
-        # else: ignore
+        registry.expand_groups()
 
-        if cur_gr_state == group_off and new_state.state == group_on:
+    group.listener = hass.states.track_change(
+        group_ids, group.state_changed)
 
-            hass.states.set(group_entity_id, group_on, state_attr)
+    return True
 
-        elif cur_gr_state == group_on and new_state.state == group_off:
 
-            # Check if any of the other states is still on
-            if not any([hass.states.is_state(ent_id, group_on)
-                        for ent_id in group_ids
-                        if entity_id != ent_id]):
-                hass.states.set(group_entity_id, group_off, state_attr)
+def update_group_members(hass, name, entity_ids):
+    """ Changes the members of a group that was set up before without
+        setting it up again. Returns False if there is no such group. """
+    group_entity_id = ENTITY_ID_FORMAT.format(util.slugify(name))
+    registry = _get_registry(hass)
+
+    with registry.lock:
+        group = registry.groups.get(group_entity_id)
 
-    _GROUPS[group_entity_id] = hass.states.track_change(
-        group_ids, update_group_state)
+        if group is None:
+            return False
 
-    hass.states.set(group_entity_id, state, state_attr)
+        group.set_members(list(entity_ids))
+
+        registry.expand_groups()
 
     return True
 
@@ -221,6 +264,159 @@ def remove_group(hass, name):
     if hass.states.get(group_entity_id) is not None:
         hass.states.remove(group_entity_id)
 
-    if group_entity_id in _GROUPS:
-        hass.bus.remove_listener(
-            ha.EVENT_STATE_CHANGED, _GROUPS.pop(group_entity_id))
+    registry = _get_registry(hass)
+
+    with registry.lock:
+        group = registry.groups.pop(group_entity_id, None)
+
+        if group is None:
+            return
+
+        registry.expand_groups()
+
+    if group.listener is not None:
+        hass.bus.remove_listener(ha.EVENT_STATE_CHANGED, group.listener)
+
+
+def _member_state(state):
+    """ Returns the state of a member as used by the group. """
+    return state.attributes.get(ATTR_CUSTOM_GROUP_STATE, state.state)
+
+
+class GroupRegistry(object):
+    """
+    Keeps the groups set up for a Home Assistant instance and the cached
+    expansions of expand_entity_ids. Changes should hold the lock.
+    """
+
+    def __init__(self):
+        # Dict mapping group entity id -> Group
+        self.groups = {}
+        # Dict mapping tuple of entity ids -> tuple of expanded entity ids
+        self.expand_cache = {}
+        self.lock = threading.RLock()
+
+    def expand_groups(self):
+        """ Computes the expanded entity ids of all groups. Groups that are
+            nested in themselves are not expanded again. Clears the cached
+            expansions of expand_entity_ids. Lock should be held. """
+
+        def expand(group, path, found_ids):
+            """ Adds the entity ids of the members of group to found_ids. """
+            for member_id in group.member_ids:
+                member = self.groups.get(member_id)
+
+                if member is None:
+                    found_ids.add(member_id)
+
+                elif member_id in path:
+                    _LOGGER.warning(
+                        "Group %s is nested in itself via %s", member_id,
+                        " -> ".join(path))
+
+                else:
+                    expand(member, path + [member_id], found_ids)
+
+        for entity_id, group in self.groups.items():
+            found_ids = util.OrderedSet()
+
+            expand(group, [entity_id], found_ids)
+
+            group.expanded_ids = list(found_ids)
+
+        self.expand_cache.clear()
+
+
+# pylint: disable=too-many-instance-attributes
+class Group(object):
+    """
+    Keeps the state of a group up to date.
+
+    The members that are on are kept in a set, so a state change of a
+    member is handled without looking at the other members. The state of
+    the group is only written when it flips. State changes are handled
+    one at a time using the current state of the member, so changes that
+    are handled out of order do not leave a stale state behind.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, hass, entity_id, member_ids, group_on, group_off,
+                 auto):
+        self.hass = hass
+        self.entity_id = entity_id
+        self.member_ids = member_ids
+        self.group_on = group_on
+        self.group_off = group_off
+        self.state_attr = {ATTR_ENTITY_ID: member_ids, ATTR_AUTO: auto}
+
+        # Entity ids of the members in nested groups, see expand_groups
+        self.expanded_ids = member_ids
+        self.listener = None
+        self._lock = threading.Lock()
+
+        self.on_ids = set()
+
+        for member_id in member_ids:
+            state = hass.states.get(member_id)
+
+            if state is not None and _member_state(state) == group_on:
+                self.on_ids.add(member_id)
+
+        self.state = group_on if self.on_ids else group_off
+
+        hass.states.set(entity_id, self.state, self.state_attr)
+
+    def set_members(self, member_ids):
+        """ Changes the members of the group. Only the state of the added
+            members is looked at. """
+        with self._lock:
+            for member_id in set(self.member_ids) - set(member_ids):
+                self.on_ids.discard(member_id)
+
+            for member_id in set(member_ids) - set(self.member_ids):
+                state = self.hass.states.get(member_id)
+
+                if state is not None and \
+                   _member_state(state) == self.group_on:
+                    self.on_ids.add(member_id)
+
+            self.member_ids = self.expanded_ids = member_ids
+            self.state_attr = dict(self.state_attr)
+            self.state_attr[ATTR_ENTITY_ID] = member_ids
+
+            if self.listener is not None:
+                self.hass.bus.remove_listener(
+                    ha.EVENT_STATE_CHANGED, self.listener)
+
+            self.listener = self.hass.states.track_change(
+                member_ids, self.state_changed)
+
+            self.state = self.group_on if self.on_ids else self.group_off
+
+            self.hass.states.set(self.entity_id, self.state, self.state_attr)
+
+    @property
+    def on_count(self):
+        """ Number of members that are on. """
+        return len(self.on_ids)
+
+    # pylint: disable=unused-argument
+    def state_changed(self, entity_id, old_state, new_state):
+        """ Updates the group state based on a state change by
+            a tracked entity. """
+        with self._lock:
+            # Events can be handled out of order, use the current state
+            current = self.hass.states.get(entity_id)
+
+            if current is not None and \
+               _member_state(current) == self.group_on:
+                self.on_ids.add(entity_id)
+            else:
+                self.on_ids.discard(entity_id)
+
+            state = self.group_on if self.on_ids else self.group_off
+
+            if state != self.state:
+                self.state = state
+
+                self.hass.states.set(self.entity_id, state, self.state_attr)
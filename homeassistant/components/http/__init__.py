@@ -6,14 +6,18 @@ This module provides an API and a HTTP interface for debug purposes.
 
 By default it will run on port 8123.
 
-All API calls have to be accompanied by an 'api_password' parameter and will
-return JSON. If successful calls will return status code 200 or 201.
+All API calls have to be accompanied by the X-HA-access header or an
+'api_password' parameter in the query string and will return JSON.
+If successful calls will return status code 200 or 201.
+The JSON is compact, add pretty=1 to the query string to get indented JSON.
 
 Other status codes that can occur are:
  - 400 (Bad Request)
  - 401 (Unauthorized)
  - 404 (Not Found)
  - 405 (Method not allowed)
+ - 500 (Internal Server Error)
+ - 504 (Gateway Timeout)
 
 The api supports the following actions:
 
@@ -32,6 +36,19 @@ Example result:
     { .. state object .. }
 ]
 
+/api/states?since=<version> - GET
+Returns the states that changed after version and the entity ids that were
+removed. If full is true the version was unknown and all states are returned.
+Example result:
+{
+    "version": 1424781295034,
+    "full": false,
+    "states": [
+        { .. state object .. }
+    ],
+    "removed": ["light.bowl"]
+}
+
 /api/states/<entity_id> - GET
 Returns the current state from an entity
 Example result:
@@ -61,6 +78,23 @@ Example result:
     "state": "below_horizon"
 }
 
+/api/events/_bulk - POST
+Fires a batch of events. Used for event forwarding.
+parameter: events - list of objects with event_type and optional data
+Example result:
+{
+    "message": "2 events fired."
+}
+
+/api/stream - GET
+Streams events as Server-Sent Events. The connection stays open and every
+event is sent as soon as it is fired.
+optional parameter: event_type - comma separated list of event types
+optional parameter: entity_id - comma separated list of entity ids
+Example event:
+event: state_changed
+data: {"event_type": "state_changed", "data": { .. }, "origin": "LOCAL"}
+
 /api/events/<event_type> - POST
 Fires an event with event_type
 optional parameter: event_data - JSON encoded object
@@ -69,6 +103,15 @@ Example result:
     "message": "Event download_file fired."
 }
 
+/api/services/<domain>/<service> - POST
+Calls a service. The body is passed as the service data.
+Add wait=1 to the query string to only return when the service has been
+executed. Returns status code 504 if it did not finish in time.
+Example result:
+{
+    "message": "Service light/turn_on called."
+}
+
 """
 
 import json
@@ -78,14 +121,21 @@ import re
 import os
 import time
 import gzip
+import hashlib
+import queue
+import socket
+import selectors
+import select
+import shutil
+import errno
 from http.server import SimpleHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
 from urllib.parse import urlparse, parse_qs
 
 import homeassistant as ha
 from homeassistant.const import (
     SERVER_PORT, URL_API, URL_API_STATES, URL_API_EVENTS, URL_API_SERVICES,
-    URL_API_EVENT_FORWARD, URL_API_STATES_ENTITY, AUTH_HEADER)
+    URL_API_EVENT_FORWARD, URL_API_STATES_ENTITY, URL_API_EVENTS_BULK,
+    URL_API_STREAM, AUTH_HEADER, ATTR_ENTITY_ID, MATCH_ALL)
 from homeassistant.helpers import validate_config
 import homeassistant.remote as rem
 import homeassistant.util as util
@@ -97,11 +147,14 @@ DEPENDENCIES = []
 HTTP_OK = 200
 HTTP_CREATED = 201
 HTTP_MOVED_PERMANENTLY = 301
+HTTP_NOT_MODIFIED = 304
 HTTP_BAD_REQUEST = 400
 HTTP_UNAUTHORIZED = 401
 HTTP_NOT_FOUND = 404
 HTTP_METHOD_NOT_ALLOWED = 405
 HTTP_UNPROCESSABLE_ENTITY = 422
+HTTP_INTERNAL_SERVER_ERROR = 500
+HTTP_GATEWAY_TIMEOUT = 504
 
 URL_ROOT = "/"
 
@@ -114,6 +167,32 @@ CONF_DEVELOPMENT = "development"
 
 DATA_API_PASSWORD = 'api_password'
 
+# Characters that end the literal part of a regular expression
+_REGEX_SPECIAL_CHARS = re.compile(r"[\\.^$*+?{}\[\]|()]")
+
+# Number of threads that handle connections
+HTTP_POOL_SIZE = 10
+
+# Maximum number of open connections, including the ones waiting for a thread
+HTTP_MAX_CONNECTIONS = 50
+
+# Seconds before an idle keep-alive connection is closed
+HTTP_IDLE_TIMEOUT = 15
+
+# Responses with more bytes of JSON are sent in chunks of this size
+JSON_STREAM_SIZE = 65536
+
+# Number of events that can be buffered for a stream subscriber before
+# it is considered too slow and gets disconnected
+STREAM_BUFFER_SIZE = 100
+
+# Seconds between keep alive messages on an idle stream
+STREAM_PING_INTERVAL = 30
+
+# Errors of os.sendfile that mean it cannot send this file to this socket
+SENDFILE_UNSUPPORTED_ERRNOS = (
+    errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP)
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -149,12 +228,379 @@ def setup(hass, config):
     return True
 
 
-class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
-    """ Handle HTTP requests in a threaded fashion. """
+def register_path(method, url, callback):
+    """
+    Registers a callback for requests with method to url.
+
+    url can be a string to match the exact path or a compiled regular
+    expression. The callback is called with the RequestHandler, the match
+    object of url and a dict with the query and JSON body data.
+    All urls starting with /api/ require the API password.
+    """
+    ROUTES.add(method, url, callback)
+
+
+class RouteTable(object):
+    """
+    Finds the callback for a request by method and path.
+
+    Exact paths are looked up in a dict. Regular expressions are indexed by
+    the literal path segments they start with so only the expressions that
+    can match a path are tried.
+    """
+
+    def __init__(self, routes=None):
+        self._lock = threading.Lock()
+        # path -> {method: callback}
+        self._exact = {}
+        # tuple of literal path segments -> tuple of (method, regex, callback)
+        # Tuples are replaced when a route is added so lookups need no lock.
+        self._patterns = {}
+        self._max_depth = 0
+
+        for method, url, callback in routes or []:
+            self.add(method, url, callback)
+
+    def add(self, method, url, callback):
+        """ Adds a route. """
+        with self._lock:
+            if isinstance(url, str):
+                methods = dict(self._exact.get(url, {}))
+                methods[method] = callback
+                self._exact[url] = methods
+                return
+
+            # The literal part of the expression before any special char.
+            # Only the complete segments in it can be used as index.
+            prefix = _REGEX_SPECIAL_CHARS.split(url.pattern, 1)[0]
+            key = tuple(prefix.split('/')[1:-1])
+
+            self._patterns[key] = \
+                self._patterns.get(key, ()) + ((method, url, callback),)
+            self._max_depth = max(self._max_depth, len(key))
+
+    def match(self, method, path):
+        """
+        Finds the route for a request.
+
+        Returns a tuple (callback, path_match, path_found). callback is None
+        if no route is found. path_found is True if a route matched the path
+        but not the method.
+        """
+        methods = self._exact.get(path)
+
+        if methods:
+            return methods.get(method), path, True
+
+        path_found = False
+        segments = path.split('/')[1:]
+
+        # Try the routes with the longest matching literal prefix first
+        for depth in range(min(len(segments), self._max_depth), -1, -1):
+            for r_method, regex, callback in \
+                    self._patterns.get(tuple(segments[:depth]), ()):
+
+                path_match = regex.match(path)
+
+                if not path_match:
+                    continue
+
+                elif r_method == method:
+                    return callback, path_match, True
+
+                path_found = True
+
+        return None, None, path_found
+
+
+def _etag_matches(etag, if_none_match):
+    """ Returns True if etag is in the value of an If-None-Match header. """
+    if not if_none_match:
+        return False
+
+    return any(tag.strip() in (etag, '*')
+               for tag in if_none_match.split(','))
+
+
+def _parse_bool(value):
+    """ Returns if a value from the query string or body means true. """
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+class StaticFileCache(object):
+    """
+    Keeps the ETag and the gzipped content of static files in memory.
+
+    Files are compressed on first request. An entry is refreshed when the
+    modification time of its file changes.
+    """
+
+    def __init__(self):
+        # path -> (mtime, etag, gzip_data)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """ Returns a tuple (etag, gzip_data) for the file at path.
+            Raises IOError if the file cannot be read. """
+        mtime = os.stat(path).st_mtime
+        entry = self._entries.get(path)
+
+        if entry is None or entry[0] != mtime:
+            # Only one thread will compress a file
+            with self._lock:
+                entry = self._entries.get(path)
+
+                if entry is None or entry[0] != mtime:
+                    with open(path, 'rb') as inp:
+                        mtime = os.fstat(inp.fileno()).st_mtime
+                        content = inp.read()
+
+                    entry = self._entries[path] = (
+                        mtime, hashlib.md5(content).hexdigest(),
+                        gzip.compress(content))
+
+        return entry[1:]
+
+
+class ThreadPoolMixIn(object):
+    """
+    Mix-in class for socketserver that handles requests using a fixed
+    number of threads instead of a new thread per connection.
+
+    A thread only handles one request of a connection at a time. Between
+    requests, keep-alive connections wait in a selector until the next
+    request arrives, so idle connections do not hold on to a thread. They
+    are closed after idle_timeout seconds.
+
+    The request handler class is created once per connection and should not
+    handle requests in its constructor. The threads call handle_one_request
+    for every request. A handler that sets detached has taken over its
+    connection. It calls close_connection when it is done.
+
+    Connections wait for a free thread. New connections are refused when
+    max_connections connections are open.
+    """
+
+    pool_size = HTTP_POOL_SIZE
+    max_connections = HTTP_MAX_CONNECTIONS
+    idle_timeout = HTTP_IDLE_TIMEOUT
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._connections = 0
+        self._connections_lock = threading.Lock()
+        self._requests = queue.Queue()
+
+        # Dict mapping handler -> time it became idle
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._closed = threading.Event()
+
+        # Wakes up the idle watcher when connections are added
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+
+        for _ in range(self.pool_size):
+            threading.Thread(target=self._pool_worker, daemon=True).start()
+
+        threading.Thread(target=self._idle_watcher, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        """ Queues the connection for one of the threads. """
+        with self._connections_lock:
+            if self._connections >= self.max_connections:
+                _LOGGER.warning(
+                    "Refusing connection from %s: %d connections open",
+                    client_address[0], self._connections)
+
+                self.shutdown_request(request)
+                return
+
+            self._connections += 1
+
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+
+        except Exception:  # pylint: disable=broad-except
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+            with self._connections_lock:
+                self._connections -= 1
+
+            return
+
+        self._requests.put(handler)
+
+    def server_close(self):
+        """ Stops the threads, closes idle connections and the server. """
+        super().server_close()
+
+        self._closed.set()
+        self._wake_idle_watcher()
+
+        for _ in range(self.pool_size):
+            self._requests.put(None)
+
+    def close_connection(self, handler):
+        """ Finishes the handler and closes its connection. """
+        try:
+            handler.finish()
+
+        except OSError:
+            # Connection is already gone
+            pass
+
+        finally:
+            self.shutdown_request(handler.request)
+
+            with self._connections_lock:
+                self._connections -= 1
+
+    def _pool_worker(self):
+        """ Handles requests of queued connections. """
+        while True:
+            handler = self._requests.get()
+
+            if handler is None:
+                return
+
+            try:
+                handler.handle_one_request()
+
+            except Exception:  # pylint: disable=broad-except
+                self.handle_error(handler.request, handler.client_address)
+                handler.close_connection = True
+
+            if handler.detached:
+                continue
+
+            elif handler.close_connection:
+                self.close_connection(handler)
+
+            else:
+                self._wait_for_request(handler)
+
+    def _wait_for_request(self, handler):
+        """ Queues the connection when its next request arrives. """
+        # A client can send the next request before the previous response
+        # was read, it will already be buffered.
+        if _has_buffered_data(handler):
+            self._requests.put(handler)
+            return
+
+        with self._idle_lock:
+            if self._closed.is_set():
+                closed = True
+
+            else:
+                closed = False
+                self._idle[handler] = time.monotonic()
+                self._selector.register(
+                    handler.request, selectors.EVENT_READ, handler)
+
+        if closed:
+            self.close_connection(handler)
+
+        else:
+            self._wake_idle_watcher()
+
+    def _wake_idle_watcher(self):
+        """ Makes the idle watcher pick up changes. """
+        try:
+            self._wakeup_writer.send(b"\0")
+
+        except OSError:
+            # Buffer is full, the watcher will wake up anyway
+            pass
+
+    def _idle_watcher(self):
+        """ Queues idle connections that receive a request and closes the
+            ones that stayed idle for longer than idle_timeout. """
+        while not self._closed.is_set():
+            ready = []
+
+            for key, _ in self._selector.select(1):
+                if key.fileobj is self._wakeup:
+                    _drain(self._wakeup)
+                else:
+                    ready.append(key.data)
+
+            expired = []
+
+            with self._idle_lock:
+                for handler in ready:
+                    self._selector.unregister(handler.request)
+                    del self._idle[handler]
+
+                deadline = time.monotonic() - self.idle_timeout
+
+                for handler, idle_since in list(self._idle.items()):
+                    if self._closed.is_set() or idle_since < deadline:
+                        self._selector.unregister(handler.request)
+                        del self._idle[handler]
+                        expired.append(handler)
+
+            for handler in ready:
+                self._requests.put(handler)
+
+            for handler in expired:
+                self.close_connection(handler)
+
+        with self._idle_lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._selector.close()
+
+        for handler in idle:
+            self.close_connection(handler)
+
+        self._wakeup.close()
+        self._wakeup_writer.close()
+
+
+def _drain(sock):
+    """ Reads everything that is available from non-blocking sock. """
+    try:
+        while sock.recv(1024):
+            pass
+
+    except OSError:
+        pass
+
+
+def _has_buffered_data(handler):
+    """ Returns if data of the connection of handler has been read into the
+        buffer of its rfile. Does not block. """
+    sock = handler.request
+    timeout = sock.gettimeout()
+
+    try:
+        sock.settimeout(0)
+
+        return bool(handler.rfile.peek(1))
+
+    except OSError:
+        # The connection broke, let the handler find out
+        return True
+
+    finally:
+        try:
+            sock.settimeout(timeout)
+        except OSError:
+            pass
+
+
+class HomeAssistantHTTPServer(ThreadPoolMixIn, HTTPServer):
+    """ Handle HTTP requests using a pool of threads. """
     # pylint: disable=too-few-public-methods
 
     allow_reuse_address = True
-    daemon_threads = True
 
     # pylint: disable=too-many-arguments
     def __init__(self, server_address, request_handler_class,
@@ -169,6 +615,8 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
         # We will lazy init this one if needed
         self.event_forwarder = None
 
+        self.static_cache = StaticFileCache()
+
         if development:
             _LOGGER.info("running frontend in development mode")
 
@@ -183,6 +631,8 @@ class HomeAssistantHTTPServer(ThreadingMixIn, HTTPServer):
 
         self.serve_forever()
 
+        self.server_close()
+
 
 # pylint: disable=too-many-public-methods
 class RequestHandler(SimpleHTTPRequestHandler):
@@ -195,6 +645,25 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
     server_version = "HomeAssistant/1.0"
 
+    # Keep connections open for multiple requests
+    protocol_version = "HTTP/1.1"
+
+    # Timeout for reading a request or writing a response
+    timeout = HTTP_IDLE_TIMEOUT
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, request, client_address, server):
+        # The server calls handle_one_request for every request instead of
+        # handling the whole connection here, see ThreadPoolMixIn.
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = True
+        # Set if a thread of the handler took over the connection
+        self.detached = False
+
+        self.setup()
+
     PATHS = [  # debug interface
         ('GET', URL_ROOT, '_handle_get_root'),
 
@@ -215,6 +684,7 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
         # /events
         ('GET', URL_API_EVENTS, '_handle_get_api_events'),
+        ('POST', URL_API_EVENTS_BULK, '_handle_api_post_events_bulk'),
         ('POST',
          re.compile(r'/api/events/(?P<event_type>[a-zA-Z\._0-9]+)'),
          '_handle_api_post_events_event'),
@@ -227,6 +697,9 @@ class RequestHandler(SimpleHTTPRequestHandler):
                      r'(?P<service>[a-zA-Z\._0-9]+)')),
          '_handle_post_api_services_domain_service'),
 
+        # /stream
+        ('GET', URL_API_STREAM, '_handle_get_api_stream'),
+
         # /event_forwarding
         ('POST', URL_API_EVENT_FORWARD, '_handle_post_api_event_forward'),
         ('DELETE', URL_API_EVENT_FORWARD,
@@ -240,14 +713,12 @@ class RequestHandler(SimpleHTTPRequestHandler):
     ]
 
     use_json = False
+    pretty_json = False
 
-    def _handle_request(self, method):  # pylint: disable=too-many-branches
+    def _handle_request(self, method):
         """ Does some common checks and calls appropriate method. """
         url = urlparse(self.path)
 
-        if url.path.startswith('/api/'):
-            self.use_json = True
-
         # Read query input
         data = parse_qs(url.query)
 
@@ -255,9 +726,39 @@ class RequestHandler(SimpleHTTPRequestHandler):
         for key in data:
             data[key] = data[key][-1]
 
-        # Did we get post input ?
+        if '_METHOD' in data:
+            method = data.pop('_METHOD')
+
+        # Indent JSON responses if the caller asks for it
+        self.pretty_json = data.pop('pretty', '0') != '0'
+
+        callback, path_match, path_found = ROUTES.match(method, url.path)
+
         content_length = int(self.headers.get('Content-Length', 0))
 
+        # Did we find a handler for the incoming request?
+        if callback is None:
+            self._close_if_unread(content_length)
+            self._send_empty_response(
+                HTTP_METHOD_NOT_ALLOWED if path_found else HTTP_NOT_FOUND)
+            return
+
+        # Connections are reused so reset this for every request
+        self.use_json = url.path.startswith('/api/')
+
+        if self.use_json:
+            # For API calls we need a valid password. Check it before we
+            # spend time on reading the body.
+            api_password = self.headers.get(AUTH_HEADER) or \
+                data.get(DATA_API_PASSWORD)
+
+            if api_password != self.server.api_password:
+                self._close_if_unread(content_length)
+                self._json_message(
+                    "API password missing or incorrect.", HTTP_UNAUTHORIZED)
+                return
+
+        # Did we get post input ?
         if content_length:
             body_content = self.rfile.read(content_length).decode("UTF-8")
 
@@ -273,57 +774,16 @@ class RequestHandler(SimpleHTTPRequestHandler):
                     "Error parsing JSON", HTTP_UNPROCESSABLE_ENTITY)
                 return
 
-        api_password = self.headers.get(AUTH_HEADER)
-
-        if not api_password and DATA_API_PASSWORD in data:
-            api_password = data[DATA_API_PASSWORD]
-
-        if '_METHOD' in data:
-            method = data.pop('_METHOD')
-
-        # Var to keep track if we found a path that matched a handler but
-        # the method was different
-        path_matched_but_not_method = False
-
-        # Var to hold the handler for this path and method if found
-        handle_request_method = False
-
-        # Check every handler to find matching result
-        for t_method, t_path, t_handler in RequestHandler.PATHS:
-
-            # we either do string-comparison or regular expression matching
-            # pylint: disable=maybe-no-member
-            if isinstance(t_path, str):
-                path_match = url.path == t_path
-            else:
-                path_match = t_path.match(url.path)
-
-            if path_match and method == t_method:
-                # Call the method
-                handle_request_method = getattr(self, t_handler)
-                break
-
-            elif path_match:
-                path_matched_but_not_method = True
-
-        # Did we find a handler for the incoming request?
-        if handle_request_method:
-
-            # For API calls we need a valid password
-            if self.use_json and api_password != self.server.api_password:
-                self._json_message(
-                    "API password missing or incorrect.", HTTP_UNAUTHORIZED)
-
-            else:
-                handle_request_method(path_match, data)
-
-        elif path_matched_but_not_method:
-            self.send_response(HTTP_METHOD_NOT_ALLOWED)
-            self.end_headers()
-
+        if isinstance(callback, str):
+            getattr(self, callback)(path_match, data)
         else:
-            self.send_response(HTTP_NOT_FOUND)
-            self.end_headers()
+            callback(self, path_match, data)
+
+    def _close_if_unread(self, content_length):
+        """ Closes the connection after this request if it has a body that
+            we did not read. The connection cannot be reused with it. """
+        if content_length:
+            self.close_connection = True
 
     def do_HEAD(self):  # pylint: disable=invalid-name
         """ HEAD request handler. """
@@ -349,36 +809,38 @@ class RequestHandler(SimpleHTTPRequestHandler):
     def _handle_get_root(self, path_match, data):
         """ Renders the debug interface. """
 
-        write = lambda txt: self.wfile.write((txt + "\n").encode("UTF-8"))
-
-        self.send_response(HTTP_OK)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-
         if self.server.development:
             app_url = "polymer/splash-login.html"
         else:
             app_url = "frontend-{}.html".format(frontend.VERSION)
 
-        write(("<!doctype html>"
-               "<html>"
-               "<head><title>Home Assistant</title>"
-               "<meta name='mobile-web-app-capable' content='yes'>"
-               "<link rel='shortcut icon' href='/static/favicon.ico' />"
-               "<link rel='icon' type='image/png' "
-               "     href='/static/favicon-192x192.png' sizes='192x192'>"
-               "<meta name='viewport' content='width=device-width, "
-               "      user-scalable=no, initial-scale=1.0, "
-               "      minimum-scale=1.0, maximum-scale=1.0' />"
-               "<meta name='theme-color' content='#03a9f4'>"
-               "</head>"
-               "<body fullbleed>"
-               "<h3 id='init' align='center'>Initializing Home Assistant</h3>"
-               "<script"
-               "     src='/static/webcomponents.min.js'></script>"
-               "<link rel='import' href='/static/{}' />"
-               "<splash-login auth='{}'></splash-login>"
-               "</body></html>").format(app_url, data.get('api_password', '')))
+        body = ("<!doctype html>"
+                "<html>"
+                "<head><title>Home Assistant</title>"
+                "<meta name='mobile-web-app-capable' content='yes'>"
+                "<link rel='shortcut icon' href='/static/favicon.ico' />"
+                "<link rel='icon' type='image/png' "
+                "     href='/static/favicon-192x192.png' sizes='192x192'>"
+                "<meta name='viewport' content='width=device-width, "
+                "      user-scalable=no, initial-scale=1.0, "
+                "      minimum-scale=1.0, maximum-scale=1.0' />"
+                "<meta name='theme-color' content='#03a9f4'>"
+                "</head>"
+                "<body fullbleed>"
+                "<h3 id='init' align='center'>Initializing Home Assistant</h3>"
+                "<script"
+                "     src='/static/webcomponents.min.js'></script>"
+                "<link rel='import' href='/static/{}' />"
+                "<splash-login auth='{}'></splash-login>"
+                "</body></html>\n").format(
+                    app_url, data.get('api_password', '')).encode("UTF-8")
+
+        self.send_response(HTTP_OK)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
 
     # pylint: disable=unused-argument
     def _handle_get_api(self, path_match, data):
@@ -387,8 +849,20 @@ class RequestHandler(SimpleHTTPRequestHandler):
 
     # pylint: disable=unused-argument
     def _handle_get_api_states(self, path_match, data):
-        """ Returns a dict containing all entity ids and their state. """
-        self._write_json(self.server.hass.states.all())
+        """ Returns a dict containing all entity ids and their state.
+            Returns only the changes if a since version is given. """
+        if 'since' not in data:
+            self._write_json(self.server.hass.states.all())
+            return
+
+        try:
+            since = int(data['since'])
+        except ValueError:
+            self._json_message(
+                "Invalid value received for since", HTTP_UNPROCESSABLE_ENTITY)
+            return
+
+        self._write_json(self.server.hass.states.changes_since(since))
 
     # pylint: disable=unused-argument
     def _handle_get_api_states_entity(self, path_match, data):
@@ -452,7 +926,36 @@ class RequestHandler(SimpleHTTPRequestHandler):
             self._json_message("event_data should be an object",
                                HTTP_UNPROCESSABLE_ENTITY)
 
-        event_origin = ha.EventOrigin.remote
+        self._fire_remote_event(event_type, event_data)
+
+        self._json_message("Event {} fired.".format(event_type))
+
+    def _handle_api_post_events_bulk(self, path_match, data):
+        """ Handles firing of a batch of events.
+
+        This handles the following paths:
+        /api/events/_bulk
+
+        Expects a list of event objects with event_type and data under events.
+        """
+        events = data.get('events')
+
+        if not isinstance(events, list) or \
+           not all(isinstance(event, dict) and 'event_type' in event
+                   for event in events):
+
+            self._json_message("events should be a list of event objects",
+                               HTTP_UNPROCESSABLE_ENTITY)
+            return
+
+        for event in events:
+            self._fire_remote_event(event['event_type'], event.get('data'))
+
+        self._json_message("{} events fired.".format(len(events)))
+
+    def _fire_remote_event(self, event_type, event_data):
+        """ Fires an event that came in through the API.
+            Events from /api are threated as remote events. """
 
         # Special case handling for event STATE_CHANGED
         # We will try to convert state dicts back to State objects
@@ -463,9 +966,67 @@ class RequestHandler(SimpleHTTPRequestHandler):
                 if state:
                     event_data[key] = state
 
-        self.server.hass.bus.fire(event_type, event_data, event_origin)
+        self.server.hass.bus.fire(
+            event_type, event_data, ha.EventOrigin.remote)
 
-        self._json_message("Event {} fired.".format(event_type))
+    def _handle_get_api_stream(self, path_match, data):
+        """ Streams events to the caller as Server-Sent Events.
+
+        This handles the following paths:
+        /api/stream
+        """
+        event_types = data.get('event_type')
+        entity_ids = data.get('entity_id')
+
+        stream = EventStream(
+            self.server.hass,
+            event_types.split(",") if event_types else None,
+            entity_ids.split(",") if entity_ids else None)
+
+        self.send_response(HTTP_OK)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        self.close_connection = True
+
+        # Stream from a thread of its own so the subscriber does not hold
+        # on to a thread of the server
+        self.detached = True
+
+        threading.Thread(
+            target=self._stream_events, args=(stream,), daemon=True).start()
+
+    def _stream_events(self, stream):
+        """ Writes the events of stream till the subscriber goes away. """
+        try:
+            while True:
+                event = stream.get(STREAM_PING_INTERVAL)
+
+                if stream.closed:
+                    break
+
+                elif event is None:
+                    # Comment line to keep the connection alive
+                    self.wfile.write(b":ping\n\n")
+
+                else:
+                    self.wfile.write(
+                        "event: {}\ndata: {}\n\n".format(
+                            event.event_type,
+                            json.dumps(event, cls=rem.JSONEncoder)
+                        ).encode("UTF-8"))
+
+                self.wfile.flush()
+
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            # Subscriber went away or is too slow to read the stream
+            pass
+
+        finally:
+            stream.close()
+            self.server.close_connection(self)
 
     def _handle_get_api_services(self, path_match, data):
         """ Handles getting overview of services. """
@@ -484,9 +1045,31 @@ class RequestHandler(SimpleHTTPRequestHandler):
         domain = path_match.group('domain')
         service = path_match.group('service')
 
-        self.server.hass.services.call(domain, service, data)
+        if not _parse_bool(data.pop('wait', False)):
+            self.server.hass.services.call(domain, service, data)
 
-        self._json_message("Service {}/{} called.".format(domain, service))
+            self._json_message(
+                "Service {}/{} called.".format(domain, service))
+            return
+
+        try:
+            self.server.hass.services.call(
+                domain, service, data, blocking=True)
+
+        except ha.ServiceCallTimeoutError:
+            self._json_message(
+                "Service {}/{} did not finish in time.".format(
+                    domain, service),
+                HTTP_GATEWAY_TIMEOUT)
+
+        except Exception:  # pylint: disable=broad-except
+            self._json_message(
+                "Service {}/{} failed.".format(domain, service),
+                HTTP_INTERNAL_SERVER_ERROR)
+
+        else:
+            self._json_message(
+                "Service {}/{} executed.".format(domain, service))
 
     # pylint: disable=invalid-name
     def _handle_post_api_event_forward(self, path_match, data):
@@ -559,30 +1142,34 @@ class RequestHandler(SimpleHTTPRequestHandler):
         inp = None
 
         try:
-            inp = open(path, 'rb')
+            etag, gzip_data = self.server.static_cache.get(path)
 
             do_gzip = 'gzip' in self.headers.get('accept-encoding', '')
 
+            # Compressed and uncompressed content need a different ETag
+            if do_gzip:
+                etag = '"{}-gzip"'.format(etag)
+            else:
+                etag = '"{}"'.format(etag)
+
+            if _etag_matches(etag, self.headers.get('If-None-Match')):
+                self.send_response(HTTP_NOT_MODIFIED)
+                self._send_static_cache_headers(etag)
+                self.end_headers()
+                return
+
+            if not do_gzip:
+                inp = open(path, 'rb')
+
             self.send_response(HTTP_OK)
 
             ctype = self.guess_type(path)
             self.send_header("Content-Type", ctype)
 
-            # Add cache if not development
-            if not self.server.development:
-                # 1 year in seconds
-                cache_time = 365 * 86400
-
-                self.send_header(
-                    "Cache-Control", "public, max-age={}".format(cache_time))
-                self.send_header(
-                    "Expires", self.date_time_string(time.time()+cache_time))
+            self._send_static_cache_headers(etag)
 
             if do_gzip:
-                gzip_data = gzip.compress(inp.read())
-
                 self.send_header("Content-Encoding", "gzip")
-                self.send_header("Vary", "Accept-Encoding")
                 self.send_header("Content-Length", str(len(gzip_data)))
 
             else:
@@ -598,31 +1185,241 @@ class RequestHandler(SimpleHTTPRequestHandler):
                 self.wfile.write(gzip_data)
 
             else:
-                self.copyfile(inp, self.wfile)
+                self._send_file(inp, fs[6])
 
         except IOError:
-            self.send_response(HTTP_NOT_FOUND)
-            self.end_headers()
+            self._send_empty_response(HTTP_NOT_FOUND)
 
         finally:
             if inp:
                 inp.close()
 
+    def _send_file(self, inp, size):
+        """ Sends size bytes of file inp to the client. Uses os.sendfile to
+            let the kernel copy the file if the platform supports it. """
+        self.wfile.flush()
+
+        sock = self.connection
+        offset = 0
+
+        try:
+            while offset < size:
+                try:
+                    sent = os.sendfile(
+                        sock.fileno(), inp.fileno(), offset, size - offset)
+
+                except BlockingIOError:
+                    # Sockets with a timeout are non-blocking
+                    _, writable, _ = select.select(
+                        [], [sock], [], sock.gettimeout())
+
+                    if not writable:
+                        raise socket.timeout("Timed out sending file")
+
+                    continue
+
+                if not sent:
+                    break
+
+                offset += sent
+
+        except AttributeError:
+            # No os.sendfile on this platform
+            self._copy_file(inp, offset)
+
+        except OSError as err:
+            if err.errno not in SENDFILE_UNSUPPORTED_ERRNOS:
+                raise
+
+            self._copy_file(inp, offset)
+
+    def _copy_file(self, inp, offset):
+        """ Writes file inp from offset to the client. """
+        inp.seek(offset)
+        shutil.copyfileobj(inp, self.wfile)
+
+    def _send_static_cache_headers(self, etag):
+        """ Sends the headers that allow clients to cache static files. """
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+
+        # Add cache if not development
+        if not self.server.development:
+            # 1 year in seconds
+            cache_time = 365 * 86400
+
+            self.send_header(
+                "Cache-Control", "public, max-age={}".format(cache_time))
+            self.send_header(
+                "Expires", self.date_time_string(time.time()+cache_time))
+
     def _json_message(self, message, status_code=HTTP_OK):
         """ Helper method to return a message to the caller. """
         self._write_json({'message': message}, status_code=status_code)
 
     def _write_json(self, data=None, status_code=HTTP_OK, location=None):
-        """ Helper method to return JSON to the caller. """
+        """ Helper method to return JSON to the caller.
+
+        JSON is compact unless the caller asked for pretty output. Bodies
+        that are larger than JSON_STREAM_SIZE are streamed in chunks. """
+        if data is None:
+            chunks = iter(())
+        elif self.pretty_json:
+            chunks = iter((json.dumps(data, indent=4, sort_keys=True,
+                                      cls=rem.JSONEncoder),))
+        else:
+            chunks = rem.JSONEncoder(separators=(',', ':')).iterencode(data)
+
+        buf, size = [], 0
+
+        for chunk in chunks:
+            chunk = chunk.encode("UTF-8")
+            buf.append(chunk)
+            size += len(chunk)
+
+            if size >= JSON_STREAM_SIZE:
+                break
+
+        else:
+            # The whole body fits in the buffer
+            self.send_response(status_code)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(size))
+
+            if location:
+                self.send_header('Location', location)
+
+            self.end_headers()
+
+            self.wfile.write(b''.join(buf))
+            return
+
+        # HTTP/1.0 clients do not support chunks, for them we will write
+        # the body as is and close the connection to mark the end.
+        use_chunks = self.request_version == 'HTTP/1.1'
+
         self.send_response(status_code)
         self.send_header('Content-type', 'application/json')
 
+        if use_chunks:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+
         if location:
             self.send_header('Location', location)
 
         self.end_headers()
 
-        if data is not None:
-            self.wfile.write(
-                json.dumps(data, indent=4, sort_keys=True,
-                           cls=rem.JSONEncoder).encode("UTF-8"))
+        write = self._write_chunk if use_chunks else self.wfile.write
+
+        write(b''.join(buf))
+        buf, size = [], 0
+
+        for chunk in chunks:
+            chunk = chunk.encode("UTF-8")
+            buf.append(chunk)
+            size += len(chunk)
+
+            if size >= JSON_STREAM_SIZE:
+                write(b''.join(buf))
+                buf, size = [], 0
+
+        if buf:
+            write(b''.join(buf))
+
+        if use_chunks:
+            # Last chunk has length 0
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        """ Writes data as a chunk of a chunked response. """
+        self.wfile.write("{:X}\r\n".format(len(data)).encode("ASCII"))
+        self.wfile.write(data)
+        self.wfile.write(b"\r\n")
+
+    def _send_empty_response(self, status_code):
+        """ Helper method to return a response without a body. """
+        self.send_response(status_code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class EventStream(object):
+    """ Buffers the events for a single /api/stream subscriber.
+
+    Every subscriber has its own bounded buffer. If a subscriber cannot keep
+    up the stream will be closed instead of holding up other subscribers.
+    """
+
+    def __init__(self, hass, event_types=None, entity_ids=None):
+        self.hass = hass
+        self.event_types = event_types or [MATCH_ALL]
+        self.entity_ids = set(entity_ids) if entity_ids else None
+        self.closed = False
+
+        self._queue = queue.Queue(STREAM_BUFFER_SIZE)
+
+        for event_type in self.event_types:
+            hass.bus.listen(event_type, self._event_listener)
+
+        hass.bus.listen(ha.EVENT_HOMEASSISTANT_STOP, self._stop_listener)
+
+    def get(self, timeout):
+        """ Returns the next event or None if no event arrived in time. """
+        try:
+            return self._queue.get(timeout=timeout)
+
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """ Stops listening for events. """
+        self.closed = True
+
+        for event_type in self.event_types:
+            self.hass.bus.remove_listener(event_type, self._event_listener)
+
+        self.hass.bus.remove_listener(
+            ha.EVENT_HOMEASSISTANT_STOP, self._stop_listener)
+
+        # Wake up the thread writing the stream
+        try:
+            self._queue.put_nowait(None)
+
+        except queue.Full:
+            pass
+
+    def _event_listener(self, event):
+        """ Buffers events that match the entity filter. """
+        if self.closed or not self._matches_entity(event):
+            return
+
+        try:
+            self._queue.put_nowait(event)
+
+        except queue.Full:
+            _LOGGER.warning(
+                "Event stream subscriber is too slow, disconnecting")
+
+            self.close()
+
+    # pylint: disable=unused-argument
+    def _stop_listener(self, event):
+        """ Closes the stream when Home Assistant stops. """
+        self.close()
+
+    def _matches_entity(self, event):
+        """ Returns True if the event is about one of the entities. """
+        if self.entity_ids is None:
+            return True
+
+        entity_id = event.data.get(ATTR_ENTITY_ID)
+
+        if isinstance(entity_id, list):
+            return not self.entity_ids.isdisjoint(entity_id)
+
+        return entity_id in self.entity_ids
+
+
+ROUTES = RouteTable(RequestHandler.PATHS)
@@ -56,7 +56,8 @@ import homeassistant.util as util
 from homeassistant.const import (
     STATE_ON, SERVICE_TURN_ON, SERVICE_TURN_OFF, ATTR_ENTITY_ID)
 from homeassistant.helpers import (
-    extract_entity_ids, platform_devices_from_config)
+    extract_entity_ids, platform_devices_from_config, DeviceUpdater,
+    turn_on_devices, turn_off_devices, update_ha_states)
 from homeassistant.components import group
 
 
@@ -186,13 +187,9 @@ def setup(hass, config):
         light.entity_id = entity_id
         ent_to_light[entity_id] = light
 
-    # pylint: disable=unused-argument
-    def update_lights_state(now):
-        """ Update the states of all the lights. """
-        for light in lights:
-            light.update_ha_state(hass)
+    updater = DeviceUpdater(hass, lights, _LOGGER)
 
-    update_lights_state(None)
+    updater.update(wait=True)
 
     # Track all lights in a group
     group.setup_group(
@@ -219,9 +216,8 @@ def setup(hass, config):
             params[ATTR_TRANSITION] = transition
 
         if service.service == SERVICE_TURN_OFF:
-            for light in lights:
-                # pylint: disable=star-args
-                light.turn_off(**params)
+            # pylint: disable=star-args
+            turn_off_devices(lights, **params)
 
         else:
             # Processing extra data for turn light on request
@@ -277,15 +273,14 @@ def setup(hass, config):
                 elif dat[ATTR_FLASH] == FLASH_LONG:
                     params[ATTR_FLASH] = FLASH_LONG
 
-            for light in lights:
-                # pylint: disable=star-args
-                light.turn_on(**params)
+            # pylint: disable=star-args
+            turn_on_devices(lights, **params)
 
-        for light in lights:
-            light.update_ha_state(hass, True)
+        # Refresh the lights once for the whole batch
+        update_ha_states(hass, lights)
 
     # Update light state every 30 seconds
-    hass.track_time_change(update_lights_state, second=[0, 30])
+    hass.track_time_change(updater.update, second=[0, 30])
 
     # Listen for light on and light off service calls
     hass.services.register(DOMAIN, SERVICE_TURN_ON,
@@ -1,9 +1,9 @@
 """ Support for Hue lights. """
 import logging
 import socket
-from datetime import timedelta
+import threading
+from datetime import datetime, timedelta
 
-import homeassistant.util as util
 from homeassistant.helpers import ToggleDevice
 from homeassistant.const import ATTR_FRIENDLY_NAME, CONF_HOST
 from homeassistant.components.light import (
@@ -15,6 +15,11 @@ MIN_TIME_BETWEEN_FORCED_SCANS = timedelta(seconds=1)
 
 PHUE_CONFIG_FILE = "phue.conf"
 
+# Name of the group on the bridge used to send a command to many lights
+HUE_GROUP_NAME = "Home Assistant"
+
+_LOGGER = logging.getLogger(__name__)
+
 
 def get_devices(hass, config):
     """ Gets the Hue lights. """
@@ -38,90 +43,274 @@ def get_devices(hass, config):
 
         return []
 
-    lights = {}
+    cache = HueBridgeCache(bridge)
+
+    cache.refresh()
+
+    return list(cache.lights.values())
+
+
+def _turn_on_command(kwargs):
+    """ Returns the bridge command to turn lights on. """
+    command = {'on': True}
+
+    if ATTR_TRANSITION in kwargs:
+        # Transition time is in 1/10th seconds and cannot exceed
+        # 900 seconds.
+        command['transitiontime'] = min(9000, kwargs[ATTR_TRANSITION] * 10)
+
+    if ATTR_BRIGHTNESS in kwargs:
+        command['bri'] = kwargs[ATTR_BRIGHTNESS]
+
+    if ATTR_XY_COLOR in kwargs:
+        command['xy'] = kwargs[ATTR_XY_COLOR]
+
+    flash = kwargs.get(ATTR_FLASH)
+
+    if flash == FLASH_LONG:
+        command['alert'] = 'lselect'
+    elif flash == FLASH_SHORT:
+        command['alert'] = 'select'
+    else:
+        command['alert'] = 'none'
+
+    return command
+
+
+def _turn_off_command(kwargs):
+    """ Returns the bridge command to turn lights off. """
+    command = {'on': False}
+
+    if ATTR_TRANSITION in kwargs:
+        # Transition time is in 1/10th seconds and cannot exceed
+        # 900 seconds.
+        command['transitiontime'] = min(9000, kwargs[ATTR_TRANSITION] * 10)
+
+    return command
+
+
+def _has_error(response):
+    """ Returns True if a response from the bridge contains an error. """
+    if isinstance(response, list):
+        return any(_has_error(item) for item in response)
+
+    return isinstance(response, dict) and 'error' in response
+
+
+class HueLightGroup(object):
+    """
+    Sends a command to many lights of a bridge with one request.
+
+    If all lights of the bridge are targeted the built-in group 0 is used.
+    Otherwise a group on the bridge owned by Home Assistant is used of which
+    the lights are only changed when a different set of lights is targeted.
+    """
+
+    def __init__(self, bridge, lights):
+        self.bridge = bridge
+        self.lights = lights
+        self._group_id = None
+        self._group_lights = None
+        self._lock = threading.Lock()
+
+    def set_lights(self, light_ids, command):
+        """ Sends command to the lights with light_ids. """
+        light_ids = sorted(set(light_ids))
+
+        if len(light_ids) == 1:
+            self.bridge.set_light(light_ids[0], command)
+            return
+
+        if light_ids == sorted(int(light_id) for light_id in self.lights):
+            self.bridge.set_group(0, command)
+            return
+
+        with self._lock:
+            if self._set_group_lights(light_ids) and \
+               not _has_error(self.bridge.set_group(self._group_id, command)):
+                return
+
+            # Our group is gone or could not be created
+            self._group_id = None
+
+        self.bridge.set_light(light_ids, command)
+
+    def _set_group_lights(self, light_ids):
+        """ Makes our group contain the lights with light_ids.
+            Returns if successful. Lock should be held. """
+        group_lights = [str(light_id) for light_id in light_ids]
+
+        if self._group_id is None:
+            self._group_id = self._find_group()
+            self._group_lights = None
+
+        if self._group_id is None:
+            response = self.bridge.create_group(HUE_GROUP_NAME, group_lights)
+
+            try:
+                self._group_id = int(response[0]['success']['id'])
+
+            except (IndexError, KeyError, TypeError, ValueError):
+                _LOGGER.warning(
+                    "Unable to create group on the bridge: %s", response)
+                return False
+
+        elif self._group_lights != light_ids:
+            if _has_error(self.bridge.set_group(
+                    self._group_id, 'lights', group_lights)):
+                return False
+
+        self._group_lights = light_ids
+
+        return True
 
-    @util.Throttle(MIN_TIME_BETWEEN_SCANS, MIN_TIME_BETWEEN_FORCED_SCANS)
-    def update_lights():
-        """ Updates the Hue light objects with latest info from the bridge. """
+    def _find_group(self):
+        """ Returns the id of our group created before or None. """
+        groups = self.bridge.get_group()
+
+        if not isinstance(groups, dict):
+            return None
+
+        for group_id, group in groups.items():
+            if isinstance(group, dict) and \
+               group.get('name') == HUE_GROUP_NAME:
+                try:
+                    return int(group_id)
+                except ValueError:
+                    pass
+
+        return None
+
+
+class HueBridgeCache(object):
+    """
+    Keeps the state of all lights of a bridge.
+
+    The state of all lights is fetched with one request, at most once per
+    MIN_TIME_BETWEEN_SCANS or once per MIN_TIME_BETWEEN_FORCED_SCANS when
+    forced. Refreshes requested while a fetch is running wait for that fetch
+    instead of starting another one.
+    """
+
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.lights = {}
+        self.light_group = HueLightGroup(bridge, self.lights)
+        self._fetching = False
+        self._last_fetch = None
+        self._lock = threading.Lock()
+        self._fetched = threading.Condition(self._lock)
+
+    def refresh(self, force=False):
+        """ Fetches the state of the lights if it is outdated. """
+        min_time = MIN_TIME_BETWEEN_FORCED_SCANS if force \
+            else MIN_TIME_BETWEEN_SCANS
+
+        with self._lock:
+            if self._fetching:
+                self._fetched.wait_for(lambda: not self._fetching)
+                return
+
+            if self._last_fetch is not None and \
+               datetime.now() - self._last_fetch < min_time:
+                return
+
+            self._fetching = True
+
+        try:
+            self._fetch()
+
+        finally:
+            with self._lock:
+                self._fetching = False
+                self._last_fetch = datetime.now()
+                self._fetched.notify_all()
+
+    def _fetch(self):
+        """ Fetches the state of all lights from the bridge. """
         try:
-            api = bridge.get_api()
+            api = self.bridge.get_api()
         except socket.error:
             # socket.error when we cannot reach Hue
-            logger.exception("Cannot reach the bridge")
+            _LOGGER.exception("Cannot reach the bridge")
             return
 
         api_states = api.get('lights')
 
         if not isinstance(api_states, dict):
-            logger.error("Got unexpected result from Hue API")
+            _LOGGER.error("Got unexpected result from Hue API")
             return
 
         for light_id, info in api_states.items():
-            if light_id not in lights:
-                lights[light_id] = HueLight(int(light_id), info,
-                                            bridge, update_lights)
+            if light_id in self.lights:
+                self.lights[light_id].set_info(info)
             else:
-                lights[light_id].info = info
-
-    update_lights()
-
-    return list(lights.values())
+                self.lights[light_id] = HueLight(int(light_id), info, self)
 
 
 class HueLight(ToggleDevice):
     """ Represents a Hue light """
 
-    def __init__(self, light_id, info, bridge, update_lights):
+    def __init__(self, light_id, info, cache):
         self.light_id = light_id
         self.info = info
-        self.bridge = bridge
-        self.update_lights = update_lights
+        self.cache = cache
+        self.bridge = cache.bridge
+        self.light_group = cache.light_group
 
-    def get_name(self):
-        """ Get the mame of the Hue light. """
-        return self.info['name']
+        # If the state changed since it was written to Home Assistant
+        self.changed = True
 
-    def turn_on(self, **kwargs):
-        """ Turn the specified or all lights on. """
-        command = {'on': True}
+    def set_info(self, info):
+        """ Stores the latest info about the light from the bridge. """
+        if info.get('state') != self.info.get('state') or \
+           info.get('name') != self.info.get('name'):
+            self.changed = True
+
+        self.info = info
 
-        if ATTR_TRANSITION in kwargs:
-            # Transition time is in 1/10th seconds and cannot exceed
-            # 900 seconds.
-            command['transitiontime'] = min(9000, kwargs[ATTR_TRANSITION] * 10)
+    @classmethod
+    def turn_on_many(cls, devices, **kwargs):
+        """ Turn a batch of lights on with one command per bridge. """
+        cls._command_many(devices, _turn_on_command(kwargs))
 
-        if ATTR_BRIGHTNESS in kwargs:
-            command['bri'] = kwargs[ATTR_BRIGHTNESS]
+    @classmethod
+    def turn_off_many(cls, devices, **kwargs):
+        """ Turn a batch of lights off with one command per bridge. """
+        cls._command_many(devices, _turn_off_command(kwargs))
 
-        if ATTR_XY_COLOR in kwargs:
-            command['xy'] = kwargs[ATTR_XY_COLOR]
+    @classmethod
+    def update_many(cls, devices):
+        """ Synchronize the state of a batch of lights, once per bridge. """
+        for cache in {device.cache for device in devices}:
+            cache.refresh(True)
 
-        flash = kwargs.get(ATTR_FLASH)
+    @staticmethod
+    def _command_many(devices, command):
+        """ Sends command to devices, grouped per bridge. """
+        light_groups = {}
 
-        if flash == FLASH_LONG:
-            command['alert'] = 'lselect'
-        elif flash == FLASH_SHORT:
-            command['alert'] = 'select'
-        else:
-            command['alert'] = 'none'
+        for device in devices:
+            light_groups.setdefault(device.light_group, []).append(
+                device.light_id)
 
-        self.bridge.set_light(self.light_id, command)
+        for light_group, light_ids in light_groups.items():
+            light_group.set_lights(light_ids, command)
 
-    def turn_off(self, **kwargs):
-        """ Turn the specified or all lights off. """
-        command = {'on': False}
+    def get_name(self):
+        """ Get the mame of the Hue light. """
+        return self.info['name']
 
-        if ATTR_TRANSITION in kwargs:
-            # Transition time is in 1/10th seconds and cannot exceed
-            # 900 seconds.
-            command['transitiontime'] = min(9000, kwargs[ATTR_TRANSITION] * 10)
+    def turn_on(self, **kwargs):
+        """ Turn the specified or all lights on. """
+        self.bridge.set_light(self.light_id, _turn_on_command(kwargs))
 
-        self.bridge.set_light(self.light_id, command)
+    def turn_off(self, **kwargs):
+        """ Turn the specified or all lights off. """
+        self.bridge.set_light(self.light_id, _turn_off_command(kwargs))
 
     def is_on(self):
         """ True if device is on. """
-        self.update_lights()
-
         return self.info['state']['reachable'] and self.info['state']['on']
 
     def get_state_attributes(self):
@@ -138,4 +327,17 @@ class HueLight(ToggleDevice):
 
     def update(self):
         """ Synchronize state with bridge. """
-        self.update_lights(no_throttle=True)
+        self.cache.refresh(True)
+
+    def update_ha_state(self, hass, force_refresh=False):
+        """ Refreshes the state of the bridge and updates Home Assistant if
+            the state of this light changed. """
+        self.cache.refresh(force_refresh)
+
+        if not self.changed and self.entity_id is not None and \
+           hass.states.get(self.entity_id) is not None:
+            return None
+
+        self.changed = False
+
+        return super().update_ha_state(hass)
@@ -0,0 +1,224 @@
+"""
+homeassistant.components.notify
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Sends a Pushbullet note when one of the configured entities changes state.
+
+Notifications are queued and sent from a background thread so that slow
+calls to the Pushbullet API never block the event bus. State changes that
+arrive close together are combined into a single note and only the latest
+state per entity is reported.
+
+Example configuration:
+
+[notify]
+api_keys=API_KEY_1,API_KEY_2
+entity_ids=device_tracker.paulus,light.bowl
+# Optional: do not send notifications between 23:00 and 07:30
+quiet_time_start=23,00
+quiet_time_end=07,30
+"""
+import logging
+import threading
+import queue
+from time import monotonic
+import json
+from collections import OrderedDict
+from datetime import datetime, time
+
+import requests
+
+import homeassistant as ha
+import homeassistant.util as util
+from homeassistant.helpers import validate_config
+
+DOMAIN = "notify"
+DEPENDENCIES = []
+
+CONF_API_KEYS = "api_keys"
+CONF_ENTITY_IDS = "entity_ids"
+CONF_QUIET_TIME_START = "quiet_time_start"
+CONF_QUIET_TIME_END = "quiet_time_end"
+
+PUSHBULLET_PUSH_URL = "https://api.pushbullet.com/v2/pushes"
+
+NOTIFICATION_TITLE = "Home Assistant"
+
+# Maximum number of state changes waiting to be sent
+MAX_QUEUE_SIZE = 100
+
+# Time in seconds to wait for more state changes before sending a note
+BATCH_DELAY = 1
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def setup(hass, config):
+    """ Sets up notifications for the configured entities. """
+    if not validate_config(
+            config, {DOMAIN: [CONF_API_KEYS, CONF_ENTITY_IDS]}, _LOGGER):
+        return False
+
+    api_keys = config[DOMAIN][CONF_API_KEYS].split(",")
+    entity_ids = config[DOMAIN][CONF_ENTITY_IDS].split(",")
+
+    quiet_time = None
+
+    if CONF_QUIET_TIME_START in config[DOMAIN] and \
+       CONF_QUIET_TIME_END in config[DOMAIN]:
+
+        try:
+            quiet_time = (
+                _parse_time(config[DOMAIN][CONF_QUIET_TIME_START]),
+                _parse_time(config[DOMAIN][CONF_QUIET_TIME_END]))
+
+        except ValueError:
+            _LOGGER.error(
+                "Invalid quiet time specified. Format should be <hour>,<min>")
+
+            return False
+
+    notifier = PushbulletNotifier(requests.Session(), api_keys)
+
+    # pylint: disable=unused-argument
+    def notify_state_change(entity_id, old_state, new_state):
+        """ Queues a notification for a state change. """
+        if quiet_time is None or \
+           not _in_quiet_time(datetime.now().time(), *quiet_time):
+
+            notifier.notify(entity_id, new_state.state)
+
+    hass.states.track_change(entity_ids, notify_state_change)
+
+    hass.bus.listen_once(
+        ha.EVENT_HOMEASSISTANT_STOP, lambda event: notifier.stop())
+
+    return True
+
+
+def _parse_time(time_str):
+    """ Parses a time in the format <hour>,<minute>. """
+    hour, minute = time_str.split(",")
+
+    return time(int(hour), int(minute))
+
+
+def _in_quiet_time(now, start, end):
+    """ Returns True if now falls within the quiet time.
+        Supports quiet times that span midnight. """
+    if start <= end:
+        return start < now < end
+    else:
+        return now > start or now < end
+
+
+def _format_state(entity_id, state):
+    """ Formats a state change as a human readable line. """
+    domain, object_id = util.split_entity_id(entity_id)
+
+    return "{}: {} is {}".format(
+        domain.replace("_", " ").title(),
+        object_id.replace("_", " ").title(),
+        state.replace("_", " ").title())
+
+
+class PushbulletNotifier(threading.Thread):
+    """ Sends queued notifications to Pushbullet from a background thread.
+        All notes are sent using the same HTTP session. """
+
+    def __init__(self, session, api_keys):
+        super().__init__(daemon=True)
+
+        self.session = session
+        self.api_keys = api_keys
+
+        self._queue = queue.Queue(MAX_QUEUE_SIZE)
+        self._quit_task = object()
+
+        self.start()
+
+    def notify(self, entity_id, state):
+        """ Queues a notification that entity_id changed to state. """
+        try:
+            self._queue.put_nowait((entity_id, state))
+
+        except queue.Full:
+            _LOGGER.warning(
+                "Notification queue is full, dropping notification for %s",
+                entity_id)
+
+    def stop(self):
+        """ Stops the notifier after sending the queued notifications.
+            If the queue is full the oldest notification is dropped to make
+            room, so stopping never blocks. """
+        while True:
+            try:
+                self._queue.put_nowait(self._quit_task)
+                return
+
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        """ Waits for notifications and sends them in batches. """
+        while True:
+            item = self._queue.get()
+
+            if item is self._quit_task:
+                return
+
+            # Collect more state changes that come in within BATCH_DELAY.
+            # Only the latest state per entity will be reported.
+            pending = OrderedDict([item])
+            running = True
+            deadline = monotonic() + BATCH_DELAY
+
+            try:
+                while True:
+                    remaining = deadline - monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    item = self._queue.get(timeout=remaining)
+
+                    if item is self._quit_task:
+                        running = False
+                        break
+
+                    entity_id, state = item
+
+                    pending.pop(entity_id, None)
+                    pending[entity_id] = state
+
+            except queue.Empty:
+                pass
+
+            self._send("\n".join(
+                _format_state(entity_id, state)
+                for entity_id, state in pending.items()))
+
+            if not running:
+                return
+
+    def _send(self, body):
+        """ Sends a note to every configured api key. """
+        data = json.dumps({'type': 'note',
+                           'title': NOTIFICATION_TITLE,
+                           'body': body})
+
+        for api_key in self.api_keys:
+            try:
+                req = self.session.post(
+                    PUSHBULLET_PUSH_URL, data=data, auth=(api_key, ''),
+                    headers={'Content-Type': 'application/json'}, timeout=10)
+
+                if req.status_code != 200:
+                    _LOGGER.error("Error sending notification: %d - %s",
+                                  req.status_code, req.text)
+
+            except requests.exceptions.RequestException:
+                _LOGGER.exception("Error sending notification")
@@ -10,7 +10,7 @@ import homeassistant.util as util
 from homeassistant.const import (
     STATE_ON, SERVICE_TURN_ON, SERVICE_TURN_OFF, ATTR_ENTITY_ID)
 from homeassistant.helpers import (
-    extract_entity_ids, platform_devices_from_config)
+    extract_entity_ids, platform_devices_from_config, DeviceUpdater)
 from homeassistant.components import group
 
 DOMAIN = 'switch'
@@ -94,17 +94,18 @@ def setup(hass, config):
         switch.entity_id = entity_id
         ent_to_switch[entity_id] = switch
 
+    updater = DeviceUpdater(hass, switches, logger)
+
     # pylint: disable=unused-argument
     @util.Throttle(MIN_TIME_BETWEEN_SCANS)
-    def update_states(now):
+    def update_states(now, wait=False):
         """ Update states of all switches. """
 
         logger.info("Updating switch states")
 
-        for switch in switches:
-            switch.update_ha_state(hass)
+        updater.update(wait=wait)
 
-    update_states(None)
+    update_states(None, wait=True)
 
     def handle_switch_service(service):
         """ Handles calls to the switch services. """
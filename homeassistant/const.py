@@ -15,12 +15,16 @@ CONF_HOSTS = "hosts"
 CONF_USERNAME = "username"
 CONF_PASSWORD = "password"
 
+# Run listeners and services on an asyncio event loop
+CONF_USE_ASYNCIO = "use_asyncio"
+
 # #### EVENTS ####
 EVENT_HOMEASSISTANT_START = "homeassistant_start"
 EVENT_HOMEASSISTANT_STOP = "homeassistant_stop"
 EVENT_STATE_CHANGED = "state_changed"
 EVENT_TIME_CHANGED = "time_changed"
 EVENT_CALL_SERVICE = "services.call"
+EVENT_SERVICE_EXECUTED = "service_executed"
 
 # #### STATES ####
 STATE_ON = 'on'
@@ -37,6 +41,9 @@ ATTR_NOW = "now"
 ATTR_DOMAIN = "domain"
 ATTR_SERVICE = "service"
 
+# Identifies a blocking service call, used to report it has been executed
+ATTR_SERVICE_CALL_ID = "service_call_id"
+
 # Contains one string or a list of strings, each being an entity id
 ATTR_ENTITY_ID = 'entity_id'
 
@@ -85,6 +92,8 @@ URL_API_STATES = "/api/states"
 URL_API_STATES_ENTITY = "/api/states/{}"
 URL_API_EVENTS = "/api/events"
 URL_API_EVENTS_EVENT = "/api/events/{}"
+URL_API_EVENTS_BULK = "/api/events/_bulk"
 URL_API_SERVICES = "/api/services"
 URL_API_SERVICES_SERVICE = "/api/services/{}/{}"
 URL_API_EVENT_FORWARD = "/api/event_forwarding"
+URL_API_STREAM = "/api/stream"
@@ -1,9 +1,19 @@
 """
 Helper methods for components within Home Assistant.
 """
+import threading
+import time
+
 from homeassistant.loader import get_component
 from homeassistant.const import (
     ATTR_ENTITY_ID, STATE_ON, STATE_OFF, CONF_PLATFORM, CONF_TYPE)
+import homeassistant.util as util
+
+# Number of devices of one platform that are updated at the same time
+DEVICE_UPDATE_CONCURRENCY = 4
+
+# Seconds after which an update of a device is considered to hang
+DEVICE_UPDATE_TIMEOUT = 10
 
 
 def extract_entity_ids(hass, service):
@@ -11,8 +21,6 @@ def extract_entity_ids(hass, service):
     Helper method to extract a list of entity ids from a service call.
     Will convert group entity ids to the entity ids it represents.
     """
-    entity_ids = []
-
     if service.data and ATTR_ENTITY_ID in service.data:
         group = get_component('group')
 
@@ -23,12 +31,10 @@ def extract_entity_ids(hass, service):
         else:
             ent_ids = [service_ent_id]
 
-        entity_ids.extend(
-            ent_id for ent_id
-            in group.expand_entity_ids(hass, ent_ids)
-            if ent_id not in entity_ids)
+        # Expansions are cached and returned without duplicates
+        return group.expand_entity_ids(hass, ent_ids)
 
-    return entity_ids
+    return []
 
 
 def validate_config(config, items, logger):
@@ -126,12 +132,67 @@ def platform_devices_from_config(config, domain, hass, logger):
     return devices
 
 
+def _group_by_type(devices):
+    """ Returns a dict mapping device type -> list of devices of that type. """
+    grouped = {}
+
+    for device in devices:
+        grouped.setdefault(type(device), []).append(device)
+
+    return grouped
+
+
+def turn_on_devices(devices, **kwargs):
+    """ Turns devices on with one batch call per device type. """
+    for device_type, typed_devices in _group_by_type(devices).items():
+        # pylint: disable=star-args
+        device_type.turn_on_many(typed_devices, **kwargs)
+
+
+def turn_off_devices(devices, **kwargs):
+    """ Turns devices off with one batch call per device type. """
+    for device_type, typed_devices in _group_by_type(devices).items():
+        # pylint: disable=star-args
+        device_type.turn_off_many(typed_devices, **kwargs)
+
+
+def update_ha_states(hass, devices):
+    """ Updates devices with one batch call per device type and updates
+        Home Assistant with their current state. """
+    for device_type, typed_devices in _group_by_type(devices).items():
+        device_type.update_many(typed_devices)
+
+    for device in devices:
+        device.update_ha_state(hass)
+
+
 class ToggleDevice(object):
-    """ ABC for devices that can be turned on and off. """
+    """ ABC for devices that can be turned on and off.
+
+    Platforms that can control many devices with one command can override
+    turn_on_many, turn_off_many and update_many. """
     # pylint: disable=no-self-use
 
     entity_id = None
 
+    @classmethod
+    def turn_on_many(cls, devices, **kwargs):
+        """ Turn a batch of devices of this type on. """
+        for device in devices:
+            device.turn_on(**kwargs)
+
+    @classmethod
+    def turn_off_many(cls, devices, **kwargs):
+        """ Turn a batch of devices of this type off. """
+        for device in devices:
+            device.turn_off(**kwargs)
+
+    @classmethod
+    def update_many(cls, devices):
+        """ Retrieve latest state of a batch of devices of this type. """
+        for device in devices:
+            device.update()
+
     def get_name(self):
         """ Returns the name of the device if any. """
         return None
@@ -172,3 +233,107 @@ class ToggleDevice(object):
 
         return hass.states.set(self.entity_id, state,
                                self.get_state_attributes())
+
+
+class DeviceUpdater(object):
+    """
+    Updates the state of devices concurrently.
+
+    Every platform gets its own thread pool so a slow platform does not hold
+    up the others and at most max_concurrent devices of a platform are
+    polled at the same time. Devices that are still being updated from a
+    previous call are skipped. Updates that run longer than timeout seconds
+    are reported and their platform gets an extra worker till they finish,
+    so a hanging device does not take up one of its slots.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, hass, devices, logger,
+                 max_concurrent=DEVICE_UPDATE_CONCURRENCY,
+                 timeout=DEVICE_UPDATE_TIMEOUT):
+        self.hass = hass
+        self.logger = logger
+        self.timeout = timeout
+
+        # Dict mapping id of a device -> None if queued, else time started
+        self._updating = {}
+        # Ids of devices reported to hang
+        self._hanging = set()
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+
+        # Workers are only started when devices are updated and quit when
+        # idle so the pools do not have to be stopped.
+        pools = {}
+        self._devices = []
+        # Dict mapping id of a device -> pool of its platform
+        self._pools = {}
+
+        for device in devices:
+            platform = type(device).__module__
+
+            if platform not in pools:
+                pools[platform] = util.ThreadPool(
+                    0, self._update_device, max_worker_count=max_concurrent)
+
+            self._devices.append((device, pools[platform]))
+            self._pools[id(device)] = pools[platform]
+
+    def update(self, now=None, wait=False):
+        """ Starts updating all devices that are not being updated.
+            If wait is True, blocks till these updates are done or till
+            timeout seconds have passed. """
+        # pylint: disable=unused-argument
+        started = []
+        current = time.monotonic()
+
+        with self._lock:
+            # Replace hanging workers before queueing the new updates
+            for device, pool in self._devices:
+                key = id(device)
+                time_started = self._updating.get(key)
+
+                if time_started is not None and key not in self._hanging \
+                   and current - time_started > self.timeout:
+                    self._hanging.add(key)
+                    pool.set_max_worker_count(pool.max_worker_count + 1)
+                    self.logger.warning(
+                        "Update of %s did not finish within %d seconds",
+                        device.entity_id, self.timeout)
+
+            for device, pool in self._devices:
+                key = id(device)
+
+                if key not in self._updating:
+                    self._updating[key] = None
+                    pool.add_job(0, device)
+                    started.append(key)
+
+            if wait:
+                self._updated.wait_for(
+                    lambda: not any(key in self._updating for key in started),
+                    self.timeout)
+
+    def _update_device(self, device):
+        """ Updates a device. Called from a worker of its platform. """
+        key = id(device)
+
+        with self._lock:
+            self._updating[key] = time.monotonic()
+
+        try:
+            device.update_ha_state(self.hass)
+
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Error updating %s", device.entity_id)
+
+        finally:
+            with self._lock:
+                del self._updating[key]
+
+                if key in self._hanging:
+                    self._hanging.remove(key)
+                    pool = self._pools[key]
+                    pool.set_max_worker_count(pool.max_worker_count - 1)
+
+                self._updated.notify_all()
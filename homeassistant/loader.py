@@ -137,8 +137,7 @@ def get_component(comp_name):
                 ("Error loading %s. Make sure all "
                  "dependencies are installed"), path)
 
-    if comp_name != "pushbullet":
-        _LOGGER.error("Unable to find component %s", comp_name)
+    _LOGGER.error("Unable to find component %s", comp_name)
 
     return None
 
@@ -13,21 +13,42 @@ import threading
 import logging
 import json
 import enum
+import time
 import urllib.parse
+import datetime as dt
+from collections import deque
 
 import requests
 
 import homeassistant as ha
+import homeassistant.util as util
 
 from homeassistant.const import (
     SERVER_PORT, AUTH_HEADER, URL_API, URL_API_STATES, URL_API_STATES_ENTITY,
-    URL_API_EVENTS, URL_API_EVENTS_EVENT, URL_API_SERVICES,
-    URL_API_SERVICES_SERVICE, URL_API_EVENT_FORWARD)
+    URL_API_EVENTS, URL_API_EVENTS_EVENT, URL_API_EVENTS_BULK,
+    URL_API_SERVICES, URL_API_SERVICES_SERVICE, URL_API_EVENT_FORWARD)
 
 METHOD_GET = "get"
 METHOD_POST = "post"
 METHOD_DELETE = "delete"
 
+# Maximum number of events sent to a forwarding target in one request
+FORWARD_BATCH_SIZE = 100
+
+# Maximum number of events waiting to be forwarded per target.
+# The oldest events are dropped when a target falls further behind.
+FORWARD_MAX_PENDING = 1000
+
+# Seconds to wait before retrying a failed forward, doubles on each failure
+FORWARD_RETRY_DELAY = 1
+FORWARD_MAX_RETRY_DELAY = 300
+
+# Status code of an API without the bulk events endpoint
+HTTP_NOT_FOUND = 404
+
+# Seconds between syncs of the states mirrored from the remote instance
+STATE_SYNC_INTERVAL = 60
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -63,20 +84,26 @@ class API(object):
 
         return self.status == APIStatus.OK
 
-    def __call__(self, method, path, data=None):
-        """ Makes a call to the Home Assistant api. """
+    # pylint: disable=too-many-arguments
+    def __call__(self, method, path, data=None, session=None, timeout=5):
+        """ Makes a call to the Home Assistant api. Uses the shared
+            keep-alive session of the host unless a requests.Session is
+            passed in. timeout is passed on to requests. """
         if data is not None:
             data = json.dumps(data, cls=JSONEncoder)
 
         url = urllib.parse.urljoin(self.base_url, path)
 
+        requester = session or util.HTTP_SESSIONS.session(self.base_url)
+
         try:
             if method == METHOD_GET:
-                return requests.get(
-                    url, params=data, timeout=5, headers=self._headers)
+                return requester.get(
+                    url, params=data, timeout=timeout, headers=self._headers)
             else:
-                return requests.request(
-                    method, url, data=data, timeout=5, headers=self._headers)
+                return requester.request(
+                    method, url, data=data, timeout=timeout,
+                    headers=self._headers)
 
         except requests.exceptions.ConnectionError:
             _LOGGER.exception("Error connecting to server")
@@ -106,10 +133,12 @@ class HomeAssistant(ha.HomeAssistant):
         self.local_api = local_api
 
         self._pool = pool = ha.create_worker_pool()
+        self.loop = None
 
         self.bus = EventBus(remote_api, pool)
         self.services = ha.ServiceRegistry(self.bus, pool)
         self.states = StateMachine(self.bus, self.remote_api)
+        self.scheduler = ha.Scheduler(self.bus, pool)
 
     def start(self):
         # If there is no local API setup but we do want to connect with remote
@@ -136,6 +165,19 @@ class HomeAssistant(ha.HomeAssistant):
                 'Could not setup event forwarding from api {} to '
                 'local api {}').format(self.remote_api, self.local_api))
 
+        self.track_point_in_time(
+            self._sync_states,
+            dt.datetime.now() + dt.timedelta(seconds=STATE_SYNC_INTERVAL))
+
+    def _sync_states(self, now):
+        """ Syncs the mirrored states and schedules the next sync.
+            Recovers from state changes that did not get forwarded. """
+        self.states.sync()
+
+        self.track_point_in_time(
+            self._sync_states,
+            now + dt.timedelta(seconds=STATE_SYNC_INTERVAL))
+
     def stop(self):
         """ Stops Home Assistant and shuts down all threads. """
         _LOGGER.info("Stopping")
@@ -156,8 +198,8 @@ class EventBus(ha.EventBus):
     """ EventBus implementation that forwards fire_event to remote API. """
     # pylint: disable=too-few-public-methods
 
-    def __init__(self, api, config, pool=None):
-        super().__init__(config, pool)
+    def __init__(self, api, pool=None):
+        super().__init__(pool)
         self._api = api
 
     def fire(self, event_type, event_data=None, origin=ha.EventOrigin.local):
@@ -174,7 +216,12 @@ class EventBus(ha.EventBus):
 
 
 class EventForwarder(object):
-    """ Listens for events and forwards to specified APIs. """
+    """ Listens for events and forwards to specified APIs.
+
+    Every target has its own queue of events which are sent in batches.
+    Only one batch per target is in flight so a slow target will not hold
+    up forwarding to the other targets.
+    """
 
     def __init__(self, hass, restrict_origin=None):
         self.hass = hass
@@ -186,6 +233,15 @@ class EventForwarder(object):
 
         self._lock = threading.Lock()
 
+    @property
+    def stats(self):
+        """ Dict with forwarding statistics per target host:port. """
+        with self._lock:
+            targets = list(self._targets.items())
+
+        return {"{}:{}".format(*key): target.stats
+                for key, target in targets}
+
     def connect(self, api):
         """
         Attach to a HA instance and forward events.
@@ -199,32 +255,203 @@ class EventForwarder(object):
 
             key = (api.host, api.port)
 
-            self._targets[key] = api
+            old_target = self._targets.get(key)
+
+            if old_target:
+                old_target.stop()
+
+            self._targets[key] = ForwardTarget(self.hass, api)
 
     def disconnect(self, api):
         """ Removes target from being forwarded to. """
         with self._lock:
             key = (api.host, api.port)
 
-            did_remove = self._targets.pop(key, None) is None
+            target = self._targets.pop(key, None)
+
+            if target:
+                target.stop()
 
             if len(self._targets) == 0:
                 # Remove event listener if no forwarding targets present
                 self.hass.bus.remove_listener(ha.MATCH_ALL,
                                               self._event_listener)
 
-            return did_remove
+            return target is not None
 
     def _event_listener(self, event):
         """ Listen and forwards all events. """
+        # We don't forward time events or, if enabled, non-local events
+        if event.event_type == ha.EVENT_TIME_CHANGED or \
+           (self.restrict_origin and event.origin != self.restrict_origin):
+            return
+
         with self._lock:
-            # We don't forward time events or, if enabled, non-local events
-            if event.event_type == ha.EVENT_TIME_CHANGED or \
-               (self.restrict_origin and event.origin != self.restrict_origin):
+            targets = list(self._targets.values())
+
+        for target in targets:
+            target.add(event)
+
+
+class ForwardTarget(object):
+    """ Queues events for a single API and sends them in batches.
+
+    Failed batches are retried with an exponential backoff. If the queue
+    grows beyond FORWARD_MAX_PENDING the oldest events are dropped. Targets
+    running an API without the bulk endpoint get the events one at a time.
+    """
+
+    def __init__(self, hass, api):
+        self.hass = hass
+        self.api = api
+        self.session = requests.Session()
+
+        self.forwarded = 0
+        self.dropped = 0
+
+        # Contains tuples (time added, event)
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._sending = False
+        self._stopped = False
+        self._retry_delay = 0
+        # If the target has no bulk endpoint
+        self._no_bulk = False
+
+    @property
+    def stats(self):
+        """ Dict with statistics for this target.
+            Lag is the age in seconds of the oldest unsent event. """
+        with self._lock:
+            oldest = self._queue[0][0] if self._queue else None
+
+            return {
+                'pending': len(self._queue),
+                'forwarded': self.forwarded,
+                'dropped': self.dropped,
+                'retry_delay': self._retry_delay,
+                'lag': 0 if oldest is None else time.monotonic() - oldest
+            }
+
+    def add(self, event):
+        """ Queues an event to be forwarded. """
+        with self._lock:
+            if self._stopped:
                 return
 
-            for api in self._targets.values():
-                fire_event(api, event.event_type, event.data)
+            self._queue.append((time.monotonic(), event))
+            self._trim_queue()
+
+            if self._sending:
+                return
+
+            self._sending = True
+
+        # pylint: disable=protected-access
+        self.hass._pool.add_job(
+            ha.JobPriority.EVENT_DEFAULT, (self._send, None))
+
+    def stop(self):
+        """ Stops forwarding and drops the queued events. """
+        with self._lock:
+            self._stopped = True
+            self._queue.clear()
+
+        self.session.close()
+
+    # pylint: disable=unused-argument
+    def _send(self, now):
+        """ Sends batches till the queue is empty or a send fails. """
+        while True:
+            with self._lock:
+                if self._stopped or not self._queue:
+                    self._sending = False
+                    return
+
+                batch = [self._queue.popleft() for _ in range(
+                    min(FORWARD_BATCH_SIZE, len(self._queue)))]
+
+            sent = self._post([event for _, event in batch])
+
+            with self._lock:
+                self.forwarded += sent
+
+                if sent == len(batch):
+                    self._retry_delay = 0
+                    continue
+
+                # Put the rest of the batch back in front and try again later
+                self._queue.extendleft(reversed(batch[sent:]))
+                self._trim_queue()
+
+                self._retry_delay = min(
+                    self._retry_delay * 2 or FORWARD_RETRY_DELAY,
+                    FORWARD_MAX_RETRY_DELAY)
+
+                retry_at = dt.datetime.now() + \
+                    dt.timedelta(seconds=self._retry_delay)
+
+            self.hass.track_point_in_time(self._send, retry_at)
+
+            return
+
+    def _post(self, events):
+        """ Posts events to the bulk endpoint. Returns the number of events
+            that were sent. """
+        if self._no_bulk:
+            return self._post_each(events)
+
+        try:
+            req = self.api(METHOD_POST, URL_API_EVENTS_BULK,
+                           {'events': events}, session=self.session)
+
+            if req.status_code == 200:
+                return len(events)
+
+            elif req.status_code == HTTP_NOT_FOUND:
+                _LOGGER.info("%s has no bulk endpoint, forwarding events "
+                             "one at a time", self.api.host)
+
+                self._no_bulk = True
+
+                return self._post_each(events)
+
+            _LOGGER.error("Error forwarding events to %s: %d - %s",
+                          self.api.host, req.status_code, req.text)
+
+        except ha.HomeAssistantError:
+            # Already logged by API
+            pass
+
+        return 0
+
+    def _post_each(self, events):
+        """ Posts events one at a time. Returns the number of events that
+            were sent. """
+        for sent, event in enumerate(events):
+            try:
+                req = self.api(METHOD_POST,
+                               URL_API_EVENTS_EVENT.format(event.event_type),
+                               event.data, session=self.session)
+
+                if req.status_code != 200:
+                    _LOGGER.error("Error forwarding event to %s: %d - %s",
+                                  self.api.host, req.status_code, req.text)
+
+                    return sent
+
+            except ha.HomeAssistantError:
+                # Already logged by API
+                return sent
+
+        return len(events)
+
+    def _trim_queue(self):
+        """ Drops the oldest events if too many are queued.
+            Lock should be held. """
+        while len(self._queue) > FORWARD_MAX_PENDING:
+            self._queue.popleft()
+            self.dropped += 1
 
 
 class StateMachine(ha.StateMachine):
@@ -248,12 +475,43 @@ class StateMachine(ha.StateMachine):
 
     def mirror(self):
         """ Discards current data and mirrors the remote state machine. """
-        self._states = {state.entity_id: state for state
-                        in get_states(self._api)}
+        self._version = 0
+
+        self.sync()
+
+    def sync(self):
+        """ Applies the changes since the last sync from the remote API.
+            Returns if successful. """
+        changes = get_state_changes(self._api, self._version)
+
+        if changes is None:
+            return False
+
+        with self._lock:
+            if changes['full']:
+                self._states = {}
+                self._domains = {}
+
+            for state in changes['states']:
+                self._store(state)
+
+            for entity_id in changes['removed']:
+                self._discard(entity_id)
+
+            self._version = changes['version']
+
+        return True
 
     def _state_changed_listener(self, event):
         """ Listens for state changed events and applies them. """
-        self._states[event.data['entity_id']] = event.data['new_state']
+        new_state = event.data['new_state']
+
+        with self._lock:
+            old_state = self._states.get(new_state.entity_id)
+
+            # Ignore events that arrive after a sync got a newer state
+            if old_state is None or old_state.version <= new_state.version:
+                self._store(new_state)
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -263,11 +521,58 @@ class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         """ Converts Home Assistant objects and hands
             other objects to the original method. """
-        if isinstance(obj, ha.State):
+        if isinstance(obj, (ha.State, ha.Event)):
             return obj.as_dict()
 
         return json.JSONEncoder.default(self, obj)
 
+    def iterencode(self, o, _one_shot=False):
+        """ Encodes o in chunks. Unless indenting or sorting keys, states
+            are inserted using their cached JSON. """
+        if self.indent is not None or self.sort_keys:
+            return super().iterencode(o, _one_shot)
+
+        return self._iterencode_cached(o)
+
+    def _iterencode_cached(self, obj):
+        """ Yields the JSON for obj using the cached JSON of states. """
+        if isinstance(obj, ha.State):
+            yield obj.as_json()
+
+        elif isinstance(obj, ha.Event):
+            yield from self._iterencode_cached(obj.as_dict())
+
+        elif isinstance(obj, (list, tuple)):
+            yield '['
+
+            for index, item in enumerate(obj):
+                if index:
+                    yield self.item_separator
+
+                yield from self._iterencode_cached(item)
+
+            yield ']'
+
+        elif isinstance(obj, dict):
+            yield '{'
+
+            for index, (key, value) in enumerate(obj.items()):
+                if index:
+                    yield self.item_separator
+
+                if not isinstance(key, str):
+                    # Converts keys like True and 1 the same way json does
+                    key = json.dumps(key)
+
+                yield json.dumps(key)
+                yield self.key_separator
+                yield from self._iterencode_cached(value)
+
+            yield '}'
+
+        else:
+            yield from super().iterencode(obj, True)
+
 
 def validate_api(api):
     """ Makes a call to validate API. """
@@ -401,6 +706,34 @@ def get_states(api):
         return []
 
 
+def get_state_changes(api, version):
+    """ Queries given API for the state changes after version.
+        Returns a dict like ha.StateMachine.changes_since or None on error. """
+
+    try:
+        req = api(METHOD_GET,
+                  "{}?since={}".format(URL_API_STATES, version))
+
+        data = req.json()
+
+        # Instances that do not support since return a list of all states
+        if isinstance(data, list):
+            data = {'version': 0, 'full': True, 'states': data,
+                    'removed': []}
+
+        data['states'] = [ha.State.from_dict(item)
+                          for item in data['states']]
+
+        return data
+
+    except (ha.HomeAssistantError, ValueError, AttributeError, KeyError,
+            TypeError):
+        # ValueError if req.json() can't parse the json
+        _LOGGER.exception("Error fetching state changes")
+
+        return None
+
+
 def set_state(api, entity_id, new_state, attributes=None):
     """
     Tells API to update state for entity_id.
@@ -454,16 +787,44 @@ def get_services(api):
         return {}
 
 
-def call_service(api, domain, service, service_data=None):
-    """ Calls a service at the remote API. """
-    try:
-        req = api(METHOD_POST,
-                  URL_API_SERVICES_SERVICE.format(domain, service),
-                  service_data)
+def call_service(api, domain, service, service_data=None, blocking=False):
+    """ Calls a service at the remote API. Returns if the call succeeded.
+        If blocking, returns when the service has been executed and raises
+        ServiceCallTimeoutError if it did not finish in time or
+        HomeAssistantError if the call failed. """
+    url = URL_API_SERVICES_SERVICE.format(domain, service)
+    timeout = 5
 
-        if req.status_code != 200:
-            _LOGGER.error("Error calling service: %d - %s",
-                          req.status_code, req.text)
+    if blocking:
+        url += "?wait=1"
+        # Give the server time to answer that the service timed out
+        timeout = (5, ha.SERVICE_CALL_LIMIT + 5)
+
+    try:
+        req = api(METHOD_POST, url, service_data, timeout=timeout)
 
     except ha.HomeAssistantError:
         _LOGGER.exception("Error calling service")
+
+        if blocking:
+            raise
+
+        return False
+
+    if req.status_code == 200:
+        return True
+
+    _LOGGER.error("Error calling service: %d - %s",
+                  req.status_code, req.text)
+
+    if not blocking:
+        return False
+
+    elif req.status_code == 504:
+        raise ha.ServiceCallTimeoutError(
+            "Service {}/{} did not finish in time".format(domain, service))
+
+    else:
+        raise ha.HomeAssistantError(
+            "Error calling service {}/{}: {}".format(
+                domain, service, req.status_code))
@@ -7,19 +7,43 @@ Helper methods for various modules.
 import collections
 from itertools import chain
 import threading
-import queue
+import asyncio
+import concurrent.futures
+import time
 from datetime import datetime
+import types
+from types import MappingProxyType
 import re
 import enum
 import socket
+import urllib.parse
 from functools import wraps
 
+import requests
+
 RE_SANITIZE_FILENAME = re.compile(r'(~|\.\.|/|\\)')
 RE_SANITIZE_PATH = re.compile(r'(~|\.(\.)+)')
 RE_SLUGIFY = re.compile(r'[^A-Za-z0-9_]+')
 
 DATE_STR_FORMAT = "%H:%M:%S %d-%m-%Y"
 
+# Number of pending jobs after which the ThreadPool applies backpressure
+POOL_MAX_PENDING_JOBS = 1000
+
+# Max seconds add_job will block the caller if the ThreadPool is too busy
+POOL_BACKPRESSURE_TIMEOUT = 5
+
+# Seconds after which an extra worker of the ThreadPool quits if idle
+POOL_WORKER_IDLE_TIMEOUT = 60
+
+# Seconds to wait for connecting to and for data from a host over HTTP
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 10
+
+# HTTP status codes that can make HTTPSessionPool authenticate again
+HTTP_UNAUTHORIZED = 401
+HTTP_FORBIDDEN = 403
+
 
 def sanitize_filename(filename):
     """ Sanitizes a filename by removing .. / and \\. """
@@ -64,7 +88,7 @@ def split_entity_id(entity_id):
 
 def repr_helper(inp):
     """ Helps creating a more readable string representation of objects. """
-    if isinstance(inp, dict):
+    if isinstance(inp, (dict, MappingProxyType)):
         return ", ".join(
             repr_helper(key)+"="+repr_helper(item) for key, item
             in inp.items())
@@ -127,7 +151,7 @@ def ensure_unique_string(preferred_string, current_strings):
     """ Returns a string that is not present in current_strings.
         If preferred string exists will append _2, _3, .. """
     string = preferred_string
-    current_strings = list(current_strings)
+    current_strings = set(current_strings)
 
     tries = 1
 
@@ -300,6 +324,69 @@ class Throttle(object):
         return wrapper
 
 
+class HTTPSessionPool(object):
+    """
+    Keeps a keep-alive requests.Session per host so polling a host reuses an
+    open connection instead of connecting for every request.
+
+    If a request is answered with one of the reauthenticate_on statuses,
+    401 by default, and a reauthenticate function is given it is called to
+    authenticate again. It returns a dict with the keyword arguments to
+    update the request with, or None if it failed. The request is then
+    retried once.
+    """
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                 session_factory=requests.Session):
+        self.timeout = timeout
+        self._session_factory = session_factory
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        """ Returns the session for the host of url. """
+        parsed = urllib.parse.urlsplit(url)
+        host = (parsed.scheme, parsed.netloc)
+
+        with self._lock:
+            session = self._sessions.get(host)
+
+            if session is None:
+                session = self._sessions[host] = self._session_factory()
+
+            return session
+
+    def request(self, method, url, reauthenticate=None,
+                reauthenticate_on=(HTTP_UNAUTHORIZED,), **kwargs):
+        """ Makes a request using the session of the host of url. """
+        kwargs.setdefault('timeout', self.timeout)
+
+        session = self.session(url)
+        response = session.request(method, url, **kwargs)
+
+        if response.status_code in reauthenticate_on and \
+           reauthenticate is not None:
+            update = reauthenticate()
+
+            if update is not None:
+                kwargs.update(update)
+                response = session.request(method, url, **kwargs)
+
+        return response
+
+    def close(self):
+        """ Closes the connections of all sessions. """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+
+            self._sessions.clear()
+
+
+# Sessions shared by everything that talks to other hosts over HTTP
+HTTP_SESSIONS = HTTPSessionPool()
+
+
 # Reason why I decided to roll my own ThreadPool instead of using
 # multiprocessing.dummy.pool or even better, use multiprocessing.pool and
 # not be hurt by the GIL in the cpython interpreter:
@@ -312,34 +399,86 @@ class Throttle(object):
 #    put that request in a seperate thread. This is for every component to
 #    decide on its own instead of enforcing it for everyone.
 class ThreadPool(object):
-    """ A simple queue-based thread pool.
-
-    Will initiate it's workers using worker(queue).start() """
+    """ A priority based thread pool.
+
+    Jobs are kept in a FIFO queue per priority and jobs with the lowest
+    priority value are handled first. Jobs are never dropped. If too many
+    jobs are pending, add_job will block the caller till there is room or
+    till POOL_BACKPRESSURE_TIMEOUT passed, after which the job is accepted
+    anyway. Jobs added from within a worker are always accepted to prevent
+    dead locks. """
     # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, worker_count, job_handler, busy_callback=None):
+    # pylint: disable=too-many-arguments
+    def __init__(self, worker_count, job_handler, busy_callback=None,
+                 max_worker_count=None, max_pending_jobs=None):
         """
         worker_count: number of threads to run that handle jobs
         job_handler: method to be called from worker thread to handle job
         busy_callback: method to be called when queue gets too big.
                        Parameters: list_of_current_jobs, number_pending_jobs
+        max_worker_count: number of threads the pool is allowed to grow to
+                          when all workers are busy. Defaults to worker_count
+        max_pending_jobs: number of pending jobs after which add_job will
+                          apply backpressure on the caller
         """
-        self.work_queue = work_queue = queue.PriorityQueue()
-        self.current_jobs = current_jobs = []
         self.worker_count = worker_count
+        self.max_worker_count = max(worker_count, max_worker_count or 0)
+        self.max_pending_jobs = max_pending_jobs or POOL_MAX_PENDING_JOBS
+        self.job_handler = job_handler
         self.busy_callback = busy_callback
         self.busy_warning_limit = worker_count**2
-        self._lock = threading.RLock()
-        self._quit_task = object()
+        self.current_jobs = []
+        self.running = True
 
-        for _ in range(worker_count):
-            worker = threading.Thread(target=_threadpool_worker,
-                                      args=(work_queue, current_jobs,
-                                            job_handler, self._quit_task))
-            worker.daemon = True
-            worker.start()
+        # Dict mapping priority -> deque with (time_queued, job)
+        self._queues = {}
+        # Sorted list of the priorities in self._queues
+        self._priorities = []
+        self._pending = 0
+        self._workers = set()
+        self._idle_workers = 0
+        self._busy_reported = False
+        self._spilled = 0
+        # Dict mapping priority -> stats of the handled jobs
+        self._stats = {}
+
+        self._lock = threading.Lock()
+        self._work_available = threading.Condition(self._lock)
+        self._room_available = threading.Condition(self._lock)
+        self._state_changed = threading.Condition(self._lock)
 
-        self.running = True
+        with self._lock:
+            for _ in range(worker_count):
+                self._start_worker()
+
+    @property
+    def metrics(self):
+        """ Returns a dict with metrics about the pool.
+
+        wait_time is the time jobs spent in the queue, run_time is the time
+        it took to handle jobs. Both are in seconds. """
+        with self._lock:
+            return {
+                'worker_count': len(self._workers),
+                'busy_worker_count': len(self.current_jobs),
+                'pending_jobs': self._pending,
+                'spilled_jobs': self._spilled,
+                'priorities': {
+                    priority: {
+                        'pending_jobs': len(self._queues.get(priority, ())),
+                        'handled_jobs': stats['count'],
+                        'wait_time_avg': stats['wait_total'] / stats['count'],
+                        'wait_time_max': stats['wait_max'],
+                        'run_time_avg': stats['run_total'] / stats['count'],
+                        'run_time_max': stats['run_max'],
+                    } if stats['count'] else {
+                        'pending_jobs': len(self._queues.get(priority, ())),
+                        'handled_jobs': 0,
+                    }
+                    for priority, stats in self._stats.items()
+                }
+            }
 
     def add_job(self, priority, job):
         """ Add a job to be sent to the workers. """
@@ -347,77 +486,333 @@ class ThreadPool(object):
             if not self.running:
                 raise RuntimeError("ThreadPool not running")
 
-            # Clear the queue if it's getting too big
-            while self.work_queue.qsize() >= (self.busy_warning_limit + 2):
-                self.work_queue.get()
-                self.work_queue.task_done()
+            if self._pending >= self.max_pending_jobs:
+                # Apply backpressure if the job is not added by a worker
+                if threading.current_thread() not in self._workers:
+                    self._room_available.wait_for(
+                        lambda: (self._pending < self.max_pending_jobs or
+                                 not self.running),
+                        POOL_BACKPRESSURE_TIMEOUT)
+
+                    if not self.running:
+                        raise RuntimeError("ThreadPool not running")
+
+                if self._pending >= self.max_pending_jobs:
+                    self._spilled += 1
+
+            job_queue = self._queues.get(priority)
+
+            if job_queue is None:
+                job_queue = self._queues[priority] = collections.deque()
+                self._priorities = sorted(self._queues)
+                self._stats[priority] = {
+                    'count': 0, 'wait_total': 0, 'wait_max': 0,
+                    'run_total': 0, 'run_max': 0}
+
+            job_queue.append((time.monotonic(), job))
+            self._pending += 1
+
+            # Grow the pool if there are more jobs than idle workers
+            if self._pending > self._idle_workers and \
+               len(self._workers) < self.max_worker_count:
+                self._start_worker()
+            else:
+                self._work_available.notify()
+
+            # Check if our queue is getting too big.
+            # Only report once till the queue is back under the limit.
+            if self._pending <= self.busy_warning_limit or \
+               self._busy_reported or self.busy_callback is None:
+                return
 
-            self.work_queue.put(PriorityQueueItem(priority, job))
+            self._busy_reported = True
+            busy_args = (list(self.current_jobs), self._pending)
 
-            # check if our queue is getting too big
-            if self.work_queue.qsize() > self.busy_warning_limit \
-               and self.busy_callback is not None:
+        self.busy_callback(*busy_args)
 
-                # Increase limit we will issue next warning
-                # self.busy_warning_limit *= 2
+    def set_max_worker_count(self, max_worker_count):
+        """ Changes the number of threads the pool is allowed to grow to and
+            starts workers for pending jobs that now fit. """
+        with self._lock:
+            self.max_worker_count = max(self.worker_count, max_worker_count)
 
-                self.busy_callback(self.current_jobs, self.work_queue.qsize())
+            for _ in range(min(self.max_worker_count - len(self._workers),
+                               self._pending - self._idle_workers)):
+                self._start_worker()
 
     def block_till_done(self):
         """ Blocks till all work is done. """
-        self.work_queue.join()
+        with self._lock:
+            self._state_changed.wait_for(
+                lambda: not self._pending and not self.current_jobs)
 
     def stop(self):
-        """ Stops all the threads. """
+        """ Stops all the threads. Pending jobs are discarded. """
         with self._lock:
             if not self.running:
                 return
 
+            self.running = False
+
             # Clear the queue
-            while self.work_queue.qsize() > 0:
-                self.work_queue.get()
-                self.work_queue.task_done()
+            for job_queue in self._queues.values():
+                job_queue.clear()
+
+            self._pending = 0
+
+            # Tell the workers to quit and wait till they are done
+            self._work_available.notify_all()
+            self._room_available.notify_all()
+
+            current = threading.current_thread()
+
+            self._state_changed.wait_for(
+                lambda: not self._workers - {current})
+
+    def _start_worker(self):
+        """ Starts a new worker. Lock should be held. """
+        worker = threading.Thread(target=self._worker)
+        worker.daemon = True
+        self._workers.add(worker)
+        worker.start()
+
+    def _get_job(self):
+        """ Waits for the next job. Returns None if the worker should quit.
+            Lock should be held. """
+        current = threading.current_thread()
+
+        while self.running and not self._pending:
+            self._idle_workers += 1
+            got_work = self._work_available.wait(POOL_WORKER_IDLE_TIMEOUT)
+            self._idle_workers -= 1
+
+            # Workers that we added to handle a burst quit when idle
+            if not got_work and not self._pending and \
+               len(self._workers) > self.worker_count:
+                break
+
+        if not self.running or not self._pending:
+            self._workers.discard(current)
+            self._state_changed.notify_all()
+            return None
+
+        for priority in self._priorities:
+            job_queue = self._queues[priority]
+
+            if job_queue:
+                time_queued, job = job_queue.popleft()
+                break
+
+        self._pending -= 1
+
+        if self._pending <= self.busy_warning_limit:
+            self._busy_reported = False
+
+        self._room_available.notify()
+
+        return priority, time_queued, job
+
+    def _worker(self):
+        """ Provides the base functionality of a worker for the thread pool.
+        """
+        while True:
+            with self._lock:
+                next_job = self._get_job()
+
+                if next_job is None:
+                    return
+
+                priority, time_queued, job = next_job
+
+                # Add to current running jobs
+                job_log = (datetime.now(), job)
+                self.current_jobs.append(job_log)
+
+            time_started = time.monotonic()
+
+            # Do the job
+            self.job_handler(job)
 
-            # Tell the workers to quit
-            for _ in range(self.worker_count):
-                self.add_job(1000, self._quit_task)
+            time_done = time.monotonic()
+
+            with self._lock:
+                # Remove from current running job
+                self.current_jobs.remove(job_log)
+
+                stats = self._stats[priority]
+                wait_time = time_started - time_queued
+                run_time = time_done - time_started
+
+                stats['count'] += 1
+                stats['wait_total'] += wait_time
+                stats['wait_max'] = max(stats['wait_max'], wait_time)
+                stats['run_total'] += run_time
+                stats['run_max'] = max(stats['run_max'], run_time)
+
+                if not self._pending and not self.current_jobs:
+                    self._state_changed.notify_all()
+
+
+def _coroutine(func):
+    """ Marks a generator function as a coroutine function on Pythons that
+        no longer have asyncio.coroutine. """
+    func = types.coroutine(func)
+    # pylint: disable=protected-access
+    func._is_coroutine = getattr(asyncio.coroutines, '_is_coroutine', None)
+
+    return func
+
+
+# Decorator for generator based coroutines. Use it with yield from instead
+# of async def and await, which Python 3.4 does not support.
+coroutine = getattr(asyncio, 'coroutine', None) or _coroutine
+
+# Schedules a coroutine as a task. Called asyncio.async before Python 3.4.4.
+ensure_future = getattr(asyncio, 'ensure_future', None) or \
+    getattr(asyncio, 'async')
+
+
+class AsyncioPool(object):
+    """ A pool that handles jobs using an asyncio event loop.
+
+    Offers the same interface as ThreadPool. The event loop runs in its own
+    thread. Jobs for which coroutine_factory returns a coroutine are run as
+    tasks on the event loop, other jobs are passed to job_handler in an
+    executor with worker_count threads. If job_handler returns a coroutine
+    it will be run on the event loop too. """
+    # pylint: disable=too-many-instance-attributes
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, worker_count, job_handler, busy_callback=None,
+                 coroutine_factory=None):
+        """
+        worker_count: number of executor threads for jobs that block
+        job_handler: method to be called from an executor thread to handle
+                     a job. May return a coroutine to run on the loop.
+        busy_callback: method to be called when queue gets too big.
+                       Parameters: list_of_current_jobs, number_pending_jobs
+        coroutine_factory: method to be called on the event loop with a job.
+                           Returns a coroutine to run the job on the loop or
+                           None to run the job in the executor.
+        """
+        self.worker_count = worker_count
+        self.job_handler = job_handler
+        self.busy_callback = busy_callback
+        self.coroutine_factory = coroutine_factory
+        self.busy_warning_limit = worker_count**2
+        self.current_jobs = []
+        self.running = True
+
+        self.loop = asyncio.new_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(worker_count)
+        self._pending = 0
+        self._busy_reported = False
+
+        self._lock = threading.Lock()
+        self._state_changed = threading.Condition(self._lock)
+
+        self._loop_thread = threading.Thread(target=self.loop.run_forever)
+        self._loop_thread.daemon = True
+        self._loop_thread.start()
+
+    @property
+    def metrics(self):
+        """ Returns a dict with metrics about the pool. """
+        with self._lock:
+            return {
+                'worker_count': self.worker_count,
+                'busy_worker_count': len(self.current_jobs),
+                'pending_jobs': self._pending - len(self.current_jobs),
+            }
+
+    def add_job(self, priority, job):
+        """ Add a job to be handled. Priority is ignored, jobs are
+            started in the order they are added. """
+        # pylint: disable=unused-argument
+        with self._lock:
+            if not self.running:
+                raise RuntimeError("AsyncioPool not running")
+
+            self._pending += 1
+
+            self.loop.call_soon_threadsafe(self._start_job, job)
+
+            if self._pending <= self.busy_warning_limit or \
+               self._busy_reported or self.busy_callback is None:
+                return
+
+            self._busy_reported = True
+            busy_args = (list(self.current_jobs), self._pending)
+
+        self.busy_callback(*busy_args)
+
+    def block_till_done(self):
+        """ Blocks till all work is done. """
+        with self._lock:
+            self._state_changed.wait_for(lambda: not self._pending)
+
+    def stop(self):
+        """ Stops the event loop and the executor.
+            Jobs that did not finish yet are discarded. """
+        with self._lock:
+            if not self.running:
+                return
 
             self.running = False
 
-            self.block_till_done()
+        self.loop.call_soon_threadsafe(self.loop.stop)
 
+        if threading.current_thread() is not self._loop_thread:
+            self._loop_thread.join()
 
-class PriorityQueueItem(object):
-    """ Holds a priority and a value. Used within PriorityQueue. """
+        self._executor.shutdown()
 
-    # pylint: disable=too-few-public-methods
-    def __init__(self, priority, item):
-        self.priority = priority
-        self.item = item
+        with self._lock:
+            self._pending = 0
+            self._state_changed.notify_all()
 
-    def __lt__(self, other):
-        return self.priority < other.priority
+    def _start_job(self, job):
+        """ Starts a job. Called from the event loop. """
+        job_log = (datetime.now(), job)
 
+        with self._lock:
+            self.current_jobs.append(job_log)
 
-def _threadpool_worker(work_queue, current_jobs, job_handler, quit_task):
-    """ Provides the base functionality of a worker for the thread pool. """
-    while True:
-        # Get new item from work_queue
-        job = work_queue.get().item
+        coro = self.coroutine_factory(job) if self.coroutine_factory else None
 
-        if job == quit_task:
-            work_queue.task_done()
+        if coro is not None:
+            self._run_coroutine(job_log, coro)
             return
 
-        # Add to current running jobs
-        job_log = (datetime.now(), job)
-        current_jobs.append(job_log)
+        future = self.loop.run_in_executor(
+            self._executor, self.job_handler, job)
+
+        future.add_done_callback(
+            lambda fut: self._executor_job_done(job_log, fut))
+
+    def _executor_job_done(self, job_log, future):
+        """ Called on the event loop when the executor finished a job. """
+        result = None if future.cancelled() else future.result()
+
+        if asyncio.iscoroutine(result):
+            self._run_coroutine(job_log, result)
+        else:
+            self._job_done(job_log)
 
-        # Do the job
-        job_handler(job)
+    def _run_coroutine(self, job_log, coro):
+        """ Runs coroutine as a task for job. Called from the event loop. """
+        task = ensure_future(coro, loop=self.loop)
+
+        task.add_done_callback(lambda task: self._job_done(job_log))
+
+    def _job_done(self, job_log):
+        """ Marks a job as done. """
+        with self._lock:
+            self.current_jobs.remove(job_log)
+            self._pending -= 1
 
-        # Remove from current running job
-        current_jobs.remove(job_log)
+            if self._pending <= self.busy_warning_limit:
+                self._busy_reported = False
 
-        # Tell work_queue a task is done
-        work_queue.task_done()
+            if not self._pending:
+                self._state_changed.notify_all()